@@ -0,0 +1,70 @@
+"""Latency and throughput benchmark for IgdbWrapper against the local stand-in server.
+
+Fires a burst of searches and id lookups at once, as a bulk import would, and reports
+how many of them the rate limited stand-in server rejected.
+
+Usage:
+
+python -m benchmarks.bench_igdb --requests 200 --latency 0.05
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+from cogs.gametags import IgdbWrapper, ItemType
+from benchmarks.fake_igdb import FakeIgdb, start
+
+async def main(args):
+    fake = FakeIgdb(latency=args.latency, rate_limit=args.rate_limit)
+    runner, base_url = await start(fake)
+    igdb = IgdbWrapper('client', 'secret', igdb_url=f"{base_url}/v4/", twitch_url=f"{base_url}/oauth2/token",
+                       pool_size=args.pool_size, cache_size=0, rate_limit=args.rate_limit)
+
+    # measure how late a ticking coroutine gets while the requests are running
+    lag = []
+    async def ticker():
+        while True:
+            before = time.perf_counter()
+            await asyncio.sleep(0.01)
+            lag.append(time.perf_counter() - before - 0.01)
+
+    async def timed(coro):
+        before = time.perf_counter()
+        try:
+            await coro
+        except Exception:
+            return None
+        return time.perf_counter() - before
+
+    def request(i):
+        if i % 2:
+            return igdb.find_item_by_id(ItemType.game, i % 500 + 1)
+        return igdb.find_items_by_name(ItemType.game, f"Fighter {i % 100}")
+
+    ticker_task = asyncio.create_task(ticker())
+    try:
+        before = time.perf_counter()
+        results = await asyncio.gather(*[timed(request(i)) for i in range(args.requests)])
+        elapsed = time.perf_counter() - before
+    finally:
+        ticker_task.cancel()
+        await igdb.close()
+        await runner.cleanup()
+
+    latencies = sorted(latency for latency in results if latency is not None)
+    print(f"lookups: {args.requests}, server latency: {args.latency * 1000:.0f} ms, rate limit: {args.rate_limit}/s")
+    print(f"total: {elapsed:.2f} s, throughput: {len(latencies) / elapsed:.1f} lookups/s, failed: {args.requests - len(latencies)}")
+    if latencies:
+        print(f"latency p50: {statistics.median(latencies) * 1000:.1f} ms, p95: {latencies[int(len(latencies) * 0.95) - 1] * 1000:.1f} ms")
+    print(f"HTTP requests: {fake.requests}, rejected with 429: {fake.rejected}, max concurrent: {fake.max_in_flight}")
+    print(f"coalesced lookups: {igdb.scheduler.coalesced}, token requests: {fake.token_requests}")
+    print(f"max event loop lag: {max(lag, default=0) * 1000:.1f} ms")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--pool-size', type=int, default=8)
+    parser.add_argument('--rate-limit', type=int, default=4)
+    asyncio.run(main(parser.parse_args()))
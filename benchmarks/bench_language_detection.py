@@ -0,0 +1,42 @@
+"""Accuracy and latency of LocalLanguageDetector against a labelled corpus.
+
+Reports how often the detector is confident enough to skip the DetectLanguage API and
+how accurate it is on those texts. The corpus also holds very short texts and texts in languages
+without a profile (e.g. sv or tr), those should stay below the threshold and go to the API.
+
+Usage:
+
+python -m benchmarks.bench_language_detection --threshold 0.95
+"""
+import argparse
+import pathlib
+import time
+
+from cogs.fun import LocalLanguageDetector
+
+CORPUS_PATH = pathlib.Path(__file__).with_name('language_corpus.tsv')
+
+def main(args):
+    corpus = [line.split('\t', 1) for line in CORPUS_PATH.read_text(encoding='utf-8').splitlines() if line]
+    detector = LocalLanguageDetector()
+
+    before = time.perf_counter()
+    results = [detector.detect(text) for _, text in corpus]
+    elapsed = time.perf_counter() - before
+
+    correct = sum(result['language'] == language for (language, _), result in zip(corpus, results))
+    confident = [(language, result) for (language, _), result in zip(corpus, results) if result['confidence'] >= args.threshold]
+    confident_correct = sum(result['language'] == language for language, result in confident)
+
+    print(f"texts: {len(corpus)}, mean latency: {elapsed / len(corpus) * 1000:.3f} ms")
+    print(f"overall accuracy: {correct / len(corpus):.1%}")
+    print(f"answered locally (confidence >= {args.threshold}): {len(confident) / len(corpus):.1%}, "
+          f"accuracy of those: {confident_correct / len(confident) if confident else 0:.1%}")
+    for (language, text), result in zip(corpus, results):
+        if result['language'] != language:
+            print(f"  expected {language}, got {result['language']} ({result['confidence']:.2f}): {text}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--threshold', type=float, default=0.95)
+    main(parser.parse_args())
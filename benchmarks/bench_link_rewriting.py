@@ -0,0 +1,68 @@
+"""Link rewriting throughput in messages per second.
+
+Compares compiling the old twitter-only regex on every message, one precompiled
+regex per rule and the combined LinkRewriter on a synthetic chat log where most
+messages contain no links at all.
+
+Usage:
+
+python -m benchmarks.bench_link_rewriting --messages 100000 --link-ratio 0.05
+"""
+import argparse
+import random
+import re
+import time
+
+from link_rewriter import DEFAULT_RULES, LinkRewriter
+
+LINKS = [
+    "https://x.com/Test_Account/status/1935493771721517678?t=YhMjRFnyI_Y_cPdrA9zIoA&s=19",
+    "https://www.instagram.com/reel/C8abc-12/?igsh=xyz",
+    "https://www.tiktok.com/@some.user/video/7380000000000000000",
+    "https://old.reddit.com/r/Guiltygear/comments/1abcde/title/",
+    "https://bsky.app/profile/someone.bsky.social/post/3kabc",
+    "https://www.youtube.com/watch?v=dQw4w9WgXcQ",
+    "https://vxtwitter.com/test/status/123",
+]
+WORDS = "gg wp anyone up for some sets tonight lobby is open ggst tekken when is the next local".split()
+
+def generate_messages(count, link_ratio, seed=0):
+    rng = random.Random(seed)
+    messages = []
+    for _ in range(count):
+        words = rng.choices(WORDS, k=rng.randint(1, 20))
+        if rng.random() < link_ratio:
+            words.insert(rng.randint(0, len(words)), rng.choice(LINKS))
+        messages.append(' '.join(words))
+    return messages
+
+def per_message_compile(text):
+    # how Vxtwitter.generate_vxtwitter_links used to do it
+    pattern = re.compile(r'https://(mobile.|vx)?(twitter|x).com/([\w]{4,15}/status/[0-9]+)')
+    return [m.group(3) for m in pattern.finditer(text)]
+
+def per_rule_patterns():
+    patterns = [re.compile(f"https://(?i:{'|'.join(re.escape(d) for d in (*rule.domains, *rule.fixed_domains))})/({rule.path})")
+                for rule in DEFAULT_RULES]
+    def rewrite(text):
+        return [m.group(1) for pattern in patterns for m in pattern.finditer(text)]
+    return rewrite
+
+def measure(func, messages):
+    before = time.perf_counter()
+    for message in messages:
+        func(message)
+    return len(messages) / (time.perf_counter() - before)
+
+def main(args):
+    messages = generate_messages(args.messages, args.link_ratio)
+    print(f"{args.messages} messages, {args.link_ratio:.0%} with links, {len(DEFAULT_RULES)} rules")
+    print(f"twitter only, compiled per message: {measure(per_message_compile, messages):>12,.0f} msgs/s")
+    print(f"one regex per rule:                 {measure(per_rule_patterns(), messages):>12,.0f} msgs/s")
+    print(f"LinkRewriter:                       {measure(LinkRewriter().rewrite, messages):>12,.0f} msgs/s")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=100000)
+    parser.add_argument('--link-ratio', type=float, default=0.05)
+    main(parser.parse_args())
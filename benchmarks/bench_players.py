@@ -0,0 +1,81 @@
+"""Micro-benchmarks for !players queries on a synthetic guild.
+
+Compares the previous approach of intersecting sets of Member objects with PlayerIndex bitsets.
+
+Usage:
+
+python -m benchmarks.bench_players --members 50000 --roles 200
+"""
+import argparse
+import random
+import timeit
+from types import SimpleNamespace
+
+from cogs.gametags import PlayerIndex, PlayerQuery
+
+class FakeMember(SimpleNamespace):
+    __hash__ = object.__hash__
+
+class FakeRole(SimpleNamespace):
+
+    @property
+    def members(self):
+        # discord.py's Role.members scans every member of the guild the same way
+        return [member for member in self.guild.members if self.id in member.role_ids]
+
+def synthetic_guild(member_count, role_count, roles_per_member):
+    guild = SimpleNamespace(members=[])
+    roles = [FakeRole(id=i, name=f"Game{i}", guild=guild) for i in range(role_count)]
+    # a few tags are much more popular than the rest
+    weights = [1 / (i + 1) for i in range(role_count)]
+    for member_id in range(member_count):
+        member_roles = {role.id: role for role in random.choices(roles, weights, k=roles_per_member)}
+        guild.members.append(FakeMember(
+            id=member_id, roles=list(member_roles.values()), role_ids=set(member_roles)))
+    return guild, roles
+
+def baseline_intersect(roles):
+    players = set(roles[0].members)
+    for role in roles[1:]:
+        players &= set(role.members)
+    return players
+
+def main(args):
+    random.seed(0)
+    guild, roles = synthetic_guild(args.members, args.roles, args.roles_per_member)
+    build = timeit.timeit(lambda: PlayerIndex(guild.members), number=1)
+    player_index = PlayerIndex(guild.members)
+    popular = roles[:3]
+
+    def query(*included, excluded=()):
+        query = PlayerQuery()
+        for role in included:
+            query.include([player_index.bits(role)])
+        query.exclude([player_index.bits(role) for role in excluded])
+        return query
+
+    def report(name, func, number=args.number):
+        seconds = timeit.timeit(func, number=number) / number
+        print(f"{name:<40} {seconds * 1000:10.3f} ms")
+
+    print(f"members: {args.members}, roles: {args.roles}, index build: {build * 1000:.1f} ms")
+    print(f"matches for A AND B: {player_index.count(query(*popular[:2]))}")
+    report("sets: A AND B", lambda: baseline_intersect(popular[:2]), number=max(1, args.number // 100))
+    report("bitsets: A AND B (count)", lambda: player_index.count(query(*popular[:2])))
+    report("bitsets: A AND B (members)", lambda: player_index.members(player_index.evaluate(query(*popular[:2]))))
+    report("sets: A AND B AND C", lambda: baseline_intersect(popular), number=max(1, args.number // 100))
+    report("bitsets: A AND B AND C (count)", lambda: player_index.count(query(*popular)))
+    report("bitsets: A AND NOT B (count)", lambda: player_index.count(query(popular[0], excluded=popular[1:2])))
+    or_query = PlayerQuery()
+    or_query.include([player_index.bits(role) for role in popular])
+    report("bitsets: A OR B OR C (count)", lambda: player_index.count(or_query))
+    member = guild.members[0]
+    report("update member roles", lambda: player_index.update_member(member, member.roles[1:]))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--members', type=int, default=50000)
+    parser.add_argument('--roles', type=int, default=200)
+    parser.add_argument('--roles-per-member', type=int, default=3)
+    parser.add_argument('--number', type=int, default=1000)
+    main(parser.parse_args())
@@ -0,0 +1,86 @@
+"""Write throughput of ItemtagRepository compared to committing every row on its own connection.
+
+The baseline reproduces the previous implementation, which opened a connection and
+committed a transaction per insert on the event loop thread.
+
+Usage:
+
+python -m benchmarks.bench_repository --rows 2000 --writers 16
+"""
+import argparse
+import asyncio
+import sqlite3
+import tempfile
+import time
+from contextlib import closing
+from types import SimpleNamespace
+
+from cogs.gametags import Item, Itemtag, ItemtagRepository, ItemType
+
+def baseline_add_item(db_path, item):
+    try:
+        with closing(sqlite3.connect(db_path)) as conn:
+            conn.execute(f"INSERT INTO {item.type}s (id, name) VALUES (?, ?)", [item.id, item.name])
+            conn.commit()
+        return True
+    except sqlite3.IntegrityError:
+        return False
+
+def baseline_add_itemtag(db_path, itemtag):
+    conn = sqlite3.connect(db_path)
+    try:
+        cursor = conn.cursor()
+        cursor.execute('BEGIN')
+        cursor.execute("REPLACE INTO tags (id) VALUES (?)", [itemtag.tag.id])
+        cursor.execute(f"REPLACE INTO {itemtag.item.type}_tags (tag_id, {itemtag.item.type}_id) VALUES (?, ?)",
+                       [itemtag.tag.id, itemtag.item.id])
+        conn.commit()
+    except:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+def itemtags(rows):
+    for i in range(rows):
+        yield Itemtag(Item(ItemType.game, i, f"Game {i}"), SimpleNamespace(id=1_000_000 + i))
+
+async def run_baseline(rows):
+    repository = ItemtagRepository(tempfile.mkdtemp() + '/')
+    await repository.setup()
+    await repository.close()
+    before = time.perf_counter()
+    for itemtag in itemtags(rows):
+        baseline_add_item(repository.db_path, itemtag.item)
+        baseline_add_itemtag(repository.db_path, itemtag)
+    return time.perf_counter() - before
+
+async def run_grouped(rows, writers):
+    repository = ItemtagRepository(tempfile.mkdtemp() + '/')
+    await repository.setup()
+    pending = list(itemtags(rows))
+
+    async def writer():
+        while pending:
+            itemtag = pending.pop()
+            await repository.add_item(itemtag.item)
+            await repository.add_itemtag(itemtag)
+
+    before = time.perf_counter()
+    await asyncio.gather(*[writer() for _ in range(writers)])
+    elapsed = time.perf_counter() - before
+    await repository.close()
+    return elapsed
+
+async def main(args):
+    baseline = await run_baseline(args.rows)
+    grouped = await run_grouped(args.rows, args.writers)
+    print(f"rows: {args.rows} games + {args.rows} tags")
+    print(f"per-row commit:  {2 * args.rows / baseline:8.0f} rows/s ({baseline:.2f} s)")
+    print(f"group commit:    {2 * args.rows / grouped:8.0f} rows/s ({grouped:.2f} s, {args.writers} concurrent writers)")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=2000)
+    parser.add_argument('--writers', type=int, default=16)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,107 @@
+"""End-to-end latency of a translation request against the offline fake backend.
+
+Compares running detection and translations one after the other on the event loop,
+as the cog used to, with Fun.create_embed_with_translation, both with a cold and a warm translation cache.
+Also compares translating a conversation message by message with a single batch translation.
+
+Usage:
+
+python -m benchmarks.bench_translation --latency 0.2 --requests 5 --messages 30
+"""
+import argparse
+import asyncio
+import time
+from types import SimpleNamespace
+
+import discord
+from discord.ext import commands
+
+from cogs.fun import Fun, TARGET_LANGUAGES, GOOGLE_CODES_TO_LANGUAGES
+from benchmarks.fake_translator import FakeTranslatorBackend
+
+class FakeInteraction:
+    """Just enough of discord.Interaction for the translation context menus."""
+
+    def __init__(self):
+        self.sent = []
+        self.response = SimpleNamespace(defer=self.defer)
+        self.followup = SimpleNamespace(send=self.send)
+
+    async def defer(self, **kwargs):
+        pass
+
+    async def send(self, content=None, **kwargs):
+        self.sent.append((time.perf_counter(), content, kwargs))
+        return SimpleNamespace(edit=self.edit)
+
+    async def edit(self, **kwargs):
+        self.sent.append((time.perf_counter(), None, kwargs))
+
+def sequential(backend, text):
+    detection = backend.detect(text)
+    source_language = GOOGLE_CODES_TO_LANGUAGES[detection['language']]
+    return [backend.translate(text, lang) for lang in TARGET_LANGUAGES if lang != source_language]
+
+async def main(args):
+    bot = commands.Bot(command_prefix='!', intents=discord.Intents.none())
+    fun = Fun(bot)
+    fun.translator = FakeTranslatorBackend(latency=args.latency)
+    text = "Szia, hogy vagy?"
+
+    before = time.perf_counter()
+    for _ in range(args.requests):
+        sequential(fun.translator, text)
+    sequential_time = (time.perf_counter() - before) / args.requests
+
+    first_outputs = []
+    before = time.perf_counter()
+    for _ in range(args.requests):
+        fun.translation_cache.clear()
+        interaction = FakeInteraction()
+        started = time.perf_counter()
+        await fun.create_embed_with_translation(interaction, text)
+        first_outputs.append(interaction.sent[0][0] - started)
+    concurrent_time = (time.perf_counter() - before) / args.requests
+
+    before = time.perf_counter()
+    await asyncio.gather(*[fun.create_embed_with_translation(FakeInteraction(), f"{text} {i}") for i in range(args.requests)])
+    burst_time = time.perf_counter() - before
+
+    before = time.perf_counter()
+    for _ in range(args.requests):
+        await fun.create_embed_with_translation(FakeInteraction(), text)
+    cached_time = (time.perf_counter() - before) / args.requests
+
+    conversation = [SimpleNamespace(content=f"Szia {i % (args.messages // 2 or 1)}!", author=SimpleNamespace(display_name=f"user{i % 3}"))
+                    for i in range(args.messages)]
+    fun.translation_cache.clear()
+    calls = fun.translator.calls
+    before = time.perf_counter()
+    for message in conversation:
+        await fun.create_embed_with_translation(FakeInteraction(), message.content)
+    one_by_one_time = time.perf_counter() - before
+    one_by_one_calls = fun.translator.calls - calls
+
+    fun.translation_cache.clear()
+    calls = fun.translator.calls
+    before = time.perf_counter()
+    await fun.send_batch_translation(FakeInteraction(), conversation)
+    batch_time = time.perf_counter() - before
+    batch_calls = fun.translator.calls - calls
+
+    await fun.cog_unload()
+    print(f"backend latency per call: {args.latency * 1000:.0f} ms")
+    print(f"sequential on the loop:   {sequential_time * 1000:.0f} ms per request")
+    print(f"concurrent:               {concurrent_time * 1000:.0f} ms per request, "
+          f"first output after {sum(first_outputs) / len(first_outputs) * 1000:.0f} ms")
+    print(f"{args.requests} concurrent requests:    {burst_time * 1000:.0f} ms in total")
+    print(f"repeated (cached):        {cached_time * 1000:.2f} ms per request")
+    print(f"{args.messages} messages one by one:  {one_by_one_time * 1000:.0f} ms, {one_by_one_calls} backend calls")
+    print(f"{args.messages} messages batched:     {batch_time * 1000:.0f} ms, {batch_calls} backend calls")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--latency', type=float, default=0.2)
+    parser.add_argument('--requests', type=int, default=5)
+    parser.add_argument('--messages', type=int, default=30)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,118 @@
+"""Local stand-in for the Twitch token endpoint and the IGDB API.
+
+Serves canned games with a configurable artificial latency and keeps track of
+request concurrency, so IgdbWrapper can be exercised offline.
+
+Usage:
+
+python -m benchmarks.fake_igdb --port 8080 --latency 0.1
+"""
+import argparse
+import asyncio
+from collections import deque
+import re
+import time
+
+from aiohttp import web
+
+ID_PATTERN = re.compile(r'where id = (\d+);')
+NAME_PATTERN = re.compile(r'where name ~ \*"(.*)"\*;')
+MULTIQUERY_PATTERN = re.compile(r'query (\w+) "([^"]*)" \{ (.*?) \};', re.DOTALL)
+
+class FakeIgdb:
+
+    def __init__(self, latency=0.05, token_lifetime=3600, games=None, rate_limit=4, max_open_requests=8):
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.max_open_requests = max_open_requests
+        self.recent_requests = deque()
+        self.token_lifetime = token_lifetime
+        self.games = games if games is not None else {
+            i: f"Fake Fighter {i}" for i in range(1, 1001)
+        }
+        self.tokens = set()
+        self.requests = 0
+        self.token_requests = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.rejected = 0
+
+    def app(self):
+        app = web.Application()
+        app.router.add_post('/oauth2/token', self.token)
+        app.router.add_post('/v4/multiquery/', self.multiquery)
+        app.router.add_post('/v4/{endpoint}/', self.query)
+        return app
+
+    async def token(self, request):
+        self.token_requests += 1
+        token = f"token-{self.token_requests}"
+        self.tokens.add(token)
+        return web.json_response({'access_token': token, 'expires_in': self.token_lifetime, 'token_type': 'bearer'})
+
+    def revoke_tokens(self):
+        self.tokens.clear()
+
+    def _find(self, query):
+        m = ID_PATTERN.search(query)
+        if m:
+            game_id = int(m.group(1))
+            return [{'id': game_id, 'name': self.games[game_id]}] if game_id in self.games else []
+        m = NAME_PATTERN.search(query)
+        if m:
+            name = m.group(1).casefold()
+            return [
+                {'id': i, 'name': n, 'slug': n.lower().replace(' ', '-')}
+                for i, n in self.games.items() if name in n.casefold()
+            ][:20]
+        return []
+
+    def _over_limit(self):
+        now = time.monotonic()
+        while self.recent_requests and self.recent_requests[0] <= now - 1:
+            self.recent_requests.popleft()
+        if len(self.recent_requests) >= self.rate_limit or self.in_flight > self.max_open_requests:
+            self.rejected += 1
+            return True
+        self.recent_requests.append(now)
+        return False
+
+    async def _handle(self, request, respond):
+        self.requests += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            if request.headers.get('Authorization', '').removeprefix('Bearer ') not in self.tokens:
+                return web.json_response({'message': 'Authorization Failure'}, status=401)
+            if self._over_limit():
+                return web.json_response({'message': 'Too Many Requests'}, status=429)
+            query = await request.text()
+            await asyncio.sleep(self.latency)
+            return web.json_response(respond(query))
+        finally:
+            self.in_flight -= 1
+
+    async def query(self, request):
+        return await self._handle(request, self._find)
+
+    async def multiquery(self, request):
+        return await self._handle(request, lambda query: [
+            {'name': name, 'result': self._find(data)} for _, name, data in MULTIQUERY_PATTERN.findall(query)
+        ])
+
+async def start(fake, host='127.0.0.1', port=0):
+    """Start serving fake in the running loop, returns the runner and the base url."""
+    runner = web.AppRunner(fake.app())
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    port = runner.addresses[0][1]
+    return runner, f"http://{host}:{port}"
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--latency', type=float, default=0.05)
+    args = parser.parse_args()
+    web.run_app(FakeIgdb(args.latency).app(), host=args.host, port=args.port)
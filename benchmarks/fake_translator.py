@@ -0,0 +1,34 @@
+"""Offline stand-in for DeepTranslatorBackend.
+
+Blocks for a configurable time per call like the real HTTP requests do.
+"""
+import threading
+import time
+
+class FakeTranslatorBackend:
+
+    def __init__(self, latency=0.2, language='hu', confidence=10.0):
+        self.latency = latency
+        self.language = language
+        self.confidence = confidence
+        self.calls = 0
+        self.__lock = threading.Lock()
+
+    def __count(self):
+        with self.__lock:
+            self.calls += 1
+
+    def detect(self, text):
+        self.__count()
+        time.sleep(self.latency)
+        return {'language': self.language, 'isReliable': True, 'confidence': self.confidence}
+
+    def translate(self, text, target):
+        self.__count()
+        time.sleep(self.latency)
+        return f"[{target}] {text}"
+
+    def translate_batch(self, texts, target):
+        self.__count()
+        time.sleep(self.latency)
+        return [f"[{target}] {text}" for text in texts]
@@ -1,14 +1,20 @@
 import discord
 from discord import app_commands
 from discord.ext import commands
+import asyncio
 import logging
 import sys
 import traceback
-import asyncio
 from datetime import datetime, timezone
 from typing import Literal
 
 import config
+from cache import TTLCache
+from guild_index import GuildIndex
+from instrumentation import http_trace_config, metrics, timed
+from loop_watchdog import LoopWatchdog
+from messaging import MESSAGE_LIMIT, MessageSender, pack_text
+from onboarding import OnboardingPipeline, WelcomeMessageTracker
 from utils import superuser_only
 
 INTENTS = discord.Intents.default()
@@ -27,14 +33,90 @@ Mainly for handing out self-assignable roles (aka tags).
 
 DEV_GUILD_OBJ = discord.Object(config.DEV_GUILD_ID) if hasattr(config, 'DEV_GUILD_ID') else None  # type: ignore
 
+class InstrumentedCommandTree(app_commands.CommandTree):
+    """Times application commands (slash commands and context menus) from the tree's check until completion."""
+
+    def __init__(self, client, **kwargs):
+        super().__init__(client, **kwargs)
+        # interaction id -> span, completion is dispatched as an event so it can't be timed in place
+        self.spans = TTLCache(1024, 15 * 60)
+
+    async def interaction_check(self, interaction):
+        if interaction.type is discord.InteractionType.application_command and interaction.command is not None:
+            # the span also becomes current for the rest of the invocation
+            span, _ = metrics.start(f"app:{interaction.command.qualified_name}")
+            self.spans.set(interaction.id, span)
+        return True
+
+    def finish_interaction(self, interaction, *, error=False):
+        span = self.spans.pop(interaction.id)
+        if span is not None:
+            metrics.finish(span, error=error)
+
+    async def on_error(self, interaction, error):
+        self.finish_interaction(interaction, error=True)
+        await super().on_error(interaction, error)
+
 class Botemkin(commands.Bot):
     """Burly bot."""
 
     def __init__(self):
-        super().__init__(command_prefix=COMMAND_PREFIX, intents=INTENTS, description=DESCRIPTION)
+        super().__init__(command_prefix=COMMAND_PREFIX, intents=INTENTS, description=DESCRIPTION,
+                         tree_cls=InstrumentedCommandTree, http_trace=http_trace_config())
+        self.before_invoke(self.start_command_timing)
+        self.after_invoke(self.finish_command_timing)
         self.onboarding_enabled_date = datetime.strptime(config.ONBOARDING_ENABLED_DATE, '%Y-%m-%d').replace(tzinfo=timezone.utc)
+        # shared by all cogs for looking up channels, emojis and roles by name
+        self.guild_index = GuildIndex()
+        for event in GuildIndex.LISTENERS:
+            self.add_listener(getattr(self.guild_index, event), event)
+        # multi-part responses of all cogs go through here
+        self.message_sender = MessageSender()
+        # Discord's welcome messages in the home channel, deleted when their member gets kicked
+        self.welcome_messages = WelcomeMessageTracker(ttl=getattr(config, 'WELCOME_MESSAGE_TTL', 60 * 60))
+        self.add_listener(self.track_welcome_message, 'on_message')
+        self.add_listener(self.finish_app_command_timing, 'on_app_command_completion')
+        # logs the stack of anything blocking the event loop for longer than the threshold (in seconds)
+        self.loop_watchdog = LoopWatchdog(threshold=getattr(config, 'LOOP_LAG_THRESHOLD', 0.25))
+        # merges the welcomes, mod notices and kicks of members onboarding at around the same time
+        self.onboarding = OnboardingPipeline(
+            welcome=self.welcome_members,
+            notify=self.notify_mods,
+            kick=self.kick_restricted_member,
+            window=getattr(config, 'ONBOARDING_BATCH_WINDOW', 1.0),
+            max_batch=getattr(config, 'ONBOARDING_BATCH_SIZE', 25),
+            kick_concurrency=getattr(config, 'ONBOARDING_KICK_CONCURRENCY', 4),
+        )
+
+    async def close(self):
+        # don't leave members of the last batch unwelcomed
+        await self.onboarding.flush()
+        self.loop_watchdog.stop()
+        await super().close()
+
+    async def start_command_timing(self, ctx):
+        ctx.timing = metrics.start(f"command:{ctx.command.qualified_name}")
+
+    async def finish_command_timing(self, ctx):
+        span, token = ctx.timing
+        metrics.finish(span, token, error=ctx.command_failed)
+
+    async def finish_app_command_timing(self, interaction, command):
+        self.tree.finish_interaction(interaction)
+
+    async def write_prometheus_metrics(self, path, interval):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await asyncio.to_thread(metrics.write_prometheus, path)
+            except:
+                log.exception("Failed to write metrics")
 
     async def setup_hook(self):
+        self.loop_watchdog.start()
+        # optional, for Prometheus' node_exporter textfile collector or the like
+        if hasattr(config, 'PROMETHEUS_FILE'):
+            self.loop.create_task(self.write_prometheus_metrics(config.PROMETHEUS_FILE, getattr(config, 'PROMETHEUS_INTERVAL', 60)))
         for extension in config.EXTENSIONS:
             try:
                 await self.load_extension(f'cogs.{extension.lower()}')
@@ -45,10 +127,19 @@ class Botemkin(commands.Bot):
     async def on_ready(self):
         log.info(f"logged in as {self.user} with an id of {self.user.id}")  # type: ignore
 
+    @timed
+    async def track_welcome_message(self, message):
+        if message.type != discord.MessageType.new_member or message.guild is None:
+            return
+        home_channel = self.guild_index.channel(message.guild, config.HOME_CHANNEL)
+        if home_channel is None or message.channel.id != home_channel.id:
+            return
+        await self.welcome_messages.track(message)
+
     # TODO print something helpful
     async def on_command_error(self, ctx, error):
         if isinstance(error, commands.CommandNotFound):
-            e = discord.utils.get(ctx.guild.emojis, name='semmiertelme')
+            e = self.guild_index.emoji(ctx.guild, 'semmiertelme') if ctx.guild else None
             if e:
                 await ctx.message.add_reaction(e)
             await ctx.send("Command not found. Use **!help** to print commands.")
@@ -56,42 +147,49 @@ class Botemkin(commands.Bot):
         print('Ignoring exception in command {}'.format(ctx.command), file=sys.stderr)
         traceback.print_exception(type(error), error, error.__traceback__, file=sys.stderr)
 
+    @timed
     async def on_member_update(self, before, after):
         if before.flags.completed_onboarding == True or after.flags.completed_onboarding == False:
             return
-        channels = after.guild.channels
         if (before.joined_at < self.onboarding_enabled_date):
-            mod_channel = discord.utils.get(channels, name=config.MOD_CHANNEL)
-            await mod_channel.send(f"Onboarded member who joined before its introduction, name: {after.mention}")
+            self.onboarding.notify_mods(after.guild, f"Onboarded member who joined before its introduction, name: {after.mention}")
             return
-        home_channel = discord.utils.get(channels, name=config.HOME_CHANNEL)
-        restricted_role = discord.utils.find(
-            lambda role: role.name.casefold() == config.RESTRICTED_ROLE.casefold(), after.roles)
+        restricted_role = self.guild_index.member_role(after, config.RESTRICTED_ROLE)
         if restricted_role:
             # new member is most likely a bot as they did not accept the terms of service
             # if after.flags.did_rejoin == False:
                 # TODO if first time joiner send a DM requesting them to retry
-            await after.kick(reason="Did not accept terms of service during onboarding, likely a bot.")
-            mod_channel = discord.utils.get(channels, name=config.MOD_CHANNEL)
-            await mod_channel.send(f"Kicked newly onboarded member that picked {restricted_role.mention} role, username: {after.name}")
-            # wait a bit for Discord to post the built-in welcome message and then delete it
-            await asyncio.sleep(1)
-            async for message in home_channel.history(limit=200):
-                if message.author == after:
-                    await message.delete()
-                    break
+            self.onboarding.kick_member(
+                after, f"Kicked newly onboarded member that picked {restricted_role.mention} role, username: {after.name}")
         else:
-            announcements_channel = discord.utils.get(channels, name=config.ANNOUNCEMENTS_CHANNEL)
-            general_channel = discord.utils.get(channels, name=config.GENERAL_CHANNEL)
-            matchmaking_channel = discord.utils.get(channels, name=config.MATCHMAKING_CHANNEL)
-            welcome_msg=config.WELCOME_TEXT.format(
-                new_member=after.mention,
-                announcements=announcements_channel.mention,
-                home=home_channel.mention,
-                general=general_channel.mention,
-                matchmaking=matchmaking_channel.mention,
-                botemkin=self.user.mention)  # type: ignore
-            await home_channel.send(welcome_msg)
+            self.onboarding.welcome_member(after)
+
+    async def kick_restricted_member(self, member):
+        await member.kick(reason="Did not accept terms of service during onboarding, likely a bot.")
+        home_channel = self.guild_index.channel(member.guild, config.HOME_CHANNEL)
+        if home_channel is None:
+            log.warning(f"Home channel not found, welcome message of kicked member {member.id} left in place")
+            return
+        await self.welcome_messages.delete(home_channel, member)
+
+    async def notify_mods(self, guild, lines):
+        mod_channel = self.guild_index.channel(guild, config.MOD_CHANNEL)
+        for message in pack_text(line[:MESSAGE_LIMIT] for line in lines):
+            await mod_channel.send(message)
+
+    async def welcome_members(self, guild, members):
+        home_channel = self.guild_index.channel(guild, config.HOME_CHANNEL)
+        announcements_channel = self.guild_index.channel(guild, config.ANNOUNCEMENTS_CHANNEL)
+        general_channel = self.guild_index.channel(guild, config.GENERAL_CHANNEL)
+        matchmaking_channel = self.guild_index.channel(guild, config.MATCHMAKING_CHANNEL)
+        welcome_msg=config.WELCOME_TEXT.format(
+            new_member=', '.join(member.mention for member in members),
+            announcements=announcements_channel.mention,
+            home=home_channel.mention,
+            general=general_channel.mention,
+            matchmaking=matchmaking_channel.mention,
+            botemkin=self.user.mention)  # type: ignore
+        await home_channel.send(welcome_msg)
 
 bot = Botemkin()
 
@@ -0,0 +1,109 @@
+from collections import OrderedDict
+import time
+
+class TTLCache:
+    """Bounded mapping whose entries expire ttl seconds after being set.
+
+    Once maxsize entries (or maxbytes as measured by sizeof(key, value)) are reached
+    the least recently used entries are evicted.
+    """
+
+    def __init__(self, maxsize, ttl, *, maxbytes=None, sizeof=None, timer=time.monotonic, wall_clock=time.time):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.maxbytes = maxbytes
+        self._sizeof = sizeof if sizeof is not None else lambda key, value: 0
+        self._timer = timer
+        # dump() and load() convert expiry to wall clock time so the time the bot is down counts
+        self._wall_clock = wall_clock
+        self._data = OrderedDict()  # key -> (expires_at, value, size), least recently used first
+        self.currbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        entry = self._data.get(key)
+        return entry is not None and entry[0] > self._timer()
+
+    def get(self, key, default=None):
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        if entry[0] <= self._timer():
+            self._remove(key)
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key, value, *, ttl=None):
+        if self.maxsize <= 0:
+            return
+        size = self._sizeof(key, value)
+        if self.maxbytes is not None and size > self.maxbytes:
+            return
+        if key in self._data:
+            self._remove(key)
+        self._data[key] = (self._timer() + (self.ttl if ttl is None else ttl), value, size)
+        self.currbytes += size
+        if len(self._data) > self.maxsize or (self.maxbytes is not None and self.currbytes > self.maxbytes):
+            self._evict()
+
+    def pop(self, key, default=None):
+        if key not in self._data:
+            return default
+        return self._remove(key)
+
+    def clear(self):
+        self._data.clear()
+        self.currbytes = 0
+
+    def _remove(self, key):
+        _, value, size = self._data.pop(key)
+        self.currbytes -= size
+        return value
+
+    def _over_limit(self):
+        return len(self._data) > self.maxsize or (self.maxbytes is not None and self.currbytes > self.maxbytes)
+
+    def _evict(self):
+        # drop expired entries first, only evict live entries if that wasn't enough
+        now = self._timer()
+        for key in [key for key, (expires_at, _, _) in self._data.items() if expires_at <= now]:
+            self._remove(key)
+        while self._over_limit():
+            self._remove(next(iter(self._data)))
+            self.evictions += 1
+
+    def dump(self):
+        """Return the live entries as (key, wall clock expiry, value) tuples, least recently used first."""
+        now = self._timer()
+        wall_now = self._wall_clock()
+        return [(key, wall_now + expires_at - now, value)
+                for key, (expires_at, value, _) in self._data.items() if expires_at > now]
+
+    def load(self, entries):
+        """Add entries returned by dump(), possibly from an earlier run, skipping the ones expired since."""
+        wall_now = self._wall_clock()
+        for key, expires_at, value in entries:
+            if expires_at > wall_now:
+                self.set(key, value, ttl=expires_at - wall_now)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        stats = {
+            'size': len(self._data),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
+        if self.maxbytes is not None:
+            stats['bytes'] = self.currbytes
+        return stats
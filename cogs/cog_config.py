@@ -0,0 +1,3 @@
+IGDB_CLIENT_ID = 'x'
+IGDB_CLIENT_SECRET = 'y'
+DETECT_LANGUAGE_API_KEY = 'z'
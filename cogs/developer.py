@@ -1,8 +1,15 @@
+import discord
 from discord.ext import commands
+from datetime import datetime, timezone
+import io
 import logging
 import traceback
+from typing import Literal
 
+import config
 from config import EXTENSIONS
+from instrumentation import metrics
+from profiling import MemoryTracker, ProfilerBusy, profile_deterministic, profile_sampling
 from utils import superuser_cog_check
 
 log = logging.getLogger(__name__)
@@ -15,6 +22,13 @@ class Developer(commands.Cog):
 
     def __init__(self, bot):
         self.bot = bot
+        self.memory_tracker = MemoryTracker()
+        # the profilers slow the bot down (cProfile) or hold a thread (sampler) for as long as they run
+        self.max_profile_seconds = getattr(config, 'MAX_PROFILE_SECONDS', 60)
+
+    async def cog_unload(self):
+        if self.memory_tracker.running:
+            self.memory_tracker.stop()
 
     async def extension_operation(self, ctx, extension, func):
         if func not in (self.bot.reload_extension, self.bot.load_extension, self.bot.unload_extension):
@@ -57,5 +71,135 @@ class Developer(commands.Cog):
         """Unload given extension."""
         await self.extension_operation(ctx, extension, self.bot.unload_extension)
 
+    @staticmethod
+    def format_stat(name, value):
+        if name.endswith('_rate'):
+            return f"{name.replace('_', ' ')} {value:.0%}"
+        if isinstance(value, float):
+            return f"{name.replace('_', ' ')} {value:.2f}"
+        return f"{name.replace('_', ' ')} {value}"
+
+    @commands.command(aliases=['cache'[:i] for i in range(2,len('cache'))])
+    async def cache(self, ctx):
+        """Show cache statistics of loaded extensions."""
+        rows = []
+        for cog_name, cog in self.bot.cogs.items():
+            # cogs with caches expose their counters through a cache_stats() method
+            cache_stats = getattr(cog, 'cache_stats', None)
+            if cache_stats is None:
+                continue
+            for cache_name, stats in cache_stats().items():
+                rows.append(f"{cog_name}/{cache_name}: " + ', '.join(
+                    self.format_stat(name, value) for name, value in stats.items()))
+        if rows:
+            await ctx.send("```" + '\n'.join(rows) + "```")
+        else:
+            await ctx.send("No caches found.")
+
+    @commands.group(aliases=['stats'[:i] for i in range(2,len('stats'))], invoke_without_command=True)
+    async def stats(self, ctx):
+        """Show timings of commands and listeners, slowest first.
+
+        p50/p95/p99 are wall times in milliseconds, io is the share of time spent awaiting HTTP and the database.
+        """
+        rows = metrics.report()
+        if not rows:
+            await ctx.send("No timings recorded yet.")
+            return
+        paginator = commands.Paginator(prefix='```', suffix='```', linesep='\n')
+        width = max(len(row['label']) for row in rows)
+        paginator.add_line(f"{'handler':<{width}} {'calls':>6} {'errors':>6} {'p50':>7} {'p95':>7} {'p99':>7} {'io':>4}")
+        for row in rows:
+            paginator.add_line(
+                f"{row['label']:<{width}} {row['calls']:>6} {row['errors']:>6} "
+                f"{row['p50'] * 1000:>7.1f} {row['p95'] * 1000:>7.1f} {row['p99'] * 1000:>7.1f} {row['io_share']:>4.0%}")
+        await self.bot.message_sender.send_pages(ctx, paginator.pages)
+
+    @stats.command(name='reset')
+    async def stats_reset(self, ctx):
+        """Forget the timings recorded so far."""
+        metrics.reset()
+        await ctx.send("Timings reset.")
+
+    @commands.command(aliases=['lag'[:i] for i in range(2,len('lag'))])
+    async def lag(self, ctx, count: int = 3):
+        """Show event loop lag and the latest stalls with what was running and where.
+
+        A stall is the event loop being blocked for longer than LOOP_LAG_THRESHOLD.
+        """
+        watchdog = self.bot.loop_watchdog
+        paginator = commands.Paginator(prefix='```', suffix='```', linesep='\n')
+        paginator.add_line(', '.join(self.format_stat(name, value) for name, value in watchdog.stats().items()))
+        for stall in list(watchdog.stalls)[-count:][::-1]:
+            duration = f"{stall.duration * 1000:.0f} ms" if stall.duration is not None else "ongoing"
+            paginator.add_line('')
+            started = datetime.fromtimestamp(stall.started, timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+            paginator.add_line(f"{started} UTC blocked for {duration} in {stall.label}")
+            # the innermost frames tell what was blocking
+            for frame in stall.stack[-6:]:
+                paginator.add_line(frame.rstrip()[:1900])
+        await self.bot.message_sender.send_pages(ctx, paginator.pages)
+
+    @staticmethod
+    def report_file(report, filename):
+        return discord.File(io.BytesIO(report.encode()), filename=filename)
+
+    @commands.group(aliases=['profile'[:i] for i in range(4,len('profile'))])
+    async def profile(self, ctx):
+        """Profile the running bot."""
+        if ctx.invoked_subcommand is None:
+            await ctx.send_help(ctx.command)
+
+    @profile.command(name='cpu')
+    async def profile_cpu(self, ctx, seconds: float = 10):
+        """Profile everything on the event loop with cProfile for the given seconds (up to MAX_PROFILE_SECONDS).
+
+        Precise but slows the bot down while running, see sample for a cheaper option.
+        """
+        seconds = min(max(seconds, 0), self.max_profile_seconds)
+        try:
+            async with ctx.typing():
+                report = await profile_deterministic(seconds)
+        except ProfilerBusy as e:
+            await ctx.send(str(e))
+            return
+        await ctx.send(f"Top functions by cumulative time over {seconds:g} seconds:", file=self.report_file(report, 'cprofile.txt'))
+
+    @profile.command(name='sample')
+    async def profile_sample(self, ctx, seconds: float = 10, interval_ms: float = 5):
+        """Sample the event loop's stack every interval_ms for the given seconds.
+
+        Low overhead, the sampling runs on a separate thread.
+        """
+        seconds = min(max(seconds, 0), self.max_profile_seconds)
+        # below a millisecond the sampler thread would mostly compete with the loop for the GIL
+        interval_ms = max(interval_ms, 1)
+        try:
+            async with ctx.typing():
+                report = await profile_sampling(seconds, interval=interval_ms / 1000)
+        except ProfilerBusy as e:
+            await ctx.send(str(e))
+            return
+        await ctx.send(f"Top functions by share of samples over {seconds:g} seconds:", file=self.report_file(report, 'samples.txt'))
+
+    @profile.command(name='memory', aliases=['mem'])
+    async def profile_memory(self, ctx, action: Literal['start', 'diff', 'stop'] = 'diff'):
+        """Trace memory allocations with tracemalloc.
+
+        start takes a baseline, diff shows the growth since then by source line and stop ends tracing.
+        Tracing costs memory and time on every allocation so don't leave it running.
+        """
+        if action == 'start':
+            traced = await self.memory_tracker.start()
+            await ctx.send(f"Tracing memory allocations, baseline taken at {traced / 1024 / 1024:.1f} MiB traced.")
+        elif not self.memory_tracker.running:
+            await ctx.send("Memory tracing isn't running, use `start` first.")
+        elif action == 'diff':
+            report = await self.memory_tracker.diff()
+            await ctx.send("Memory growth since start:", file=self.report_file(report, 'tracemalloc.txt'))
+        else:
+            self.memory_tracker.stop()
+            await ctx.send("Stopped tracing memory allocations.")
+
 async def setup(bot):
     await bot.add_cog(Developer(bot))
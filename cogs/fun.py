@@ -3,22 +3,395 @@ from discord import app_commands
 from discord.ext import commands
 import logging
 import asyncio
+import json
+import math
+import os
+import pathlib
 import random
+import re
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from deep_translator.constants import GOOGLE_LANGUAGES_TO_CODES
 from deep_translator import single_detection, GoogleTranslator
 import requests
 
 from . import cog_config
+from cache import TTLCache
+from instrumentation import io_timer, metrics
+from messaging import PageView
 
 log = logging.getLogger(__name__)
 
 GOOGLE_CODES_TO_LANGUAGES = {v: k for k, v in GOOGLE_LANGUAGES_TO_CODES.items()}
 
+TARGET_LANGUAGES = ['english', 'hungarian', 'japanese']
+
+# https://discord.com/developers/docs/resources/message#embed-object-embed-limits
+EMBED_TITLE_LIMIT = 256
+EMBED_FIELD_NAME_LIMIT = 256
+EMBED_FIELD_VALUE_LIMIT = 1024
+EMBED_FIELD_LIMIT = 25
+MESSAGE_EMBED_LIMIT = 10
+MESSAGE_EMBED_TOTAL_LIMIT = 6000  # summed over all embeds of a message
+EMBED_URL_LIMIT = 2048
+EMBED_DESCRIPTION_LIMIT = 4096
+
+TRANSLATION_PENDING = '…'
+TRANSLATION_FAILED = '*Translation unavailable.*'
+
+def split_text(text, limit):
+    """Split text into chunks of at most limit characters, preferably at line breaks or spaces."""
+    chunks = []
+    while len(text) > limit:
+        cut = text.rfind('\n', 0, limit + 1)
+        if cut <= 0:
+            cut = text.rfind(' ', 0, limit + 1)
+        if cut <= 0:
+            cut = limit
+        chunks.append(text[:cut])
+        text = text[cut:].lstrip('\n ')
+    chunks.append(text)
+    return chunks
+
+def build_translation_messages(text, url, description, translations):
+    """Lay out a translation as embeds within Discord's limits.
+
+    translations is a list of (language, translation) pairs, empty translations are shown as
+    TRANSLATION_FAILED. Texts too long for a single field are split across several, spilling over into more embeds and messages as needed.
+    Returns a list of messages, each a list of embeds.
+    """
+    title = text if len(text) <= EMBED_TITLE_LIMIT else text[:EMBED_TITLE_LIMIT - 1] + '…'
+    fields = []
+    if title != text:
+        # the title only fits the beginning so the whole text is repeated in fields
+        translations = [('Original', text)] + translations
+    for name, value in translations:
+        # Discord rejects fields without a value
+        chunks = split_text(value if value and value.strip() else TRANSLATION_FAILED, EMBED_FIELD_VALUE_LIMIT)
+        for i, chunk in enumerate(chunks):
+            fields.append((name if len(chunks) == 1 else f"{name} ({i + 1}/{len(chunks)})", chunk))
+
+    embed = discord.Embed(title=title, url=url, description=description)
+    messages = [[embed]]
+    message_size = len(embed)
+    for name, value in fields:
+        field_size = len(name) + len(value)
+        if message_size + field_size > MESSAGE_EMBED_TOTAL_LIMIT:
+            embed = discord.Embed()
+            messages.append([embed])
+            message_size = 0
+        elif len(embed.fields) >= EMBED_FIELD_LIMIT:
+            embed = discord.Embed()
+            if len(messages[-1]) >= MESSAGE_EMBED_LIMIT:
+                messages.append([])
+                message_size = 0
+            messages[-1].append(embed)
+        embed.add_field(name=name, value=value, inline=False)
+        message_size += field_size
+    return messages
+
+def google_translate_url(source_language_code, text):
+    # long texts are cut short to keep the link within the embed url limit
+    length = len(text)
+    while True:
+        url = f"https://translate.google.com/?sl={source_language_code}&text={requests.utils.quote(text[:length])}"
+        if len(url) <= EMBED_URL_LIMIT:
+            return url
+        length = length * 2 // 3
+
+class DeepTranslatorBackend:
+    """Language detection and translation through deep_translator.
+
+    Every call blocks on an HTTP request so these are meant to be run in an executor.
+    """
+
+    def __init__(self, detect_language_api_key):
+        self.detect_language_api_key = detect_language_api_key
+
+    def detect(self, text):
+        return single_detection(text=text, api_key=self.detect_language_api_key, detailed=True)
+
+    # GoogleTranslator rejects longer texts
+    REQUEST_LIMIT = 5000
+
+    def translate_batch(self, texts, target):
+        """Translate single-line texts, packing as many as fit into each request.
+
+        The texts are sent joined by line breaks and split back afterwards. If the
+        lines don't come back one for one the texts of that request are translated
+        one by one instead.
+        """
+        translator = GoogleTranslator(source='auto', target=target)
+        translations = []
+        for chunk in self.__pack(texts):
+            lines = translator.translate('\n'.join(chunk)).split('\n')
+            if len(lines) == len(chunk):
+                translations.extend(line.strip() for line in lines)
+            else:
+                translations.extend(translator.translate_batch(chunk))
+        return translations
+
+    def __pack(self, texts):
+        chunk, size = [], 0
+        for text in texts:
+            if chunk and size + 1 + len(text) > self.REQUEST_LIMIT:
+                yield chunk
+                chunk, size = [], 0
+            chunk.append(text)
+            size += len(text) + (1 if size else 0)
+        if chunk:
+            yield chunk
+
+    def translate(self, text, target):
+        # GoogleTranslator keeps per-request state so instances are not shared between threads
+        return GoogleTranslator(source='auto', target=target).translate(text)
+
+# short samples of each Latin script language the local detector should recognize, the n-gram model is built from these
+LANGUAGE_SAMPLES = {
+    'en': "Hi, how are you? Tonight everyone is playing at the tournament and I think it will be really good. "
+          "Yesterday I saw the new character they announced, it looks very strong but the combos are hard to learn. "
+          "Thank you for the match, it was a lot of fun and I would like to play again. "
+          "Do you have time tomorrow afternoon? We are going to the club together where the others will be too. "
+          "The weather is nice today, so we went for a walk in the park and had lunch at a small restaurant near the river. "
+          "My brother works at the university and he usually comes home late in the evening.",
+    'hu': "Szia, hogy vagy? Ma este mindenki játszik a versenyen, és szerintem nagyon jó lesz. "
+          "Tegnap láttam az új karaktert, amit bejelentettek, nagyon erősnek tűnik, de nehéz megtanulni a kombókat. "
+          "Köszönöm a meccset, nagyon jó volt, szívesen játszanék még egyet. "
+          "Holnap délután ráérsz? Együtt megyünk a klubba, ahol a többiek is ott lesznek. "
+          "Ma szép idő van, ezért elmentünk sétálni a parkba, és egy kis étteremben ebédeltünk a folyó mellett. "
+          "A bátyám az egyetemen dolgozik, és általában későn jön haza este.",
+    'de': "Hallo, wie geht es dir? Heute Abend spielen alle beim Turnier und ich glaube, es wird sehr gut. "
+          "Gestern habe ich den neuen Charakter gesehen, der angekündigt wurde, er sieht sehr stark aus, aber die Kombos sind schwer zu lernen. "
+          "Danke für das Spiel, es hat viel Spaß gemacht und ich würde gerne noch einmal spielen. "
+          "Hast du morgen Nachmittag Zeit? Wir gehen zusammen in den Verein, wo auch die anderen sein werden. "
+          "Heute ist schönes Wetter, deshalb sind wir im Park spazieren gegangen und haben in einem kleinen Restaurant am Fluss gegessen. "
+          "Mein Bruder arbeitet an der Universität und kommt meistens spät am Abend nach Hause.",
+    'fr': "Salut, comment ça va ? Ce soir tout le monde joue au tournoi et je pense que ce sera très bien. "
+          "Hier j'ai vu le nouveau personnage qui a été annoncé, il a l'air très fort mais les combos sont difficiles à apprendre. "
+          "Merci pour le match, c'était très amusant et j'aimerais bien rejouer. "
+          "Est-ce que tu es libre demain après-midi ? Nous allons ensemble au club où les autres seront aussi. "
+          "Il fait beau aujourd'hui, alors nous sommes allés nous promener dans le parc et nous avons déjeuné dans un petit restaurant près de la rivière. "
+          "Mon frère travaille à l'université et il rentre généralement tard le soir.",
+    'es': "Hola, ¿cómo estás? Esta noche todos juegan en el torneo y creo que será muy bueno. "
+          "Ayer vi el nuevo personaje que anunciaron, parece muy fuerte pero los combos son difíciles de aprender. "
+          "Gracias por la partida, fue muy divertido y me gustaría jugar otra vez. "
+          "¿Tienes tiempo mañana por la tarde? Vamos juntos al club donde también estarán los demás. "
+          "Hoy hace buen tiempo, así que fuimos a pasear por el parque y comimos en un pequeño restaurante cerca del río. "
+          "Mi hermano trabaja en la universidad y normalmente vuelve a casa tarde por la noche.",
+    'it': "Ciao, come stai? Stasera tutti giocano al torneo e penso che sarà molto bello. "
+          "Ieri ho visto il nuovo personaggio che hanno annunciato, sembra molto forte ma le combo sono difficili da imparare. "
+          "Grazie per la partita, è stato molto divertente e mi piacerebbe giocare ancora. "
+          "Sei libero domani pomeriggio? Andiamo insieme al club dove ci saranno anche gli altri. "
+          "Oggi è una bella giornata, quindi siamo andati a fare una passeggiata nel parco e abbiamo pranzato in un piccolo ristorante vicino al fiume. "
+          "Mio fratello lavora all'università e di solito torna a casa tardi la sera.",
+    'pt': "Olá, como você está? Hoje à noite todos jogam no torneio e acho que vai ser muito bom. "
+          "Ontem eu vi o novo personagem que anunciaram, parece muito forte mas os combos são difíceis de aprender. "
+          "Obrigado pela partida, foi muito divertido e eu gostaria de jogar outra vez. "
+          "Você tem tempo amanhã à tarde? Vamos juntos ao clube onde os outros também vão estar. "
+          "Hoje está um dia bonito, então fomos passear no parque e almoçamos em um pequeno restaurante perto do rio. "
+          "Meu irmão trabalha na universidade e geralmente chega em casa tarde da noite.",
+    'pl': "Cześć, jak się masz? Dziś wieczorem wszyscy grają w turnieju i myślę, że będzie bardzo dobrze. "
+          "Wczoraj widziałem nową postać, którą ogłosili, wygląda na bardzo silną, ale kombosy są trudne do nauczenia. "
+          "Dziękuję za mecz, było bardzo fajnie i chętnie zagrałbym jeszcze raz. "
+          "Masz czas jutro po południu? Pójdziemy razem do klubu, gdzie będą też inni. "
+          "Dzisiaj jest ładna pogoda, więc poszliśmy na spacer do parku i zjedliśmy obiad w małej restauracji nad rzeką. "
+          "Mój brat pracuje na uniwersytecie i zwykle wraca do domu późnym wieczorem.",
+    'nl': "Hallo, hoe gaat het met je? Vanavond speelt iedereen op het toernooi en ik denk dat het heel goed wordt. "
+          "Gisteren zag ik het nieuwe personage dat ze hebben aangekondigd, het ziet er erg sterk uit maar de combo's zijn moeilijk te leren. "
+          "Bedankt voor de wedstrijd, het was heel leuk en ik zou graag nog een keer spelen. "
+          "Heb je morgenmiddag tijd? We gaan samen naar de club waar de anderen ook zijn. "
+          "Vandaag is het mooi weer, dus we gingen wandelen in het park en aten in een klein restaurant bij de rivier. "
+          "Mijn broer werkt op de universiteit en komt meestal laat in de avond thuis.",
+}
+
+class LocalLanguageDetector:
+    """Offline language detection, good enough to skip the DetectLanguage API for the obvious cases.
+
+    Scripts used by a single language (e.g. kana or hangul) decide outright, Latin script text is scored against
+    character n-gram profiles of LANGUAGE_SAMPLES. Returns results in the format of single_detection with
+    a confidence between 0 and 1.
+
+    The scores only rank the profiled languages against each other, so very short texts and texts that
+    look unlike even the best matching profile (likely a language without one) get a low confidence.
+    """
+
+    # (first code point, last code point, script name)
+    SCRIPT_RANGES = [
+        (0x0041, 0x024F, 'latin'),
+        (0x0370, 0x03FF, 'greek'),
+        (0x0400, 0x04FF, 'cyrillic'),
+        (0x0590, 0x05FF, 'hebrew'),
+        (0x0600, 0x06FF, 'arabic'),
+        (0x0E00, 0x0E7F, 'thai'),
+        (0x1100, 0x11FF, 'hangul'),
+        (0x3040, 0x30FF, 'kana'),
+        (0x3400, 0x4DBF, 'han'),
+        (0x4E00, 0x9FFF, 'han'),
+        (0xAC00, 0xD7AF, 'hangul'),
+        (0xFF66, 0xFF9F, 'kana'),
+    ]
+    # script -> (language code, confidence) for scripts that (nearly) pin down the language
+    SCRIPT_LANGUAGES = {
+        'greek': ('el', 0.99),
+        'hebrew': ('iw', 0.95),
+        'arabic': ('ar', 0.8),  # shared with Persian and Urdu
+        'thai': ('th', 0.99),
+        'hangul': ('ko', 0.99),
+        'kana': ('ja', 0.99),
+        'han': ('zh-CN', 0.6),  # could be Japanese written in kanji only or traditional Chinese
+        'cyrillic': ('ru', 0.7),  # shared with Ukrainian, Bulgarian, Serbian...
+    }
+    UKRAINIAN_LETTERS = set('іїєґ')
+    # letters (nearly) exclusive to one of the Latin script languages
+    MARKER_LETTERS = {
+        'ő': 'hu', 'ű': 'hu',
+        'ł': 'pl', 'ą': 'pl', 'ę': 'pl', 'ś': 'pl', 'ź': 'pl', 'ż': 'pl', 'ń': 'pl',
+        'ñ': 'es', '¿': 'es', '¡': 'es',
+        'ã': 'pt', 'õ': 'pt',
+        'ß': 'de',
+        'œ': 'fr',
+    }
+    # log likelihood added to a language per marker letter found
+    MARKER_BONUS = 2.0
+    # the profiles are built from little text so the likelihoods of longer texts are scaled down to
+    # this many n-grams before turning them into a confidence, otherwise they come out overconfident
+    CONFIDENCE_SCALE = 40
+    # below this many letters similar languages can't be told apart
+    MIN_LETTERS = 15
+    # a text of this many words that shares none of them with the sample is in a language without a profile,
+    # close relatives (e.g. Danish and Dutch) share too many trigrams for the unseen trigram limit to notice
+    MIN_WORDS_SHARED = 5
+    # confidence of short and out-of-model texts, low enough to leave them to the DetectLanguage API
+    UNCERTAIN_CONFIDENCE = 0.5
+    NGRAM_SIZES = (1, 2, 3)
+    NON_LETTERS = re.compile(r'[\W\d_]+')
+    SENTENCE_ENDS = re.compile(r'(?<=[.?!])\s+')
+
+    def __init__(self, samples=LANGUAGE_SAMPLES):
+        # language -> (n-gram -> log probability, log probability of unseen n-grams)
+        self.__profiles = {}
+        # language -> highest share of trigrams unseen by the profile expected from text in that language
+        self.__unseen_limits = {}
+        # language -> words of the sample
+        self.__vocabularies = {}
+        for language, sample in samples.items():
+            counts = Counter(self.__ngrams(sample))
+            total = sum(counts.values())
+            vocabulary = len(counts) + 1
+            self.__profiles[language] = (
+                {ngram: math.log((count + 1) / (total + vocabulary)) for ngram, count in counts.items()},
+                math.log(1 / (total + vocabulary)),
+            )
+            self.__unseen_limits[language] = self.__unseen_limit(sample)
+            self.__vocabularies[language] = set(self.__words(sample))
+
+    def __unseen_limit(self, sample):
+        # hold out each sentence of the sample in turn, text in the language shares at least
+        # as many trigrams with the full profile as the held out sentences do with the rest
+        sentences = self.SENTENCE_ENDS.split(sample)
+        limit = 0.0 if len(sentences) > 1 else 1.0
+        for i, sentence in enumerate(sentences):
+            rest = set(self.__trigrams(' '.join(sentences[:i] + sentences[i + 1:])))
+            trigrams = list(self.__trigrams(sentence))
+            if trigrams:
+                limit = max(limit, sum(trigram not in rest for trigram in trigrams) / len(trigrams))
+        return limit
+
+    def __words(self, text):
+        return self.NON_LETTERS.sub(' ', text.casefold()).split()
+
+    def __trigrams(self, text):
+        return (ngram for ngram in self.__ngrams(text) if len(ngram) == 3)
+
+    def __ngrams(self, text):
+        text = f" {self.NON_LETTERS.sub(' ', text.casefold()).strip()} "
+        for n in self.NGRAM_SIZES:
+            for i in range(len(text) - n + 1):
+                ngram = text[i:i + n]
+                if ngram != ' ':
+                    yield ngram
+
+    def __script(self, char):
+        code_point = ord(char)
+        for first, last, script in self.SCRIPT_RANGES:
+            if first <= code_point <= last:
+                return script
+        return None
+
+    def detect(self, text):
+        """Return {'language': code, 'confidence': 0..1} or None if there is nothing to go on."""
+        scripts = Counter(self.__script(char) for char in text if char.isalpha())
+        scripts.pop(None, None)
+        if not scripts:
+            return None
+        # any kana means Japanese, even if most of the text is kanji
+        script = 'kana' if 'kana' in scripts else scripts.most_common(1)[0][0]
+        if script == 'cyrillic' and self.UKRAINIAN_LETTERS & set(text.casefold()):
+            return {'language': 'uk', 'confidence': 0.9}
+        if script != 'latin':
+            language, confidence = self.SCRIPT_LANGUAGES[script]
+            return {'language': language, 'confidence': confidence}
+        return self.__detect_latin(text)
+
+    def __detect_latin(self, text):
+        scores = {language: 0.0 for language in self.__profiles}
+        ngrams = list(self.__ngrams(text))
+        for ngram in ngrams:
+            for language, (log_probabilities, unseen) in self.__profiles.items():
+                scores[language] += log_probabilities.get(ngram, unseen)
+        ngram_count = len(ngrams)
+        if not ngram_count:
+            return None
+        scale = min(1.0, self.CONFIDENCE_SCALE / ngram_count)
+        for char in text.casefold():
+            language = self.MARKER_LETTERS.get(char)
+            if language in scores:
+                scores[language] += self.MARKER_BONUS / scale
+        best_language = max(scores, key=scores.__getitem__)
+        best_score = scores[best_language]
+        # softmax of the scaled log likelihoods is the share of the best language
+        confidence = 1 / sum(math.exp((score - best_score) * scale) for score in scores.values())
+        if sum(char.isalpha() for char in text) < self.MIN_LETTERS or self.__is_out_of_model(text, ngrams, best_language):
+            confidence = min(confidence, self.UNCERTAIN_CONFIDENCE)
+        return {'language': best_language, 'confidence': round(confidence, 2)}
+
+    def __is_out_of_model(self, text, ngrams, language):
+        words = self.__words(text)
+        if len(words) >= self.MIN_WORDS_SHARED and self.__vocabularies[language].isdisjoint(words):
+            return True
+        log_probabilities = self.__profiles[language][0]
+        trigrams = [ngram for ngram in ngrams if len(ngram) == 3]
+        unseen = sum(trigram not in log_probabilities for trigram in trigrams)
+        return unseen > self.__unseen_limits[language] * len(trigrams)
+
 class Fun(commands.Cog):
     """Fun module. Your mileage may vary."""
 
     def __init__(self, bot):
         self.bot = bot
+        self.translator = DeepTranslatorBackend(cog_config.DETECT_LANGUAGE_API_KEY)
+        self.local_language_detector = LocalLanguageDetector()
+        # below this confidence the DetectLanguage API has the final say
+        self.local_detection_threshold = getattr(cog_config, 'LOCAL_DETECTION_THRESHOLD', 0.95)
+        # bounds the number of blocking translation requests in flight
+        self.translation_executor = ThreadPoolExecutor(
+            max_workers=getattr(cog_config, 'TRANSLATION_WORKERS', 8), thread_name_prefix='translation')
+        self.translation_timeout = getattr(cog_config, 'TRANSLATION_TIMEOUT', 10)
+        # keys are ('detect', text) and ('translate', target language, text)
+        self.translation_cache = TTLCache(
+            getattr(cog_config, 'TRANSLATION_CACHE_SIZE', 4096),
+            getattr(cog_config, 'TRANSLATION_CACHE_TTL', 7 * 24 * 60 * 60),
+            maxbytes=getattr(cog_config, 'TRANSLATION_CACHE_BYTES', 4 * 1024 * 1024),
+            sizeof=self._translation_cache_entry_size,
+        )
+        # optional, the cache only lives in memory if not set
+        self.translation_cache_path = getattr(cog_config, 'TRANSLATION_CACHE_FILE', None)
+        # besides on unload the cache is saved every interval if anything was added, so a crash loses little
+        self.translation_cache_save_interval = getattr(cog_config, 'TRANSLATION_CACHE_SAVE_INTERVAL', 10 * 60)
+        self.translation_cache_lock = asyncio.Lock()
+        self.translation_cache_saver = None
+        self.unsaved_translations = 0
 
         # https://github.com/Rapptz/discord.py/issues/7823
         self.translate_name_ctx_menu = app_commands.ContextMenu(
@@ -29,19 +402,88 @@ class Fun(commands.Cog):
             name='Translate Message',
             callback=self.translate_message,
         )
+        self.translate_from_ctx_menu = app_commands.ContextMenu(
+            name='Translate From Here',
+            callback=self.translate_from_message,
+        )
         self.bot.tree.add_command(self.translate_name_ctx_menu)
         self.bot.tree.add_command(self.translate_msg_ctx_menu)
+        self.bot.tree.add_command(self.translate_from_ctx_menu)
+        # upper bound on the messages translated by a single batch translation
+        self.recent_translation_limit = getattr(cog_config, 'RECENT_TRANSLATION_LIMIT', 50)
+
+    async def cog_load(self) -> None:
+        if self.translation_cache_path:
+            try:
+                entries = await asyncio.to_thread(self._read_translation_cache, self.translation_cache_path)
+                self.translation_cache.load(entries)
+            except FileNotFoundError:
+                pass
+            except:
+                log.exception("Failed to load translation cache")
+            self.translation_cache_saver = asyncio.create_task(self._save_translation_cache_periodically())
 
     async def cog_unload(self) -> None:
         self.bot.tree.remove_command(self.translate_name_ctx_menu.name, type=self.translate_name_ctx_menu.type)
         self.bot.tree.remove_command(self.translate_msg_ctx_menu.name, type=self.translate_msg_ctx_menu.type)
+        self.bot.tree.remove_command(self.translate_from_ctx_menu.name, type=self.translate_from_ctx_menu.type)
+        self.translation_executor.shutdown(wait=False, cancel_futures=True)
+        if self.translation_cache_saver is not None:
+            self.translation_cache_saver.cancel()
+            self.translation_cache_saver = None
+        if self.translation_cache_path:
+            await self._save_translation_cache()
+
+    async def _save_translation_cache(self):
+        # the lock keeps a periodic save and the one on unload from writing the file at the same time
+        async with self.translation_cache_lock:
+            entries = self.translation_cache.dump()
+            self.unsaved_translations = 0
+            try:
+                await asyncio.to_thread(self._write_translation_cache, self.translation_cache_path, entries)
+            except:
+                log.exception("Failed to save translation cache")
+
+    async def _save_translation_cache_periodically(self):
+        while True:
+            await asyncio.sleep(self.translation_cache_save_interval)
+            if self.unsaved_translations:
+                # shielded so that unloading the cog doesn't abandon a write halfway
+                await asyncio.shield(self._save_translation_cache())
+
+    def _cache_translation(self, key, value):
+        self.translation_cache.set(key, value)
+        self.unsaved_translations += 1
+
+    @staticmethod
+    def _read_translation_cache(path):
+        with open(path, encoding='utf-8') as f:
+            # JSON turns the tuple keys into lists
+            return [(tuple(key), expires_at, value) for key, expires_at, value in json.load(f)]
+
+    @staticmethod
+    def _write_translation_cache(path, entries):
+        path = pathlib.Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # replaced atomically so a crash while saving leaves the previous file intact
+        temp_path = path.with_name(path.name + '.tmp')
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(entries, f, ensure_ascii=False)
+        os.replace(temp_path, path)
+
+    @staticmethod
+    def _translation_cache_entry_size(key, value):
+        # rough UTF-8 size of the strings involved, detection results are small dicts
+        return sum(len(part.encode()) for part in key) + len(str(value).encode())
+
+    def cache_stats(self):
+        return {'translations': self.translation_cache.stats()}
 
     @commands.command()
     async def buster(self, ctx):
         """Busts."""
-        emojis = ctx.guild.emojis
-#       e1 = discord.utils.get(emojis, name='confirmed')
-        e2 = discord.utils.get(emojis, name='buster')
+#       e1 = self.bot.guild_index.emoji(ctx.guild, 'confirmed')
+        e2 = self.bot.guild_index.emoji(ctx.guild, 'buster')
 #       if e1 and e2:
         if e2:
 #           await ctx.message.add_reaction(e1)
@@ -56,12 +498,11 @@ class Fun(commands.Cog):
     @commands.command()
     async def waifu(self, ctx):
         """???"""
-        emojis = ctx.guild.emojis
-        e = discord.utils.get(emojis, name='igenytelenseg')
+        e = self.bot.guild_index.emoji(ctx.guild, 'igenytelenseg')
         if e:
             await ctx.message.add_reaction(e)
-        e1 = discord.utils.get(emojis, name='destr')
-        e2 = discord.utils.get(emojis, name='royed')
+        e1 = self.bot.guild_index.emoji(ctx.guild, 'destr')
+        e2 = self.bot.guild_index.emoji(ctx.guild, 'royed')
         if e1 and e2:
             await ctx.send(f"{ctx.author.mention} <:{e1.name}:{e1.id}><:{e2.name}:{e2.id}> your laifu!")
         else:
@@ -73,9 +514,8 @@ class Fun(commands.Cog):
         """This hardly ever happens, really."""
         if random.randint(1, 10) > 3:
             return
-        emojis = ctx.guild.emojis
-        e1 = discord.utils.get(emojis, name='danger')
-        e2 = discord.utils.get(emojis, name='time')
+        e1 = self.bot.guild_index.emoji(ctx.guild, 'danger')
+        e2 = self.bot.guild_index.emoji(ctx.guild, 'time')
         msg = await ctx.send('3')
         await asyncio.sleep(1)
         await msg.edit(content='2')
@@ -98,35 +538,185 @@ class Fun(commands.Cog):
     async def translate_message(self, interaction: discord.Interaction, message: discord.Message) -> None:
         await self.create_embed_with_translation(interaction, message.content)
 
+    @app_commands.command(name='translate_recent', description="Translates the latest messages of this channel.")
+    @app_commands.describe(count="Number of messages to translate")
+    @app_commands.guild_only()
+    async def translate_recent(self, interaction: discord.Interaction, count: app_commands.Range[int, 1, 100] = 10) -> None:
+        await interaction.response.defer(ephemeral=True, thinking=True)
+        # the limit is a setting so it can't be the bound of the Range, which is fixed when the command is defined
+        limit = min(count, self.recent_translation_limit)
+        messages = [message async for message in interaction.channel.history(limit=limit)]
+        await self.send_batch_translation(interaction, messages[::-1])
+        if limit < count:
+            await interaction.followup.send(
+                f"Only the latest {limit} messages were translated, that is the most translated at once.", ephemeral=True)
+
+    async def translate_from_message(self, interaction: discord.Interaction, message: discord.Message) -> None:
+        await interaction.response.defer(ephemeral=True, thinking=True)
+        messages = [message] + [m async for m in message.channel.history(
+            limit=self.recent_translation_limit - 1, after=message, oldest_first=True)]
+        await self.send_batch_translation(interaction, messages)
+
+    async def translate_texts(self, texts: list, target: str) -> dict:
+        """Translate distinct normalized texts into target, returns them mapped to their translations.
+
+        Cached translations are reused and the rest go to the translator in a single batch.
+        """
+        translations = {}
+        missing = []
+        for text in texts:
+            translation = self.translation_cache.get(('translate', target, text))
+            if translation is None:
+                missing.append(text)
+            else:
+                translations[text] = translation
+        if missing:
+            for text, translation in zip(missing, await self._run_translator(self.translator.translate_batch, missing, target)):
+                self._cache_translation(('translate', target, text), translation)
+                translations[text] = translation
+        return translations
+
+    async def send_batch_translation(self, interaction: discord.Interaction, messages: list) -> None:
+        messages = [message for message in messages if message.content.strip()]
+        if not messages:
+            await interaction.followup.send("No messages to translate.", ephemeral=True)
+            return
+
+        texts = list(dict.fromkeys(self._normalize_text(message.content) for message in messages))
+        # only the local detector is consulted, a confident match spares translating
+        # a text into its own language but every other text is sent to all targets
+        source_languages = {}
+        for text in texts:
+            detection = self.local_language_detector.detect(text)
+            if detection and detection['confidence'] >= self.local_detection_threshold:
+                source_languages[text] = GOOGLE_CODES_TO_LANGUAGES.get(detection['language'])
+
+        async def translate_into(lang):
+            return await self.translate_texts([text for text in texts if source_languages.get(text) != lang], lang)
+
+        results = await asyncio.gather(*(translate_into(lang) for lang in TARGET_LANGUAGES), return_exceptions=True)
+        translations = {}
+        for lang, result in zip(TARGET_LANGUAGES, results):
+            if isinstance(result, BaseException):
+                log.error("Failed to query Google Translate", exc_info=result)
+                result = {}
+            translations[lang] = result
+
+        entries = []
+        for message in messages:
+            text = self._normalize_text(message.content)
+            lines = [f"**{discord.utils.escape_markdown(message.author.display_name)}:** {text}"]
+            for lang in TARGET_LANGUAGES:
+                if source_languages.get(text) != lang:
+                    lines.append(f"> {lang.capitalize()}: {translations[lang].get(text, TRANSLATION_FAILED)}")
+            entries.append('\n'.join(lines))
+
+        pages = []
+        for entry in entries:
+            for chunk in split_text(entry, EMBED_DESCRIPTION_LIMIT):
+                if pages and len(pages[-1]) + 2 + len(chunk) <= EMBED_DESCRIPTION_LIMIT:
+                    pages[-1] += '\n\n' + chunk
+                else:
+                    pages.append(chunk)
+        embeds = [[discord.Embed(description=page)] for page in pages]
+        if len(embeds) == 1:
+            await interaction.followup.send(embeds=embeds[0], ephemeral=True)
+            return
+        # a single message with buttons, sending every page as a message of its own would run into rate limits
+        view = PageView(embeds, interaction.user.id)
+        view.message = await interaction.followup.send(embeds=embeds[0], view=view, ephemeral=True, wait=True)
+
+    async def _run_translator(self, func, *args):
+        loop = asyncio.get_running_loop()
+        # on timeout the thread still finishes its request but nobody waits for it
+        with io_timer():
+            return await asyncio.wait_for(
+                loop.run_in_executor(self.translation_executor, func, *args), self.translation_timeout)
+
+    @staticmethod
+    def _normalize_text(text):
+        return ' '.join(text.split())
+
+    async def detect_language(self, text: str) -> dict:
+        detection = self.local_language_detector.detect(text)
+        if detection and detection['confidence'] >= self.local_detection_threshold:
+            return detection
+
+        key = ('detect', self._normalize_text(text))
+        detection = self.translation_cache.get(key)
+        if detection is None:
+            detection = await self._run_translator(self.translator.detect, text)
+            self._cache_translation(key, detection)
+        return detection
+
+    async def translate_text(self, text: str, target: str) -> str:
+        key = ('translate', target, self._normalize_text(text))
+        translation = self.translation_cache.get(key)
+        if translation is None:
+            translation = await self._run_translator(self.translator.translate, text, target)
+            self._cache_translation(key, translation)
+        return translation
+
     async def create_embed_with_translation(self, interaction: discord.Interaction, text: str) -> None:
+        started = time.perf_counter()
         await interaction.response.defer(ephemeral=True, thinking=True)
 
-        embed = discord.Embed(title=text)
+        # translations are started alongside the detection instead of waiting for it,
+        # the one into the source language is dropped once that's known
+        detection_task = asyncio.create_task(self.detect_language(text))
+        translation_tasks = {lang: asyncio.create_task(self.translate_text(text, lang)) for lang in TARGET_LANGUAGES}
+
+        description = None
         source_language_code = 'auto'
-        target_languages = ['english', 'hungarian', 'japanese']
         try:
-            detection = single_detection(text=text, api_key=cog_config.DETECT_LANGUAGE_API_KEY, detailed=True)
+            detection = await detection_task
             source_language = GOOGLE_CODES_TO_LANGUAGES[detection['language']]
             source_language_code = detection['language']
-            if source_language in target_languages:
-                target_languages.remove(source_language)
-            embed.description = f"Source language: {source_language.capitalize()}\nConfidence rating: {detection['confidence']}"
+            if source_language in translation_tasks:
+                translation_tasks.pop(source_language).cancel()
+            description = f"Source language: {source_language.capitalize()}\nConfidence rating: {detection['confidence']}"
         except:
             log.exception("Language detection failed")
 
-        embed.url = f"https://translate.google.com/?sl={source_language_code}&text={requests.utils.quote(text)}"
+        url = google_translate_url(source_language_code, text)
+        translations = {lang: TRANSLATION_PENDING for lang in translation_tasks}
+        sent_messages = []  # (message, embeds as dicts) in the order they were sent
 
-        for lang in target_languages:
-            try:
-                translation = GoogleTranslator(source='auto', target=lang).translate(text)
-                embed.add_field(name=lang.capitalize(), value=translation, inline=False)
-            except:
-                log.exception("Failed to query Google Translate")
+        async def show_translations():
+            messages = build_translation_messages(
+                text, url, description, [(lang.capitalize(), translation) for lang, translation in translations.items()])
+            for i, embeds in enumerate(messages):
+                embed_dicts = [embed.to_dict() for embed in embeds]
+                if i >= len(sent_messages):
+                    sent_messages.append((await interaction.followup.send(embeds=embeds, ephemeral=True, wait=True), embed_dicts))
+                elif sent_messages[i][1] != embed_dicts:
+                    await sent_messages[i][0].edit(embeds=embeds)
+                    sent_messages[i] = (sent_messages[i][0], embed_dicts)
+
+        # the first message shows up as soon as the source language is known and
+        # gets filled in as each translation arrives
         try:
-            await interaction.followup.send(embed=embed)
+            await show_translations()
+            first_output = time.perf_counter() - started
+            languages_by_task = {task: lang for lang, task in translation_tasks.items()}
+            pending = set(languages_by_task)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    try:
+                        translations[languages_by_task[task]] = task.result()
+                    except:
+                        log.exception("Failed to query Google Translate")
+                        translations[languages_by_task[task]] = TRANSLATION_FAILED
+                await show_translations()
         except:
-            # FIXME embed has constraints (such as character limit in title field) which can cause exceptions
-            await interaction.followup.send("Oops, something went wrong.")
+            log.exception("Failed to send translation")
+            for task in translation_tasks.values():
+                task.cancel()
+            await interaction.followup.send("Oops, something went wrong.", ephemeral=True)
+            return
+        metrics.observe('translation:first_output', first_output)
+        log.debug(f"Translation shown after {first_output * 1000:.0f} ms, completed after {(time.perf_counter() - started) * 1000:.0f} ms")
 
 async def setup(bot):
     await bot.add_cog(Fun(bot))
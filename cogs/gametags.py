@@ -1,17 +1,25 @@
-﻿from collections import namedtuple
+﻿from collections import deque, namedtuple
+from dataclasses import dataclass, field
 from enum import Enum
+import asyncio
+import bisect
 import logging
 import pathlib
 import sqlite3
-from contextlib import closing
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 
 import discord
+from discord import app_commands
 from discord.ext import commands
 
 # for IGDB wrapper
-import requests
+import aiohttp
 
 from . import cog_config
+from cache import TTLCache
+from instrumentation import io_timer, timed
 from utils import superuser_only
 
 log = logging.getLogger(__name__)
@@ -39,34 +47,155 @@ Itemtag = namedtuple('Itemtag', 'item tag')
 class Gametags(commands.Cog):
     """Module for handling self-assignable roles (aka tags)."""
 
+    EXCLUDE_ONLY_QUERY = "Name at least one tag whose players to show, excluded tags only narrow those down."
+
     def __init__(self, bot):
         self.bot = bot
         self.repository = ItemtagRepository()
-        self.repository.setup()
-        self.igdb_wrapper = IgdbWrapper(cog_config.IGDB_CLIENT_ID, cog_config.IGDB_CLIENT_SECRET)
+        self.tag_indexes = {}  # guild id -> TagIndex, built on first use
+        self.available_tags = {}  # guild id -> (available tags, their ids), dropped whenever roles change
+        # (guild id, item type, all) -> (repository version, available tags, pages)
+        # entries are stale once either the repository or the available tags of the guild change
+        self.tag_pages = {}
+        self.tag_page_hits = 0
+        self.tag_page_rebuilds = 0
+        self.tag_page_rebuild_time = 0.0
+        self.tag_page_evictions = 0  # stale pages replaced and pages of guilds the bot left
+        self.player_indexes = {}  # guild id -> PlayerIndex, built on first use
+        self.igdb_wrapper = IgdbWrapper(
+            cog_config.IGDB_CLIENT_ID,
+            cog_config.IGDB_CLIENT_SECRET,
+            cache_size=getattr(cog_config, 'IGDB_CACHE_SIZE', 512),
+            cache_ttl=getattr(cog_config, 'IGDB_CACHE_TTL', 3600),
+        )
+
+    async def cog_load(self):
+        await self.repository.setup()
+
+    async def cog_unload(self):
+        await self.igdb_wrapper.close()
+        await self.repository.close()
+
+    def cache_stats(self):
+        lookups = self.tag_page_hits + self.tag_page_rebuilds
+        return {
+            'IGDB': self.igdb_wrapper.cache.stats(),
+            'tag pages': {
+                'size': len(self.tag_pages),
+                'hits': self.tag_page_hits,
+                'misses': self.tag_page_rebuilds,
+                'evictions': self.tag_page_evictions,
+                'hit_rate': self.tag_page_hits / lookups if lookups else 0.0,
+                'rebuild_ms': 1000 * self.tag_page_rebuild_time / self.tag_page_rebuilds if self.tag_page_rebuilds else 0.0,
+            },
+        }
+
+    def _get_player_index(self, guild : discord.Guild):
+        player_index = self.player_indexes.get(guild.id)
+        if player_index is None:
+            player_index = self.player_indexes[guild.id] = PlayerIndex(guild.members)
+        return player_index
+
+    def _get_tag_index(self, guild : discord.Guild):
+        tag_index = self.tag_indexes.get(guild.id)
+        if tag_index is None:
+            tag_index = self.tag_indexes[guild.id] = TagIndex(guild.roles)
+        return tag_index
+
+    @commands.Cog.listener()
+    async def on_guild_role_create(self, role):
+        self.available_tags.pop(role.guild.id, None)
+        tag_index = self.tag_indexes.get(role.guild.id)
+        if tag_index:
+            tag_index.add(role)
+
+    @commands.Cog.listener()
+    async def on_guild_role_delete(self, role):
+        self.available_tags.pop(role.guild.id, None)
+        player_index = self.player_indexes.get(role.guild.id)
+        if player_index:
+            player_index.remove_role(role)
+        tag_index = self.tag_indexes.get(role.guild.id)
+        if tag_index:
+            tag_index.remove(role)
+
+    @commands.Cog.listener()
+    async def on_guild_role_update(self, before, after):
+        # covers permission and position changes, including those of @everyone
+        self.available_tags.pop(after.guild.id, None)
+        tag_index = self.tag_indexes.get(after.guild.id)
+        if tag_index and before.name != after.name:
+            tag_index.remove(before)
+            tag_index.add(after)
+
+    @commands.Cog.listener()
+    @timed
+    async def on_member_update(self, before, after):
+        if before.roles == after.roles:
+            return
+        # the bot can only assign roles below its own top role
+        if after.id == self.bot.user.id:
+            self.available_tags.pop(after.guild.id, None)
+        player_index = self.player_indexes.get(after.guild.id)
+        if player_index:
+            player_index.update_member(after, before.roles)
+
+    @commands.Cog.listener()
+    async def on_member_join(self, member):
+        player_index = self.player_indexes.get(member.guild.id)
+        if player_index:
+            player_index.add_member(member)
+
+    @commands.Cog.listener()
+    async def on_member_remove(self, member):
+        player_index = self.player_indexes.get(member.guild.id)
+        if player_index:
+            player_index.remove_member(member)
+
+    @commands.Cog.listener()
+    async def on_guild_remove(self, guild):
+        self.tag_indexes.pop(guild.id, None)
+        self.available_tags.pop(guild.id, None)
+        self.player_indexes.pop(guild.id, None)
+        for key in [key for key in self.tag_pages if key[0] == guild.id]:
+            del self.tag_pages[key]
+            self.tag_page_evictions += 1
+
+    def _filter_available_tags(self, guild : discord.Guild):
+        everyone_role = guild.default_role
+        # a tag must not grant anything beyond @everyone and has to be assignable by the bot,
+        # which rules out managed (bot, booster and integration) roles and ones above the bot's top role
+        return [
+            role for role in guild.roles
+            if not role.is_default()
+            and role.is_assignable()
+            and role.permissions.is_subset(everyone_role.permissions)
+        ]
 
-    # TODO make async?
     def _get_available_tags(self, guild : discord.Guild):
-        everyone_role = discord.utils.find(
-            lambda role: role.id == guild.id, guild.roles)
+        return self._get_available_tags_with_ids(guild)[0]
 
-        # TODO this doesn't seem to actually filter out roles by permission
-        available_tags = list(filter(
-            lambda role: role.id != everyone_role.id and role.permissions <= everyone_role.permissions, guild.roles))  # type: ignore
+    def _get_available_tag_ids(self, guild : discord.Guild):
+        return self._get_available_tags_with_ids(guild)[1]
 
+    def _get_available_tags_with_ids(self, guild : discord.Guild):
+        available_tags = self.available_tags.get(guild.id)
+        if available_tags is None:
+            tags = self._filter_available_tags(guild)
+            available_tags = self.available_tags[guild.id] = (tags, frozenset(tag.id for tag in tags))
         return available_tags
 
     # TODO make async?
     def _get_selected_tags(self, guild : discord.Guild, requested_tag_names: list):
-        # TODO use sets and the intersection/difference functions
-        available_tags = self._get_available_tags(guild)
+        available_tag_ids = self._get_available_tag_ids(guild)
+        tag_index = self._get_tag_index(guild)
 
         selected_tags = []
         unknown_tag_names = []
         for tag_name in requested_tag_names:
 
-            requested_tag = discord.utils.find(
-                lambda tag: tag.name.casefold() == tag_name.casefold(), available_tags)
+            # a role that isn't available must not hide an available one of the same name
+            requested_tag = tag_index.get(tag_name, among=available_tag_ids)
 
             if requested_tag:
                 selected_tags.append(requested_tag)
@@ -88,8 +217,7 @@ class Gametags(commands.Cog):
                     paginator.add_line(row)
 
                 pages = [paginator.pages[0][len(paginator.prefix):]] + paginator.pages[1:]  # type: ignore
-                for page in pages:
-                    await ctx.send(page)
+                await self.bot.message_sender.send_pages(ctx, pages)
             else:
                 await ctx.send("No search results from the *Internet Game Database* (<https://www.igdb.com>).")
         except:
@@ -135,28 +263,42 @@ class Gametags(commands.Cog):
             pages = [paginator.pages[0][len(paginator.prefix):]] + paginator.pages[1:]  # type: ignore
         return pages
 
+    async def _get_cached_pages(self, guild, item_type, *, all = False):
+        available_tags = self._get_available_tags_with_ids(guild)
+        version = self.repository.version
+        key = (guild.id, item_type, all)
+        cached = self.tag_pages.get(key)
+        if cached and cached[0] == version and cached[1] is available_tags:
+            self.tag_page_hits += 1
+            return cached[2]
+
+        before = time.perf_counter()
+        if all:
+            pages = await self._get_pages_for_all_itemtags(item_type, available_tags[0])
+        else:
+            pages = await self._get_pages_for_available_itemtags(item_type, available_tags[0])
+        self.tag_page_rebuild_time += time.perf_counter() - before
+        self.tag_page_rebuilds += 1
+        if cached:
+            self.tag_page_evictions += 1
+        self.tag_pages[key] = (version, available_tags, pages)
+        return pages
+
     async def _list_available_tags(self, ctx):
         available_tags = self._get_available_tags(ctx.guild)
         if available_tags:
+            pages = []
             for item_type in ItemType:
-                pages = await self._get_pages_for_available_itemtags(item_type, available_tags)
-                if pages:
-                    for page in pages:
-                        await ctx.send(page)
-                else:
-                    await ctx.send(f"```There are currently no available {item_type}tags.```")
+                pages += await self._get_cached_pages(ctx.guild, item_type) or [f"```There are currently no available {item_type}tags.```"]
+            await self.bot.message_sender.send_pages(ctx, pages)
         else:
             await ctx.send(f"```There are currently no available tags.```")
 
     async def _list_all_tags(self, ctx):
-        available_tags = self._get_available_tags(ctx.guild)
+        pages = []
         for item_type in ItemType:
-            pages = await self._get_pages_for_all_itemtags(item_type, available_tags)
-            if pages:
-                for page in pages:
-                    await ctx.send(page)
-            else:
-                await ctx.send(f"```There are currently no imported {item_type}s.```")
+            pages += await self._get_cached_pages(ctx.guild, item_type, all=True) or [f"```There are currently no imported {item_type}s.```"]
+        await self.bot.message_sender.send_pages(ctx, pages)
 
     @commands.command(name='list', aliases=['ls', 'l'], usage='[all]')
     async def list_available_tags(self, ctx, arg=None):
@@ -200,7 +342,7 @@ class Gametags(commands.Cog):
                 else:
                     msg_str += f"*{item_names[0]}*! "
 
-                e = discord.utils.get(ctx.guild.emojis, name='quan')
+                e = self.bot.guild_index.emoji(ctx.guild, 'quan')
                 if e:
                     msg_str += len(item_names) * f"<:{e.name}:{e.id}>"
 
@@ -250,7 +392,7 @@ class Gametags(commands.Cog):
                 else:
                     msg_str += f"*{item_names[0]}*! "
 
-                e = discord.utils.get(ctx.guild.emojis, name='salt')
+                e = self.bot.guild_index.emoji(ctx.guild, 'salt')
                 if e:
                     msg_str += len(item_names) * f"<:{e.name}:{e.id}>"
 
@@ -281,23 +423,50 @@ class Gametags(commands.Cog):
     async def show_players(self, ctx, *role_names):
         """Shows players with given tags. When given multiple tags only show players who match all of them.
 
+        Prefix a tag with - to exclude its players, join tags with | to match any of them.
+
         Usage examples:
 
         !players SF6
         !ps Strive GBVSR
+        !ps SF6 -T8
+        !ps Strive|GBVSR -DNFD
         """
 
         # required because *tag_names being empty does not trigger a MissingRequiredArgument
         if not role_names:
             return await ctx.send_help(ctx.command)
-        if len(role_names) > 1:
-            await self._intersect_players(ctx, role_names)
+        if len(role_names) > 1 or self._is_player_query(ctx.guild, role_names[0]):
+            await self._query_players(ctx, role_names)
         else:
             await self._show_players_for_single_role(ctx, role_names[0])  # type: ignore
 
+    @commands.command(name='player_count', aliases=['pc'], usage='<tags>')
+    async def count_players(self, ctx, *role_names):
+        """Counts players with given tags. Accepts the same tags as !players.
+
+        Usage examples:
+
+        !player_count SF6
+        !pc SF6 -T8
+        """
+
+        # required because *tag_names being empty does not trigger a MissingRequiredArgument
+        if not role_names:
+            return await ctx.send_help(ctx.command)
+        query, description, unknown_tag_names = self._parse_player_query(ctx.guild, role_names)
+        if query is None:
+            return await ctx.send("No matching tags found.")
+        if not query.included:
+            return await ctx.send(self.EXCLUDE_ONLY_QUERY)
+        num = self._get_player_index(ctx.guild).count(query)
+        msg_str = f"The following tags are matched by {num} player{'s' if num != 1 else ''}: {description}."
+        if unknown_tag_names:
+            msg_str += f"```Unknown tags: {', '.join(unknown_tag_names)}```Use **!list** to print available tags."
+        await ctx.send(msg_str)
+
     async def _show_players_for_single_role(self, ctx, role_name):
-        role = discord.utils.find(
-            lambda role: role.name.casefold() == role_name.casefold(), ctx.guild.roles)
+        role = self._get_tag_index(ctx.guild).get(role_name)
 
         if not role:
             await ctx.send(f"```Unknown tag: {role_name}```Use **!list** to print available tags.")
@@ -306,46 +475,79 @@ class Gametags(commands.Cog):
         paginator = commands.Paginator(prefix='', suffix='', linesep='\n')
         item = await self.repository.find_any_item_by_tag(role)
         if item:
-            num = len(role.members)
+            player_index = self._get_player_index(ctx.guild)
+            num = player_index.count(player_index.bits(role))
             if num > 0:
                 paginator.add_line(f"*{item.name}* has {num} player{'s' if num != 1 else ''}:")
-                for player in role.members:
+                for player in player_index.members(player_index.bits(role)):
                     paginator.add_line(f"{player.mention} ({discord.utils.escape_markdown(player.name)})")
             else:
                 msg_str = f"*{role.name}* is a **DEAD** {item.type}"
-                e = discord.utils.get(ctx.guild.emojis, name='rip')
+                e = self.bot.guild_index.emoji(ctx.guild, 'rip')
                 if e:
                     msg_str = f"<:{e.name}:{e.id}> {msg_str} <:{e.name}:{e.id}>"
                 paginator.add_line(msg_str)
         else:
             paginator.add_line(f"```Not a tag: {role.name}```Use **!list** to print available tags.")
 
-        for page in paginator.pages:
-            await ctx.send(page, allowed_mentions = discord.AllowedMentions.none())
+        await self.bot.message_sender.send_pages(ctx, paginator.pages, allowed_mentions = discord.AllowedMentions.none())
 
-    async def _intersect_players(self, ctx, role_names):
-        selected_tags, unknown_tag_names = self._get_selected_tags(ctx.guild, role_names)
-        if not selected_tags:
-            return await ctx.send("No matching tags found.")
+    def _is_player_query(self, guild, role_name):
+        # an existing role always wins over the query syntax
+        return (role_name.startswith('-') or '|' in role_name) and self._get_tag_index(guild).get(role_name) is None
 
-        valid_role_names = [role.name for role in selected_tags]
+    def _parse_player_query(self, guild, role_names):
+        """Resolve !players arguments to a PlayerQuery.
 
-        players = set(selected_tags[0].members)
-        for role in selected_tags[1:]:
-            players &= set(role.members)
-        if not players:
-            return await ctx.send(f"No players who match all of the following tags: *{'*, *'.join(valid_role_names)}*.")
+        Returns the query (None if no tags were found), its human readable description and the unknown tag names.
+        A query that only excludes tags matches nobody, callers have to reject it.
+        """
+        player_index = self._get_player_index(guild)
+        query = PlayerQuery()
+        descriptions = []
+        unknown_tag_names = []
+        for role_name in role_names:
+            is_query = self._is_player_query(guild, role_name)
+            excluded = is_query and role_name.startswith('-')
+            names = role_name[1:] if excluded else role_name
+            alternatives = names.split('|') if is_query else [names]
+            selected_tags, unknown = self._get_selected_tags(guild, [name for name in alternatives if name])
+            unknown_tag_names.extend(unknown)
+            if not selected_tags:
+                continue
+            bits = [player_index.bits(tag) for tag in selected_tags]
+            description = ' or '.join(f"*{tag.name}*" for tag in selected_tags)
+            if excluded:
+                query.exclude(bits)
+                descriptions.append(f"not {description}")
+            else:
+                query.include(bits)
+                descriptions.append(description)
+        if not descriptions:
+            return None, None, unknown_tag_names
+        return query, ', '.join(descriptions), unknown_tag_names
+
+    async def _query_players(self, ctx, role_names):
+        query, description, unknown_tag_names = self._parse_player_query(ctx.guild, role_names)
+        if query is None:
+            return await ctx.send("No matching tags found.")
+        if not query.included:
+            return await ctx.send(self.EXCLUDE_ONLY_QUERY)
 
-        msg_str = ""
-        for player in players:
-            msg_str += f"{player.mention} ({discord.utils.escape_markdown(player.name)})\n"
+        player_index = self._get_player_index(ctx.guild)
+        players = player_index.members(player_index.evaluate(query))
+        if not players:
+            return await ctx.send(f"No players who match all of the following tags: {description}.")
 
         num = len(players)
-        msg_str =  f"The following tags are matched by {num} player{'s' if num != 1 else ''}: *{'*, *'.join(valid_role_names)}*.\n{msg_str}"
+        paginator = commands.Paginator(prefix='', suffix='', linesep='\n')
+        paginator.add_line(f"The following tags are matched by {num} player{'s' if num != 1 else ''}: {description}.")
+        for player in players:
+            paginator.add_line(f"{player.mention} ({discord.utils.escape_markdown(player.name)})")
         if unknown_tag_names:
-            msg_str += f"```Unknown tags: {', '.join(unknown_tag_names)}```Use **!list** to print available tags."
+            paginator.add_line(f"```Unknown tags: {', '.join(unknown_tag_names)}```Use **!list** to print available tags.")
 
-        await ctx.send(msg_str, allowed_mentions = discord.AllowedMentions.none())
+        await self.bot.message_sender.send_pages(ctx, paginator.pages, allowed_mentions = discord.AllowedMentions.none())
 
     async def _tag_item(self, ctx, item_type, item_id, tag_name):
         item = await self.igdb_wrapper.find_item_by_id(item_type, item_id)
@@ -359,10 +561,9 @@ class Gametags(commands.Cog):
             await ctx.send(f"Could not find {item_type} in external database.")
             return
 
-        available_tags = self._get_available_tags(ctx.guild)
+        available_tag_ids = self._get_available_tag_ids(ctx.guild)
 
-        tag = discord.utils.find(
-            lambda tag: tag.name.casefold() == tag_name.casefold(), available_tags)
+        tag = self._get_tag_index(ctx.guild).get(tag_name, among=available_tag_ids)
         if tag is None:
             msg = await ctx.send("No existing tag found by that name, creating now.")
             try:
@@ -399,6 +600,67 @@ class Gametags(commands.Cog):
         """
         await self._tag_item(ctx, ItemType.game, game_id, tag_name)
 
+    @commands.command(name='check_db', aliases=['cdb'])
+    @superuser_only()
+    async def check_db(self, ctx):
+        """Check that the in-memory copy of the internal database is up-to-date. (superuser-only)
+
+        Reloads the in-memory copy if any differences are found.
+        """
+        differences = await self.repository.check_consistency()
+        if differences:
+            paginator = commands.Paginator(prefix='```', suffix='```', linesep='\n')
+            paginator.add_line(f"Found {len(differences)} difference{'s' if len(differences) != 1 else ''}, reloaded from internal database:")
+            for difference in differences:
+                paginator.add_line(difference)
+            await self.bot.message_sender.send_pages(ctx, paginator.pages)
+        else:
+            await ctx.send("In-memory copy matches the internal database.")
+
+    def _complete_tags(self, guild, current, *, available_only):
+        tags = self._get_tag_index(guild).complete(current, limit=None if available_only else 25)
+        if available_only:
+            available_tag_ids = self._get_available_tag_ids(guild)
+            tags = [tag for tag in tags if tag.id in available_tag_ids][:25]
+        return [app_commands.Choice(name=tag.name, value=tag.name) for tag in tags]
+
+    @app_commands.command(name='play', description="Assigns you the given gametag.")
+    @app_commands.describe(tag="Gametag to assign")
+    @app_commands.guild_only()
+    async def play_game_slash(self, interaction: discord.Interaction, tag: str):
+        ctx = await commands.Context.from_interaction(interaction)
+        await self._assign_tags_by_name(ctx, ItemType.game, [tag])
+
+    @play_game_slash.autocomplete('tag')
+    async def _play_game_autocomplete(self, interaction: discord.Interaction, current: str):
+        return self._complete_tags(interaction.guild, current, available_only=True)
+
+    @app_commands.command(name='drop', description="Removes the given tag from you.")
+    @app_commands.describe(tag="Tag to remove")
+    @app_commands.guild_only()
+    async def drop_slash(self, interaction: discord.Interaction, tag: str):
+        ctx = await commands.Context.from_interaction(interaction)
+        await self._remove_any_tags_by_name(ctx, [tag])
+
+    @drop_slash.autocomplete('tag')
+    async def _drop_autocomplete(self, interaction: discord.Interaction, current: str):
+        # only offer the tags the member actually has
+        member_tag_ids = {role.id for role in interaction.user.roles} & self._get_available_tag_ids(interaction.guild)  # type: ignore
+        choices = self._complete_tags(interaction.guild, current, available_only=True)
+        tag_index = self._get_tag_index(interaction.guild)  # type: ignore
+        return [choice for choice in choices if tag_index.get(choice.value, among=member_tag_ids)]  # type: ignore
+
+    @app_commands.command(name='players', description="Shows players with the given tag.")
+    @app_commands.describe(tag="Tag to show players of")
+    @app_commands.guild_only()
+    async def show_players_slash(self, interaction: discord.Interaction, tag: str):
+        ctx = await commands.Context.from_interaction(interaction)
+        await self._show_players_for_single_role(ctx, tag)
+
+    @show_players_slash.autocomplete('tag')
+    async def _show_players_autocomplete(self, interaction: discord.Interaction, current: str):
+        return self._complete_tags(interaction.guild, current, available_only=False)
+
     # superuser-only commands print !help as well as print other errors
     @search_IGDB_game.error
     @tag_game.error
@@ -412,30 +674,272 @@ class Gametags(commands.Cog):
 async def setup(bot):
     await bot.add_cog(Gametags(bot))
 
-class ItemtagRepository:
+class PlayerQuery:
+    """Tags to match in a player query.
+
+    Each included group is a list of role bitsets of which a player needs to match any,
+    players matching any of the excluded bitsets are left out.
+    """
 
     def __init__(self):
-        self.data_dir = 'data/'
-        self.db_path = f'{self.data_dir}gametag.db'
+        self.included = []
+        self.excluded = []
+
+    def include(self, bits):
+        self.included.append(bits)
+
+    def exclude(self, bits):
+        self.excluded.extend(bits)
+
+class PlayerIndex:
+    """Member bitsets per role of a guild.
+
+    Every member gets a slot and a role's bitset has the bits of its members' slots set,
+    so player queries are a handful of integer operations instead of set building over Member objects.
+    """
+
+    def __init__(self, members):
+        self.__slots = {}  # member id -> slot
+        self.__members = []  # slot -> member, None for free slots
+        self.__free_slots = []
+        self.__role_bits = {}  # role id -> bitset
+
+        slots_by_role_id = {}
+        for member in members:
+            slot = self.__assign_slot(member)
+            for role in member.roles:
+                slots_by_role_id.setdefault(role.id, []).append(slot)
+        # set the bits in a byte buffer as OR-ing into a growing int one member at a time is quadratic
+        for role_id, slots in slots_by_role_id.items():
+            self.__role_bits[role_id] = self.__bits_from_slots(slots)
+
+    def __assign_slot(self, member):
+        slot = self.__free_slots.pop() if self.__free_slots else len(self.__members)
+        if slot == len(self.__members):
+            self.__members.append(member)
+        else:
+            self.__members[slot] = member
+        self.__slots[member.id] = slot
+        return slot
+
+    def __bits_from_slots(self, slots):
+        buffer = bytearray(len(self.__members) // 8 + 1)
+        for slot in slots:
+            buffer[slot >> 3] |= 1 << (slot & 7)
+        return int.from_bytes(buffer, 'little')
+
+    def add_member(self, member):
+        if member.id in self.__slots:
+            return
+        slot = self.__assign_slot(member)
+        bit = 1 << slot
+        for role in member.roles:
+            self.__role_bits[role.id] = self.__role_bits.get(role.id, 0) | bit
+
+    def remove_member(self, member):
+        slot = self.__slots.pop(member.id, None)
+        if slot is None:
+            return
+        mask = ~(1 << slot)
+        for role in member.roles:
+            if role.id in self.__role_bits:
+                self.__role_bits[role.id] &= mask
+        self.__members[slot] = None
+        self.__free_slots.append(slot)
+
+    def update_member(self, member, before_roles):
+        slot = self.__slots.get(member.id)
+        if slot is None:
+            return self.add_member(member)
+        bit = 1 << slot
+        self.__members[slot] = member
+        before_role_ids = {role.id for role in before_roles}
+        after_role_ids = {role.id for role in member.roles}
+        for role_id in before_role_ids - after_role_ids:
+            if role_id in self.__role_bits:
+                self.__role_bits[role_id] &= ~bit
+        for role_id in after_role_ids - before_role_ids:
+            self.__role_bits[role_id] = self.__role_bits.get(role_id, 0) | bit
+
+    def remove_role(self, role):
+        self.__role_bits.pop(role.id, None)
+
+    def bits(self, role):
+        return self.__role_bits.get(role.id, 0)
+
+    def evaluate(self, query):
+        """Return the bitset of the players matching query, a query without included tags matches nobody."""
+        # OR within groups, then AND the groups smallest first so the running result shrinks as early as possible
+        groups = []
+        for group in query.included:
+            bits = 0
+            for role_bits in group:
+                bits |= role_bits
+            groups.append(bits)
+        groups.sort(key=int.bit_count)
+
+        if not groups:
+            return 0
+        result = groups[0]
+        for bits in groups[1:]:
+            if not result:
+                return 0
+            result &= bits
+        for bits in query.excluded:
+            if not result:
+                return 0
+            result &= ~bits
+        return result
 
-    def setup(self):
-        pathlib.Path(self.data_dir).mkdir(parents=True, exist_ok=True)
+    def count(self, bits):
+        if isinstance(bits, PlayerQuery):
+            bits = self.evaluate(bits)
+        return bits.bit_count()
+
+    def members(self, bits):
+        members = []
+        for byte_index, byte in enumerate(bits.to_bytes((bits.bit_length() + 7) // 8, 'little')):
+            while byte:
+                low_bit = byte & -byte
+                members.append(self.__members[(byte_index << 3) + low_bit.bit_length() - 1])
+                byte ^= low_bit
+        return members
+
+class RoleTrie:
+    """Prefix tree over casefolded role names."""
+
+    def __init__(self):
+        self.children = {}
+        self.roles = {}  # role id -> role, for roles whose name ends at this node
+
+    def add(self, name, role):
+        node = self
+        for char in name:
+            node = node.children.setdefault(char, RoleTrie())
+        node.roles[role.id] = role
+
+    def remove(self, name, role):
+        path = []
+        node = self
+        for char in name:
+            path.append((node, char))
+            node = node.children.get(char)
+            if node is None:
+                return
+        node.roles.pop(role.id, None)
+        # prune the branch if nothing is left under it
+        for parent, char in reversed(path):
+            child = parent.children[char]
+            if child.roles or child.children:
+                break
+            del parent.children[char]
+
+    def complete(self, prefix, limit=None):
+        node = self
+        for char in prefix:
+            node = node.children.get(char)
+            if node is None:
+                return []
+        roles = []
+        # depth first in character order yields the roles sorted by name
+        stack = [node]
+        while stack and (limit is None or len(roles) < limit):
+            node = stack.pop()
+            roles.extend(node.roles.values())
+            stack.extend(node.children[char] for char in sorted(node.children, reverse=True))
+        return roles if limit is None else roles[:limit]
+
+class TagIndex:
+    """Casefolded name lookup and prefix completion over the roles of a guild."""
+
+    def __init__(self, roles):
+        self.__roles_by_name = {}  # casefolded name -> {role id: role}
+        self.__trie = RoleTrie()
+        for role in roles:
+            self.add(role)
+
+    def add(self, role):
+        name = role.name.casefold()
+        self.__roles_by_name.setdefault(name, {})[role.id] = role
+        self.__trie.add(name, role)
+
+    def remove(self, role):
+        name = role.name.casefold()
+        roles = self.__roles_by_name.get(name, {})
+        roles.pop(role.id, None)
+        if not roles:
+            self.__roles_by_name.pop(name, None)
+        self.__trie.remove(name, role)
+
+    def get(self, name, among=None):
+        """Return the role called name, only considering the role ids in among if given (e.g. the available tags)."""
+        roles = self.__roles_by_name.get(name.casefold())
+        if not roles:
+            return None
+        if among is not None:
+            roles = {role_id: role for role_id, role in roles.items() if role_id in among}
+            if not roles:
+                return None
+        # same as searching guild.roles in order when several roles share a name
+        return min(roles.values(), key=lambda role: role.position)
+
+    def complete(self, prefix, limit=25):
+        return self.__trie.complete(prefix.casefold(), limit)
 
-        # TODO use closing context manager instead of try/except once sqlite3 autocommit parameter becomes available for connect (python>=3.12)
-            # - all DB connections should turn off autocommit and manually commit changes for clarity
-            # - conn.commit() will need to be called for all DB changes
-            # - conn.rollback() and conn.close() will be handled by the closing context manager (i.e. less boilerplate)
-            # - cursor.execute('BEGIN') will be handled by first cursor.execute() that implicitly triggers a transaction as needed (e.g. INSERT)
-                # so remove explicit call
-            # Example: with closing(sqlite3.connect(self.db_path, autocommit=False)) as conn:
-        conn = sqlite3.connect(self.db_path)
+class ItemtagRepository:
+
+    # upper limit on the number of writes committed together
+    MAX_WRITE_BATCH = 256
+
+    def __init__(self, data_dir='data/'):
+        self.data_dir = data_dir
+        self.db_path = f'{self.data_dir}gametag.db'
+        # sqlite3 connections are bound to the thread that created them,
+        # so a single worker thread owns the connection and runs every query
+        self.__executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='gametag-db')
+        self.__conn = None
+        # writes are queued and committed in groups, see __write_batches
+        self.__writes = asyncio.Queue()
+        self.__writer = None
+        # every read is answered from the snapshot, writes update it once committed
+        self.__snapshot = ItemtagSnapshot()
+        # incremented on every change to the snapshot so callers can tell when derived data is stale
+        self.version = 0
+
+    async def __run(self, func, *args):
+        with io_timer():
+            return await asyncio.get_running_loop().run_in_executor(self.__executor, func, *args)
+
+    @contextmanager
+    def __transaction(self):
+        # connection is in autocommit mode (isolation_level=None) so transactions are explicit
+        cursor = self.__conn.cursor()
+        cursor.execute('BEGIN')
         try:
-            cursor = conn.cursor()
-            cursor.execute('PRAGMA journal_mode = wal')
-            cursor.execute('PRAGMA foreign_keys = ON')
+            yield cursor
+        except:
+            cursor.execute('ROLLBACK')
+            raise
+        else:
+            cursor.execute('COMMIT')
 
-            cursor.execute('BEGIN')
+    async def setup(self):
+        await self.__run(self.__setup)
+        self.__snapshot = await self.__run(self.__load_snapshot)
+        self.version += 1
+        self.__writer = asyncio.create_task(self.__write_batches())
 
+    def __setup(self):
+        pathlib.Path(self.data_dir).mkdir(parents=True, exist_ok=True)
+
+        self.__conn = sqlite3.connect(self.db_path, isolation_level=None, cached_statements=64)
+        cursor = self.__conn.cursor()
+        cursor.execute('PRAGMA journal_mode = wal')
+        # in WAL mode NORMAL is safe from corruption and avoids an fsync on every commit
+        cursor.execute('PRAGMA synchronous = normal')
+        cursor.execute('PRAGMA foreign_keys = ON')
+
+        with self.__transaction() as cursor:
             cursor.execute("""
                 CREATE TABLE IF NOT EXISTS tags (
                     id INTEGER PRIMARY KEY,
@@ -472,163 +976,494 @@ class ItemtagRepository:
             #         FOREIGN KEY (platform_id) REFERENCES platforms(id)
             #     )"""
             # )
-            conn.commit()
-        except:
-            conn.rollback()
-            raise
-        finally:
-            conn.close()
+
+    def __load_snapshot(self):
+        snapshot = ItemtagSnapshot()
+        cursor = self.__conn.cursor()
+        for item_type in ItemType:
+            cursor.execute(f"SELECT id, name FROM {item_type}s")
+            for item_id, item_name in cursor.fetchall():
+                snapshot.add_item(Item(item_type, item_id, item_name))
+            cursor.execute(f"SELECT tag_id, {item_type}_id FROM {item_type}_tags")
+            for tag_id, item_id in cursor.fetchall():
+                snapshot.set_tag(item_type, item_id, tag_id)
+        return snapshot
+
+    async def close(self):
+        if self.__writer is not None:
+            # let queued writes finish before closing the connection
+            self.__writes.put_nowait(None)
+            await self.__writer
+            self.__writer = None
+        await self.__run(self.__close)
+        self.__executor.shutdown(wait=False)
+
+    def __close(self):
+        if self.__conn is not None:
+            self.__conn.close()
+            self.__conn = None
+
+    async def __write(self, func, *args):
+        future = asyncio.get_running_loop().create_future()
+        self.__writes.put_nowait((func, args, future))
+        with io_timer():
+            return await future
+
+    async def __write_batches(self):
+        # writes queue up while the previous batch is being committed, so under load each
+        # transaction (and fsync) covers many writes while a lone write is committed right away
+        while True:
+            write = await self.__writes.get()
+            if write is None:
+                return
+            batch = [write]
+            while len(batch) < self.MAX_WRITE_BATCH and not self.__writes.empty():
+                write = self.__writes.get_nowait()
+                if write is None:
+                    # handle the close request after this batch
+                    self.__writes.put_nowait(None)
+                    break
+                batch.append(write)
+            try:
+                results = await self.__run(self.__commit_batch, [(func, args) for func, args, _ in batch])
+            except Exception as e:
+                results = [(None, e)] * len(batch)
+            for (_, _, future), (result, error) in zip(batch, results):
+                if future.done():
+                    continue
+                if error is None:
+                    future.set_result(result)
+                else:
+                    future.set_exception(error)
+
+    def __commit_batch(self, batch):
+        results = []
+        with self.__transaction() as cursor:
+            for func, args in batch:
+                # a savepoint per write keeps one failing write from rolling back the others
+                cursor.execute('SAVEPOINT write')
+                try:
+                    results.append((func(cursor, *args), None))
+                except sqlite3.Error as e:
+                    cursor.execute('ROLLBACK TO write')
+                    results.append((None, e))
+                cursor.execute('RELEASE write')
+        return results
 
     async def add_item(self, item):
-        conn = sqlite3.connect(self.db_path)
         try:
-            # TODO see note on autocommit
-            with closing(sqlite3.connect(self.db_path)) as conn:
-                cursor = conn.cursor()
-                cursor.execute(f"INSERT INTO {item.type}s (id, name) VALUES (?, ?)", [item.id, item.name])
-                conn.commit()  # not sure why this is needed with the expected autocommit behaviour but it is
-            return True
+            await self.__write(self.__insert_item, item)
         except sqlite3.IntegrityError:
             return False
+        self.__snapshot.add_item(item)
+        self.version += 1
+        return True
 
-    async def add_itemtag(self, itemtag):
-        item = itemtag.item
-        tag = itemtag.tag
-
-        # TODO see note on autocommit
-        conn = sqlite3.connect(self.db_path)
-        try:
-            cursor = conn.cursor()
-            cursor.execute('BEGIN')
-
-            # insert or replace into tags
-            cursor.execute("""
-                REPLACE INTO tags (id)
-                VALUES (?)
-            """, [tag.id])
-            # insert or replace into <item_type>_tags
-            cursor.execute(f"""
-                REPLACE INTO {item.type}_tags (tag_id, {item.type}_id)
-                VALUES (?, ?)
-            """, [tag.id, item.id])
-
-            conn.commit()
-        except:
-            conn.rollback()
-            raise
-        finally:
-            conn.close()
+    @staticmethod
+    def __insert_item(cursor, item):
+        cursor.execute(f"INSERT INTO {item.type}s (id, name) VALUES (?, ?)", [item.id, item.name])
 
+    async def add_itemtag(self, itemtag):
+        await self.__write(self.__replace_itemtag, itemtag.item, itemtag.tag.id)
+        self.__snapshot.set_tag(itemtag.item.type, itemtag.item.id, itemtag.tag.id)
+        self.version += 1
+
+    @staticmethod
+    def __replace_itemtag(cursor, item, tag_id):
+        # insert or replace into tags
+        cursor.execute("""
+            REPLACE INTO tags (id)
+            VALUES (?)
+        """, [tag_id])
+        # insert or replace into <item_type>_tags
+        cursor.execute(f"""
+            REPLACE INTO {item.type}_tags (tag_id, {item.type}_id)
+            VALUES (?, ?)
+        """, [tag_id, item.id])
 
     async def find_item_by_tag(self, item_type, tag):
-        item = None
-        with closing(sqlite3.connect(self.db_path)) as conn:
-            cursor = conn.cursor()
-
-            cursor.execute(f"""
-                SELECT {item_type}s.id, {item_type}s.name
-                FROM {item_type}s
-                INNER JOIN {item_type}_tags ON {item_type}s.id = {item_type}_tags.{item_type}_id
-                WHERE {item_type}_tags.tag_id = ?
-            """, [tag.id])
-
-            row = cursor.fetchone()
-            if (row):
-                item = Item(item_type, row[0], row[1])
-        return item
+        return self.__snapshot.items_by_tag_id[item_type].get(tag.id)
 
     async def find_any_item_by_tag(self, tag):
         item = None
         for item_type in ItemType:
-            item = await self.find_item_by_tag(item_type, tag)
+            item = self.__snapshot.items_by_tag_id[item_type].get(tag.id)
             if item:
                 break
         return item
 
     async def find_itemtags_by_tags(self, item_type, tags, *, all = False):
-        rows = []
-        with closing(sqlite3.connect(self.db_path)) as conn:
-            cursor = conn.cursor()
-
-            if all:
-                cursor.execute(f"""
-                    SELECT {item_type}_tags.tag_id, {item_type}s.id, {item_type}s.name
-                    FROM {item_type}s
-                    LEFT OUTER JOIN {item_type}_tags ON {item_type}s.id = {item_type}_tags.{item_type}_id
-                    ORDER BY {item_type}s.name ASC
-                """)
-            else:
-                cursor.execute(f"""
-                    SELECT {item_type}_tags.tag_id, {item_type}s.id, {item_type}s.name
-                    FROM {item_type}s
-                    INNER JOIN {item_type}_tags ON {item_type}s.id = {item_type}_tags.{item_type}_id
-                    WHERE {item_type}_tags.tag_id IN (?{(len(tags) - 1) * ', ?'})
-                    ORDER BY {item_type}s.name ASC
-                """, [tag.id for tag in tags])
-            rows = cursor.fetchall()
-
+        tags_by_id = {tag.id: tag for tag in tags}
         itemtags = []
-        if rows:
-            for tag_id, item_id, item_name in rows:
-                item = Item(item_type, item_id, item_name)
-                tag = discord.utils.get(tags, id=tag_id)
-                itemtags.append(Itemtag(item, tag))
+        if all:
+            tag_ids_by_item_id = self.__snapshot.tag_ids_by_item_id[item_type]
+            for item in self.__snapshot.sorted_items[item_type]:
+                itemtags.append(Itemtag(item, tags_by_id.get(tag_ids_by_item_id.get(item.id))))
+        else:
+            items_by_tag_id = self.__snapshot.items_by_tag_id[item_type]
+            for tag in tags_by_id.values():
+                item = items_by_tag_id.get(tag.id)
+                if item:
+                    itemtags.append(Itemtag(item, tag))
+            itemtags.sort(key=lambda itemtag: ItemtagSnapshot.sort_key(itemtag.item))
         return itemtags
 
+    async def check_consistency(self):
+        """Compare the in-memory snapshot with the database.
+
+        Returns a list of differences, the snapshot is reloaded from the database if there were any.
+        """
+        snapshot = await self.__run(self.__load_snapshot)
+        differences = self.__snapshot.diff(snapshot)
+        if differences:
+            log.warning(f"In-memory snapshot differed from database, reloading: {differences}")
+            self.__snapshot = snapshot
+            self.version += 1
+        return differences
+
+class ItemtagSnapshot:
+    """In-memory copy of the items and their tags, per item type."""
+
+    def __init__(self):
+        self.items_by_id = {item_type: {} for item_type in ItemType}
+        self.items_by_tag_id = {item_type: {} for item_type in ItemType}
+        self.tag_ids_by_item_id = {item_type: {} for item_type in ItemType}
+        self.sorted_items = {item_type: [] for item_type in ItemType}
+
+    @staticmethod
+    def sort_key(item):
+        # SQLite's default collation compares UTF-8 bytes which orders the same as code points
+        return (item.name, item.id)
+
+    def add_item(self, item):
+        if item.id in self.items_by_id[item.type]:
+            return
+        item = Item(item.type, item.id, item.name)
+        self.items_by_id[item.type][item.id] = item
+        bisect.insort(self.sorted_items[item.type], item, key=self.sort_key)
+
+    def set_tag(self, item_type, item_id, tag_id):
+        item = self.items_by_id[item_type][item_id]
+        items_by_tag_id = self.items_by_tag_id[item_type]
+        tag_ids_by_item_id = self.tag_ids_by_item_id[item_type]
+        # mirrors REPLACE INTO which drops rows conflicting on either the tag or the item
+        previous_item = items_by_tag_id.pop(tag_id, None)
+        if previous_item:
+            del tag_ids_by_item_id[previous_item.id]
+        previous_tag_id = tag_ids_by_item_id.pop(item_id, None)
+        if previous_tag_id is not None:
+            del items_by_tag_id[previous_tag_id]
+        items_by_tag_id[tag_id] = item
+        tag_ids_by_item_id[item_id] = tag_id
+
+    def diff(self, other):
+        differences = []
+        for item_type in ItemType:
+            for name, mine, theirs in (
+                ('items', self.items_by_id[item_type], other.items_by_id[item_type]),
+                ('tags', self.tag_ids_by_item_id[item_type], other.tag_ids_by_item_id[item_type]),
+            ):
+                for key in mine.keys() | theirs.keys():
+                    if mine.get(key) != theirs.get(key):
+                        differences.append(f"{item_type} {name} #{key}: memory {mine.get(key)}, database {theirs.get(key)}")
+        return differences
+
 class IgdbWrapper:
 
-    def __init__(self, igdb_client_id, igdb_client_secret):
-        self.__igdb_url = "https://api.igdb.com/v4/"
-        self.__twitch_url = "https://id.twitch.tv/oauth2/token"
+    # renew the access token this many seconds before Twitch would expire it
+    TOKEN_EXPIRY_MARGIN = 60
+
+    def __init__(self, igdb_client_id, igdb_client_secret, *,
+                 igdb_url="https://api.igdb.com/v4/", twitch_url="https://id.twitch.tv/oauth2/token",
+                 timeout=10, pool_size=8, cache_size=512, cache_ttl=3600, rate_limit=4, max_open_requests=8):
+        self.__igdb_url = igdb_url
+        self.__twitch_url = twitch_url
         self.__IGDB_CLIENT_ID = igdb_client_id
         self.__IGDB_CLIENT_SECRET = igdb_client_secret
         self.__access_token = None
-
-    async def __renew_access_token(self):
-        log.info('Renewing IGDB access token')
-        payload = {'client_id': self.__IGDB_CLIENT_ID, 'client_secret': self.__IGDB_CLIENT_SECRET, 'grant_type': 'client_credentials'}
-        result = requests.post(self.__twitch_url, params=payload)
-        result.raise_for_status()
-        self.__access_token = result.json()['access_token']
+        self.__access_token_expires_at = 0.0
+        self.__token_lock = asyncio.Lock()
+        self.__timeout = aiohttp.ClientTimeout(total=timeout)
+        self.__pool_size = pool_size
+        self.__session = None
+        # keys are (item_type, 'id', item_id) and (item_type, 'name', normalized_name)
+        self.cache = TTLCache(cache_size, cache_ttl)
+        self.scheduler = IgdbScheduler(self.__post_query, rate_limit=rate_limit, max_open_requests=max_open_requests)
+
+    def __get_session(self):
+        # created lazily as aiohttp sessions have to be created inside the running event loop
+        if self.__session is None or self.__session.closed:
+            connector = aiohttp.TCPConnector(limit=self.__pool_size, keepalive_timeout=60)
+            self.__session = aiohttp.ClientSession(connector=connector, timeout=self.__timeout)
+        return self.__session
+
+    async def close(self):
+        await self.scheduler.close()
+        if self.__session is not None:
+            await self.__session.close()
+            self.__session = None
+
+    def __has_valid_token(self):
+        return self.__access_token is not None and time.monotonic() < self.__access_token_expires_at
+
+    async def __renew_access_token(self, stale_token):
+        async with self.__token_lock:
+            # concurrent requests share a single renewal
+            if self.__access_token != stale_token and self.__has_valid_token():
+                return
+            log.info('Renewing IGDB access token')
+            payload = {'client_id': self.__IGDB_CLIENT_ID, 'client_secret': self.__IGDB_CLIENT_SECRET, 'grant_type': 'client_credentials'}
+            async with self.__get_session().post(self.__twitch_url, params=payload) as result:
+                result.raise_for_status()
+                body = await result.json()
+            self.__access_token = body['access_token']
+            expires_in = body.get('expires_in')
+            if expires_in is None:
+                # no expiry given, rely on the 401 response to trigger a renewal
+                self.__access_token_expires_at = float('inf')
+            else:
+                self.__access_token_expires_at = time.monotonic() + max(0, expires_in - self.TOKEN_EXPIRY_MARGIN)
 
     async def __post_request(self, url, data):
+        if not self.__has_valid_token():
+            await self.__renew_access_token(self.__access_token)
         for i in range(2):
+            token = self.__access_token
             headers = {
                 'Client-ID': self.__IGDB_CLIENT_ID,
-                'Authorization': f"Bearer {self.__access_token}",
+                'Authorization': f"Bearer {token}",
                 'Accept': 'application/json',
             }
-            try:
-                result = requests.post(url, data=data, headers=headers)
-                result.raise_for_status()
-            except requests.exceptions.HTTPError as err:
-                if err.response.status_code == 401:
-                    log.info(err)
-                    await self.__renew_access_token()
-                    continue
-                log.error(err)
-        return result
+            async with self.__get_session().post(url, data=data, headers=headers) as result:
+                if result.status == 401 and i == 0:
+                    log.info(f"IGDB rejected access token ({result.status} {result.reason})")
+                else:
+                    result.raise_for_status()
+                    return await result.json()
+            await self.__renew_access_token(token)
+
+    async def __post_query(self, endpoint, data):
+        return await self.__post_request(self.__igdb_url + f"{endpoint}/", data)
+
+    @staticmethod
+    def __normalize_name(item_name):
+        return ' '.join(item_name.casefold().split())
+
+    @staticmethod
+    def __escape(text):
+        # user input ends up inside a quoted string of the query
+        return text.replace('\\', '\\\\').replace('"', '\\"')
 
     async def find_item_by_id(self, item_type, item_id):
-        url = self.__igdb_url + f"{item_type}s/"
+        key = (item_type, 'id', item_id)
+        item = self.cache.get(key)
+        if item:
+            return item
+
         # TODO validate/sanitize
         data = f"fields id,name; where id = {item_id};"
 
-        result = await self.__post_request(url, data)
-        result.body = result.json()  # type: ignore
-        elem = result.body[0] if result.body else None  # type: ignore
+        body = await self.scheduler.query(f"{item_type}s", data)
+        elem = body[0] if body else None
         item = None
         if elem:
             item = Item(item_type, elem['id'], elem['name'])
+            self.cache.set(key, item)
         return item
 
     async def find_items_by_name(self, item_type, item_name):
-        url = self.__igdb_url + f"{item_type}s/"
-        # TODO validate/sanitize
-        data = f"fields id,name,slug; sort first_release_date desc; limit 20; where name ~ *\"{item_name}\"*;"
+        key = (item_type, 'name', self.__normalize_name(item_name))
+        items = self.cache.get(key)
+        if items is not None:
+            return list(items)
 
-        result = await self.__post_request(url, data)
+        data = f"fields id,name,slug; sort first_release_date desc; limit 20; where name ~ *\"{self.__escape(item_name)}\"*;"
+
+        body = await self.scheduler.query(f"{item_type}s", data)
         items = []
-        for elem in result.json():
+        for elem in body:
             items.append(Item(item_type, elem['id'], elem['name'], elem['slug']))
+
+        self.cache.set(key, tuple(items))
+        # a search is usually followed by tagging one of the results so prime the id lookups as well
+        for item in items:
+            self.cache.set((item_type, 'id', item.id), item)
         return items
+
+@dataclass
+class IgdbQuery:
+    endpoint: str
+    data: str
+    future: asyncio.Future
+    retries: int = field(default=0)
+    alone: bool = field(default=False)  # sent on its own after its multiquery was rejected
+
+    @property
+    def key(self):
+        return (self.endpoint, self.data)
+
+class IgdbScheduler:
+    """Sends IGDB queries in arrival order without exceeding the API rate limit.
+
+    Identical queries that are already queued or in flight share a single request.
+    A query arriving while the scheduler is idle goes out right away, during a burst
+    the queries arriving within the same batching window are sent together through /multiquery.
+    """
+
+    # maximum number of queries IGDB accepts in a single multiquery
+    MULTIQUERY_LIMIT = 10
+
+    def __init__(self, post_query, *, rate_limit=4, max_open_requests=8, batch_window=0.05, max_retries=3):
+        self.__post_query = post_query
+        self.__rate_limit = rate_limit
+        # the bucket only holds a single token as IGDB counts requests over a sliding window and rejects bursts
+        self.__tokens = 1.0
+        self.__last_refill = time.monotonic()
+        self.__paused_until = 0.0
+        self.__open_requests = asyncio.Semaphore(max_open_requests)
+        self.__batch_window = batch_window
+        self.__max_retries = max_retries
+        self.__queue = deque()
+        self.__pending = {}  # (endpoint, data) -> IgdbQuery, both queued and in flight
+        self.__wakeup = asyncio.Event()
+        self.__arrivals = 0
+        self.__worker = None
+        self.__dispatches = set()
+        self.requests = 0
+        self.coalesced = 0
+        self.rate_limited = 0
+
+    async def query(self, endpoint, data):
+        query = self.__pending.get((endpoint, data))
+        if query is not None:
+            self.coalesced += 1
+        else:
+            query = IgdbQuery(endpoint, data, asyncio.get_running_loop().create_future())
+            self.__pending[query.key] = query
+            self.__queue.append(query)
+            self.__arrivals += 1
+            self.__wakeup.set()
+            if self.__worker is None or self.__worker.done():
+                self.__worker = asyncio.create_task(self.__run())
+        # shielded so that one cancelled caller doesn't cancel the request for the others sharing it
+        with io_timer():
+            return await asyncio.shield(query.future)
+
+    async def close(self):
+        if self.__worker is not None:
+            self.__worker.cancel()
+            self.__worker = None
+        for task in list(self.__dispatches):
+            task.cancel()
+        for query in self.__pending.values():
+            if not query.future.done():
+                query.future.cancel()
+        self.__pending.clear()
+        self.__queue.clear()
+
+    async def __acquire_token(self):
+        while True:
+            now = time.monotonic()
+            if now < self.__paused_until:
+                await asyncio.sleep(self.__paused_until - now)
+                continue
+            self.__tokens = min(1.0, self.__tokens + (now - self.__last_refill) * self.__rate_limit)
+            self.__last_refill = now
+            if self.__tokens >= 1:
+                self.__tokens -= 1
+                return
+            await asyncio.sleep((1 - self.__tokens) / self.__rate_limit)
+
+    async def __run(self):
+        idle = True
+        while True:
+            if not self.__queue:
+                idle = True
+                self.__wakeup.clear()
+                await self.__wakeup.wait()
+            await self.__acquire_token()
+            await self.__open_requests.acquire()
+            if not idle:
+                # queries kept arriving while the previous batch went out, let the rest of the burst share a multiquery
+                while len(self.__queue) < self.MULTIQUERY_LIMIT:
+                    arrivals = self.__arrivals
+                    await asyncio.sleep(self.__batch_window)
+                    if self.__arrivals == arrivals:
+                        break
+            batch = self.__next_batch()
+            if not batch:
+                self.__open_requests.release()
+                continue
+            idle = False
+            task = asyncio.create_task(self.__dispatch(batch))
+            self.__dispatches.add(task)
+            task.add_done_callback(self.__dispatches.discard)
+
+    def __next_batch(self):
+        batch = []
+        while self.__queue and len(batch) < self.MULTIQUERY_LIMIT:
+            if self.__queue[0].alone and batch:
+                break
+            batch.append(self.__queue.popleft())
+            if batch[0].alone:
+                break
+        return batch
+
+    async def __dispatch(self, batch):
+        self.requests += 1
+        try:
+            if len(batch) == 1:
+                results = [await self.__post_query(batch[0].endpoint, batch[0].data)]
+            else:
+                data = ''.join(f'query {query.endpoint} "{i}" {{ {query.data} }};\n' for i, query in enumerate(batch))
+                body = await self.__post_query('multiquery', data)
+                results_by_name = {elem['name']: elem['result'] for elem in body}
+                results = [results_by_name.get(str(i), []) for i in range(len(batch))]
+        except aiohttp.ClientResponseError as err:
+            if err.status == 429:
+                self.__retry_later(batch)
+            elif len(batch) > 1:
+                self.__retry_alone(batch, err)
+            else:
+                self.__fail(batch, err)
+        except Exception as err:
+            self.__fail(batch, err)
+        else:
+            for query, result in zip(batch, results):
+                self.__finish(query)
+                if not query.future.done():
+                    query.future.set_result(result)
+        finally:
+            self.__open_requests.release()
+
+    def __retry_later(self, batch):
+        self.rate_limited += 1
+        log.warning(f"IGDB rate limit hit, requeueing {len(batch)} queries")
+        # pause the whole queue as the limit applies to every request
+        self.__paused_until = time.monotonic() + 1
+        self.__tokens = 0
+        for query in reversed(batch):
+            query.retries += 1
+            if query.retries > self.__max_retries:
+                self.__fail([query], RuntimeError("IGDB rate limit retries exhausted"))
+            else:
+                self.__queue.appendleft(query)
+        self.__wakeup.set()
+
+    def __retry_alone(self, batch, err):
+        # IGDB rejects the whole multiquery for a single bad query, only that one should fail
+        log.warning(f"IGDB rejected a multiquery of {len(batch)} queries ({err.status}), sending them one by one")
+        for query in reversed(batch):
+            query.alone = True
+            self.__queue.appendleft(query)
+        self.__wakeup.set()
+
+    def __fail(self, batch, err):
+        for query in batch:
+            self.__finish(query)
+            if not query.future.done():
+                query.future.set_exception(err)
+
+    def __finish(self, query):
+        if self.__pending.get(query.key) is query:
+            del self.__pending[query.key]
@@ -1,65 +1,295 @@
 import discord
 from discord.ext import commands
+import asyncio
+from collections import OrderedDict
+import functools
+import json
 import logging
-import re
+import os
+import pathlib
+
+from cache import TTLCache
+from instrumentation import timed
+from link_rewriter import DEFAULT_RULES, LinkRewriter, RewriteRule
 
 log = logging.getLogger(__name__)
 
 UNDO_EMOJI_NAME = '\u21a9\ufe0f'  # :leftwards_arrow_with_hook:
 
+class ChannelQueue:
+    """Runs actions one at a time per channel, spaced out by interval while there's a backlog.
+
+    Actions are keyed, submitting an action for a key that's still pending replaces
+    the pending one but keeps its place in the queue. An action still rate limited after
+    discord.py's own retries pauses the channel for Retry-After, or backoff seconds without one.
+    """
+
+    def __init__(self, interval, *, backoff=30.0):
+        self.interval = interval
+        self.backoff = backoff
+        self.__pending = {}  # channel id -> OrderedDict of key -> action
+        self.__workers = {}  # channel id -> task
+        self.submitted = 0
+        self.coalesced = 0
+
+    def submit(self, channel_id, key, action):
+        pending = self.__pending.setdefault(channel_id, OrderedDict())
+        self.submitted += 1
+        if key in pending:
+            self.coalesced += 1
+        pending[key] = action
+        if channel_id not in self.__workers:
+            self.__workers[channel_id] = asyncio.create_task(self.__work(channel_id))
+
+    def discard(self, channel_id, key):
+        self.__pending.get(channel_id, {}).pop(key, None)
+
+    def pending(self):
+        return sum(len(pending) for pending in self.__pending.values())
+
+    def close(self):
+        for worker in self.__workers.values():
+            worker.cancel()
+
+    async def __work(self, channel_id):
+        pending = self.__pending[channel_id]
+        try:
+            while pending:
+                _, action = pending.popitem(last=False)
+                try:
+                    await action()
+                except discord.HTTPException as e:
+                    log.exception(e)
+                    if e.status == 429:
+                        # discord.py already retried, the channel is in trouble so back off
+                        await asyncio.sleep(self.__retry_after(e))
+                except Exception:
+                    log.exception("Channel action failed")
+                if pending:
+                    # stays clear of the per-channel buckets (e.g. 5 messages per 5 seconds) during bursts
+                    await asyncio.sleep(self.interval)
+        finally:
+            del self.__workers[channel_id]
+            if not pending:
+                del self.__pending[channel_id]
+
+    def __retry_after(self, e):
+        # HTTPException doesn't parse the header, only RateLimited (raised before sending) has retry_after
+        try:
+            return float(e.response.headers['Retry-After'])
+        except (AttributeError, KeyError, TypeError, ValueError):
+            return self.backoff
+
 class Vxtwitter(commands.Cog):
+    """Replies to links of sites with broken embeds with links to fixed embeds."""
 
-    def __init__(self, bot):
+    def __init__(self, bot, rules=DEFAULT_RULES, *, tracked_replies=10000, tracked_reply_ttl=7 * 24 * 60 * 60,
+                 tracked_replies_path=None, tracked_replies_save_interval=10 * 60, reply_interval=1.0):
         self.bot = bot
+        self.link_rewriter = LinkRewriter(rules)
+        # reply id -> (original message id, channel id, original author id), replies
+        # that fell out of here can no longer be undone
+        self.replies = TTLCache(tracked_replies, tracked_reply_ttl)
+        # original message id -> (reply id, links of the reply or None if not known)
+        self.replies_by_original = TTLCache(tracked_replies, tracked_reply_ttl)
+        # original message id -> links of the message when its reply was undone, restoring the
+        # embeds of an uncached message looks like any other edit and would post the reply again
+        self.undone_links = TTLCache(tracked_replies, tracked_reply_ttl)
+        self.reply_queue = ChannelQueue(reply_interval)
+        # optional, the tracked replies are forgotten on restart if not set
+        self.replies_path = tracked_replies_path
+        self.replies_save_interval = tracked_replies_save_interval
+        self.replies_lock = asyncio.Lock()
+        self.replies_saver = None
+        self.unsaved_replies = 0
+
+    async def cog_load(self):
+        if self.replies_path:
+            try:
+                self.replies.load(await asyncio.to_thread(self._read_replies, self.replies_path))
+                self.replies_by_original.load([(original_id, expires_at, (reply_id, None))
+                                               for reply_id, expires_at, (original_id, _, _) in self.replies.dump()])
+            except FileNotFoundError:
+                pass
+            except:
+                log.exception("Failed to load tracked replies")
+            self.replies_saver = asyncio.create_task(self._save_replies_periodically())
+
+    async def cog_unload(self):
+        self.reply_queue.close()
+        if self.replies_saver is not None:
+            self.replies_saver.cancel()
+            self.replies_saver = None
+        if self.replies_path:
+            await self._save_replies()
+
+    async def _save_replies(self):
+        # the lock keeps a periodic save and the one on unload from writing the file at the same time
+        async with self.replies_lock:
+            entries = self.replies.dump()
+            self.unsaved_replies = 0
+            try:
+                await asyncio.to_thread(self._write_replies, self.replies_path, entries)
+            except:
+                log.exception("Failed to save tracked replies")
+
+    async def _save_replies_periodically(self):
+        while True:
+            await asyncio.sleep(self.replies_save_interval)
+            if self.unsaved_replies:
+                # shielded so that unloading the cog doesn't abandon a write halfway
+                await asyncio.shield(self._save_replies())
+
+    @staticmethod
+    def _read_replies(path):
+        with open(path, encoding='utf-8') as f:
+            # JSON turns the tuple values into lists
+            return [(key, expires_at, tuple(value)) for key, expires_at, value in json.load(f)]
+
+    @staticmethod
+    def _write_replies(path, entries):
+        path = pathlib.Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # replaced atomically so a crash while saving leaves the previous file intact
+        temp_path = path.with_name(path.name + '.tmp')
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(entries, f)
+        os.replace(temp_path, path)
+
+    def cache_stats(self):
+        return {
+            'tracked replies': self.replies.stats(),
+            'reply queue': {
+                'pending': self.reply_queue.pending(),
+                'submitted': self.reply_queue.submitted,
+                'coalesced': self.reply_queue.coalesced,
+            },
+        }
+
+    def track_reply(self, reply, message, links):
+        self.replies.set(reply.id, (message.id, message.channel.id, message.author.id))
+        self.replies_by_original.set(message.id, (reply.id, links))
+        self.unsaved_replies += 1
+
+    def forget_reply(self, reply_id):
+        tracked = self.replies.pop(reply_id)
+        if tracked is not None:
+            self.replies_by_original.pop(tracked[0])
+            self.unsaved_replies += 1
+        return tracked
 
     @commands.Cog.listener()
+    @timed
     async def on_message(self, message):
         if message.author.bot or message.type not in (discord.MessageType.default, discord.MessageType.reply):
             return
-        links = self.generate_vxtwitter_links(message.content)
-        if not links:
+        if not self.generate_fixed_links(message.content):
             return
-        reply = await message.reply(links, mention_author=False)
-        await reply.add_reaction(UNDO_EMOJI_NAME)
-        await message.edit(suppress=True)
+        self.reply_queue.submit(message.channel.id, message.id, functools.partial(self.sync_reply, message))
 
     @commands.Cog.listener()
+    @timed
+    async def on_raw_message_edit(self, payload):
+        # on_message_edit only fires for messages still in the message cache
+        after = payload.message
+        if after.author.bot or after.type not in (discord.MessageType.default, discord.MessageType.reply):
+            return
+        links = self.generate_fixed_links(after.content)
+        before = payload.cached_message
+        if before is None:
+            # embeds getting resolved or suppressed also count as edits, only act on edits by the author
+            if after.edited_at is None:
+                return
+        elif before.content == after.content or links == self.generate_fixed_links(before.content):
+            return
+        if links is not None and self.undone_links.get(after.id) == links:
+            return
+        if not links and after.id not in self.replies_by_original:
+            return
+        self.reply_queue.submit(after.channel.id, after.id, functools.partial(self.sync_reply, after))
+
+    async def sync_reply(self, message):
+        """Post, update or delete the reply to message so it matches the message's current links."""
+        links = self.generate_fixed_links(message.content)
+        tracked = self.replies_by_original.get(message.id)
+        if tracked is None:
+            if not links:
+                return
+            reply = await message.reply(links, mention_author=False)
+            self.track_reply(reply, message, links)
+            await reply.add_reaction(UNDO_EMOJI_NAME)
+            await message.edit(suppress=True)
+            return
+        reply_id, reply_links = tracked
+        reply = message.channel.get_partial_message(reply_id)
+        if not links:
+            self.forget_reply(reply_id)
+            try:
+                await reply.delete()
+            except discord.NotFound:
+                pass
+        elif links != reply_links:
+            await reply.edit(content=links)
+            self.replies_by_original.set(message.id, (reply_id, links))
+
+    @commands.Cog.listener()
+    @timed
     async def on_raw_reaction_add(self, payload):
         if payload.emoji.name != UNDO_EMOJI_NAME or payload.user_id == self.bot.user.id:
             return
-        channel = self.bot.get_channel(payload.channel_id)
-        msg = await channel.fetch_message(payload.message_id)
-        if msg.author != self.bot.user:
-            # if it ain't mine then why are we still here?
-            return
-        ref = msg.reference.resolved  # this will raise AttributeError if no ref but that's fine
-        if not ref:
-            # temporarily couldn't fetch ref, user should retry later
+        # if it ain't mine then why are we still here?
+        tracked = self.replies.get(payload.message_id)
+        if tracked is None:
             return
-        if not isinstance(ref, discord.DeletedReferencedMessage):
-            if ref.author.id != payload.user_id and not payload.member.guild_permissions.manage_messages:
+        original_id, channel_id, author_id = tracked
+        channel = self.bot.get_channel(channel_id) or self.bot.get_partial_messageable(channel_id)
+        original = discord.utils.get(self.bot.cached_messages, id=original_id)
+        if original is None:
+            try:
+                original = await channel.fetch_message(original_id)
+            except discord.NotFound:
+                pass
+        if original is not None:
+            if author_id != payload.user_id and not payload.member.guild_permissions.manage_messages:
                 return
+            self.undone_links.set(original_id, self.generate_fixed_links(original.content))
             try:
-                await ref.edit(suppress=False)
+                await original.edit(suppress=False)
+            except discord.NotFound:
+                pass
             except discord.HTTPException as e:
                 log.exception(e)
                 return
         # if the original messages was deleted anyone can revert
-        await msg.delete()
-
-    def generate_vxtwitter_links(self, text):
-        # NOTE this pattern is a bit more forgiving than Discord's
-        pattern = re.compile(r'https://(mobile.|vx)?(twitter|x).com/([\w]{4,15}/status/[0-9]+)')
-        matches = pattern.finditer(text)
-        prefixes = set()
-        links = dict()  # wanted to use ordered set but apparently this is the closest thing
-        for m in matches:
-            prefixes.add(m.group(1))
-            links[f"https://vxtwitter.com/{m.group(3)}"] = None
-        if not links or prefixes == {"vx"}:
-            # if there are no matches (or it's all vxtwitter links) then our work here is done
-            return
-        return ' '.join(links.keys())
+        self.forget_reply(payload.message_id)
+        try:
+            await channel.get_partial_message(payload.message_id).delete()
+        except discord.NotFound:
+            pass
+
+    @commands.Cog.listener()
+    async def on_raw_message_delete(self, payload):
+        self.forget_reply(payload.message_id)
+        # nothing to do for originals deleted while waiting in the queue
+        self.reply_queue.discard(payload.channel_id, payload.message_id)
+
+    def generate_fixed_links(self, text):
+        return self.link_rewriter.rewrite(text)
+
+    # the name from when only Twitter links were rewritten
+    generate_vxtwitter_links = generate_fixed_links
 
 async def setup(bot):
-    await bot.add_cog(Vxtwitter(bot))
\ No newline at end of file
+    # imported here so the cog can be constructed without a config, e.g. in tests
+    from . import cog_config
+    rules = getattr(cog_config, 'LINK_REWRITE_RULES', None)
+    rules = DEFAULT_RULES if rules is None else [RewriteRule(**rule) for rule in rules]
+    await bot.add_cog(Vxtwitter(
+        bot, rules,
+        tracked_replies=getattr(cog_config, 'TRACKED_REPLIES', 10000),
+        tracked_reply_ttl=getattr(cog_config, 'TRACKED_REPLY_TTL', 7 * 24 * 60 * 60),
+        tracked_replies_path=getattr(cog_config, 'TRACKED_REPLIES_FILE', None),
+        tracked_replies_save_interval=getattr(cog_config, 'TRACKED_REPLIES_SAVE_INTERVAL', 10 * 60),
+        reply_interval=getattr(cog_config, 'LINK_REPLY_INTERVAL', 1.0),
+    ))
+
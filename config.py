@@ -0,0 +1,11 @@
+TOKEN = 'x'
+EXTENSIONS = ['Developer', 'Fun', 'Gametags', 'Vxtwitter']
+SUPERUSER_ROLE = 'su'
+ONBOARDING_ENABLED_DATE = '2024-01-01'
+MOD_CHANNEL = 'mod'
+HOME_CHANNEL = 'home'
+RESTRICTED_ROLE = 'restricted'
+ANNOUNCEMENTS_CHANNEL = 'ann'
+GENERAL_CHANNEL = 'general'
+MATCHMAKING_CHANNEL = 'mm'
+WELCOME_TEXT = 'Welcome {new_member} {announcements} {home} {general} {matchmaking} {botemkin}'
@@ -0,0 +1,105 @@
+class GuildIndex:
+    """Name lookups of channels, emojis and roles per guild.
+
+    Each guild's indexes are built on first use and dropped by the gateway events
+    that could change them, lookups in between are a dict access instead of a scan.
+    Channels and emojis are matched by exact name like discord.utils.get, roles by
+    casefolded name.
+    """
+
+    # events to register with bot.add_listener, each handled by the method of the same name
+    LISTENERS = (
+        'on_guild_channel_create',
+        'on_guild_channel_delete',
+        'on_guild_channel_update',
+        'on_guild_emojis_update',
+        'on_guild_role_create',
+        'on_guild_role_delete',
+        'on_guild_role_update',
+        'on_guild_available',
+        'on_guild_remove',
+    )
+
+    def __init__(self):
+        self.__channels = {}  # guild id -> channel name -> channel id
+        self.__emojis = {}  # guild id -> emoji name -> emoji
+        self.__roles = {}  # guild id -> casefolded role name -> role ids
+        self.builds = 0
+
+    def channel(self, guild, name):
+        channels = self.__channels.get(guild.id)
+        if channels is None:
+            channels = {}
+            for channel in guild.channels:
+                channels.setdefault(channel.name, channel.id)
+            self.__channels[guild.id] = channels
+            self.builds += 1
+        channel_id = channels.get(name)
+        return None if channel_id is None else guild.get_channel(channel_id)
+
+    def emoji(self, guild, name):
+        emojis = self.__emojis.get(guild.id)
+        if emojis is None:
+            emojis = {}
+            for emoji in guild.emojis:
+                emojis.setdefault(emoji.name, emoji)
+            self.__emojis[guild.id] = emojis
+            self.builds += 1
+        return emojis.get(name)
+
+    def role_ids(self, guild, name):
+        roles = self.__roles.get(guild.id)
+        if roles is None:
+            roles = {}
+            for role in guild.roles:
+                roles[role.name.casefold()] = roles.get(role.name.casefold(), ()) + (role.id,)
+            self.__roles[guild.id] = roles
+            self.builds += 1
+        return roles.get(name.casefold(), ())
+
+    def member_role(self, member, name):
+        """Return the member's role with the given name or None."""
+        guild = getattr(member, 'guild', None)
+        if guild is None:
+            # users outside of guilds don't have roles
+            return None
+        for role_id in self.role_ids(guild, name):
+            role = member.get_role(role_id)
+            if role is not None:
+                return role
+        return None
+
+    def invalidate(self, guild):
+        self.__channels.pop(guild.id, None)
+        self.__emojis.pop(guild.id, None)
+        self.__roles.pop(guild.id, None)
+
+    async def on_guild_channel_create(self, channel):
+        self.__channels.pop(channel.guild.id, None)
+
+    async def on_guild_channel_delete(self, channel):
+        self.__channels.pop(channel.guild.id, None)
+
+    async def on_guild_channel_update(self, before, after):
+        if before.name != after.name:
+            self.__channels.pop(after.guild.id, None)
+
+    async def on_guild_emojis_update(self, guild, before, after):
+        self.__emojis.pop(guild.id, None)
+
+    async def on_guild_role_create(self, role):
+        self.__roles.pop(role.guild.id, None)
+
+    async def on_guild_role_delete(self, role):
+        self.__roles.pop(role.guild.id, None)
+
+    async def on_guild_role_update(self, before, after):
+        if before.name != after.name:
+            self.__roles.pop(after.guild.id, None)
+
+    async def on_guild_available(self, guild):
+        # the guild's objects may have been recreated while it was unavailable
+        self.invalidate(guild)
+
+    async def on_guild_remove(self, guild):
+        self.invalidate(guild)
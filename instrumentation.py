@@ -0,0 +1,222 @@
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+import asyncio
+import bisect
+import functools
+import os
+import pathlib
+import time
+import weakref
+
+import aiohttp
+
+# upper bounds in seconds, the last bucket takes everything above
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+class Span:
+    """Timing of one command invocation or listener call in progress."""
+    __slots__ = ('label', 'started', 'io_time', 'task', 'outer_label')
+
+    def __init__(self, label):
+        self.label = label
+        self.started = time.perf_counter()
+        self.io_time = 0.0
+        self.task = None
+        self.outer_label = None
+
+# the span of the command or listener running in the current task, copied into tasks it creates
+current_span = ContextVar('current_span', default=None)
+
+def record_io(elapsed):
+    span = current_span.get()
+    if span is not None:
+        span.io_time += elapsed
+
+@contextmanager
+def io_timer():
+    """Count the time spent in the block (typically awaiting HTTP or the database) as I/O of the current span.
+
+    Concurrent I/O is summed up so it can exceed the wall time of the span.
+    """
+    before = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_io(time.perf_counter() - before)
+
+def http_trace_config():
+    """aiohttp tracing that counts the requests of a session as I/O of the current span."""
+    async def on_request_start(session, context, params):
+        context.started = time.perf_counter()
+
+    async def on_request_end(session, context, params):
+        record_io(time.perf_counter() - context.started)
+
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_request_start.append(on_request_start)
+    trace_config.on_request_end.append(on_request_end)
+    trace_config.on_request_exception.append(on_request_end)
+    return trace_config
+
+class Histogram:
+    """Counts of observations per bucket, percentiles are interpolated within buckets."""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def percentile(self, p):
+        if not self.count:
+            return 0.0
+        rank = p / 100 * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+class Metric:
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.wall = Histogram()
+        self.io = Histogram()
+
+class Instrumentation:
+    """Per command and listener timings, keyed by labels like 'command:list' or 'listener:Vxtwitter.on_message'.
+
+    Durations measured by the handlers themselves are recorded with observe() under labels like 'translation:first_output'.
+    """
+
+    def __init__(self):
+        self.metrics = {}  # label -> Metric
+        # task -> label of the span it's running, read by the loop watchdog from another thread
+        self.running = weakref.WeakKeyDictionary()
+
+    def start(self, label):
+        """Start timing label in the current task, returns the span and a token for finish()."""
+        span = Span(label)
+        try:
+            span.task = asyncio.current_task()
+        except RuntimeError:
+            pass  # not called from a coroutine
+        if span.task is not None:
+            span.outer_label = self.running.get(span.task)
+            self.running[span.task] = label
+        return span, current_span.set(span)
+
+    def finish(self, span, token=None, *, error=False):
+        if token is not None:
+            current_span.reset(token)
+        if span.task is not None and self.running.get(span.task) == span.label:
+            if span.outer_label is None:
+                del self.running[span.task]
+            else:
+                self.running[span.task] = span.outer_label
+        metric = self.__metric(span.label)
+        metric.calls += 1
+        if error:
+            metric.errors += 1
+        metric.wall.observe(time.perf_counter() - span.started)
+        metric.io.observe(span.io_time)
+
+    def observe(self, label, seconds):
+        """Record a duration measured elsewhere, e.g. the time until a response first showed up."""
+        metric = self.__metric(label)
+        metric.calls += 1
+        metric.wall.observe(seconds)
+
+    def __metric(self, label):
+        metric = self.metrics.get(label)
+        if metric is None:
+            metric = self.metrics[label] = Metric()
+        return metric
+
+    @asynccontextmanager
+    async def measure(self, label):
+        span, token = self.start(label)
+        error = False
+        try:
+            yield span
+        except BaseException:
+            error = True
+            raise
+        finally:
+            self.finish(span, token, error=error)
+
+    def timed(self, func):
+        """Decorator timing an async function (e.g. a listener) under its qualified name."""
+        label = f"listener:{func.__qualname__}"
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            async with self.measure(label):
+                return await func(*args, **kwargs)
+        return wrapper
+
+    def reset(self):
+        self.metrics.clear()
+
+    def report(self):
+        """Return a row of stats per label, slowest (by p95) first."""
+        rows = []
+        for label, metric in self.metrics.items():
+            rows.append({
+                'label': label,
+                'calls': metric.calls,
+                'errors': metric.errors,
+                'p50': metric.wall.percentile(50),
+                'p95': metric.wall.percentile(95),
+                'p99': metric.wall.percentile(99),
+                'io_share': metric.io.sum / metric.wall.sum if metric.wall.sum else 0.0,
+            })
+        rows.sort(key=lambda row: row['p95'], reverse=True)
+        return rows
+
+    def prometheus_text(self, prefix='botemkin'):
+        """Render the metrics in the Prometheus text exposition format."""
+        lines = []
+        for name, help_text, histogram in (
+                ('duration_seconds', "Wall time of commands and listeners.", lambda metric: metric.wall),
+                ('io_seconds', "Time commands and listeners spent awaiting HTTP and the database.", lambda metric: metric.io)):
+            lines.append(f"# HELP {prefix}_{name} {help_text}")
+            lines.append(f"# TYPE {prefix}_{name} histogram")
+            for label, metric in sorted(self.metrics.items()):
+                label = label.replace('\\', '\\\\').replace('"', '\\"')
+                values = histogram(metric)
+                cumulative = 0
+                for bound, count in zip(values.buckets + (float('inf'),), values.counts):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append(f'{prefix}_{name}_bucket{{handler="{label}",le="{le}"}} {cumulative}')
+                lines.append(f'{prefix}_{name}_sum{{handler="{label}"}} {values.sum}')
+                lines.append(f'{prefix}_{name}_count{{handler="{label}"}} {values.count}')
+        lines.append(f"# HELP {prefix}_errors_total Failed command and listener calls.")
+        lines.append(f"# TYPE {prefix}_errors_total counter")
+        for label, metric in sorted(self.metrics.items()):
+            label = label.replace('\\', '\\\\').replace('"', '\\"')
+            lines.append(f'{prefix}_errors_total{{handler="{label}"}} {metric.errors}')
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path):
+        """Write prometheus_text() to path, replacing it atomically for the scraper (e.g. node_exporter's textfile collector)."""
+        path = pathlib.Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = path.with_name(path.name + '.tmp')
+        temp_path.write_text(self.prometheus_text(), encoding='utf-8')
+        os.replace(temp_path, path)
+
+# shared by the bot and its cogs
+metrics = Instrumentation()
+timed = metrics.timed
@@ -0,0 +1,92 @@
+from dataclasses import dataclass
+import re
+
+@dataclass(frozen=True)
+class RewriteRule:
+    """Rewrites links of a site to an embed fixing mirror.
+
+    path is a regex (without named groups) matched right after the domain,
+    target is formatted with the matched path. Links already pointing to one
+    of the fixed_domains count as matches but don't warrant a rewrite by themselves.
+    """
+    name: str
+    domains: tuple
+    path: str
+    target: str
+    fixed_domains: tuple = ()
+
+DEFAULT_RULES = (
+    RewriteRule(
+        name='twitter',
+        domains=('twitter.com', 'x.com', 'mobile.twitter.com', 'mobile.x.com'),
+        fixed_domains=('vxtwitter.com', 'fxtwitter.com', 'fixupx.com'),
+        path=r'\w{4,15}/status/[0-9]+',
+        target='https://vxtwitter.com/{path}',
+    ),
+    RewriteRule(
+        name='instagram',
+        domains=('instagram.com', 'www.instagram.com'),
+        fixed_domains=('ddinstagram.com', 'www.ddinstagram.com'),
+        path=r'(?:p|reels?|tv)/[\w-]+',
+        target='https://ddinstagram.com/{path}',
+    ),
+    RewriteRule(
+        name='tiktok',
+        domains=('tiktok.com', 'www.tiktok.com'),
+        fixed_domains=('vxtiktok.com', 'www.vxtiktok.com'),
+        path=r'@[\w.-]+/video/[0-9]+',
+        target='https://vxtiktok.com/{path}',
+    ),
+    RewriteRule(
+        name='reddit',
+        domains=('reddit.com', 'www.reddit.com', 'old.reddit.com', 'new.reddit.com'),
+        fixed_domains=('rxddit.com', 'www.rxddit.com'),
+        path=r'r/\w+/(?:comments|s)/\w+',
+        target='https://rxddit.com/{path}',
+    ),
+    RewriteRule(
+        name='bluesky',
+        domains=('bsky.app',),
+        fixed_domains=('fxbsky.app',),
+        path=r'profile/[\w.:-]+/post/\w+',
+        target='https://fxbsky.app/{path}',
+    ),
+)
+
+class LinkRewriter:
+    """Finds links matching any of the rules in a single pass over the text."""
+
+    # every link we care about contains this, anything else is skipped without running the regex
+    PREFILTER = 'https://'
+
+    def __init__(self, rules=DEFAULT_RULES):
+        self.rules = tuple(rules)
+        self.__fixed_domains = [frozenset(domain.lower() for domain in rule.fixed_domains) for rule in self.rules]
+        alternatives = []
+        for i, rule in enumerate(self.rules):
+            # longest first so a domain never stops at a shorter one it starts with
+            domains = sorted((*rule.domains, *rule.fixed_domains), key=len, reverse=True)
+            # NOTE this pattern is a bit more forgiving than Discord's
+            alternatives.append(
+                f"(?P<r{i}>(?P<d{i}>(?i:{'|'.join(re.escape(domain) for domain in domains)}))/(?P<p{i}>{rule.path}))")
+        self.pattern = re.compile(f"https://(?:{'|'.join(alternatives)})")
+
+    def rewrite(self, text):
+        """Return the unique rewritten links of text separated by spaces.
+
+        Returns None if there are no links or all of them are already fixed.
+        """
+        if self.PREFILTER not in text:
+            return
+        links = dict()  # wanted to use ordered set but apparently this is the closest thing
+        all_fixed = True
+        for m in self.pattern.finditer(text):
+            # the rule's outermost group closes last
+            i = int(m.lastgroup[1:])
+            if m.group(f'd{i}').lower() not in self.__fixed_domains[i]:
+                all_fixed = False
+            links[self.rules[i].target.format(path=m.group(f'p{i}'))] = None
+        if not links or all_fixed:
+            # if there are no matches (or they're all fixed already) then our work here is done
+            return
+        return ' '.join(links.keys())
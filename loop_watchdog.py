@@ -0,0 +1,112 @@
+from collections import deque
+from dataclasses import dataclass
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+
+from instrumentation import Histogram, metrics
+
+log = logging.getLogger(__name__)
+
+@dataclass
+class Stall:
+    """The event loop not getting around to the watchdog's heartbeat for longer than the threshold."""
+    started: float  # time.time() of the capture
+    label: str  # command or listener (or failing that the task) that was running
+    stack: list  # formatted frames of the loop thread, innermost last
+    duration: float = None  # filled in once the loop is responsive again
+
+class LoopWatchdog:
+    """Measures event loop lag and captures what the loop is stuck on.
+
+    A heartbeat task on the loop wakes up every interval seconds and records how late
+    it was. A sampler thread checks on the heartbeat and if it's overdue by more than
+    threshold seconds it takes the loop thread's stack (once per stall) and attributes
+    it to the command or listener currently running.
+    """
+
+    def __init__(self, *, threshold=0.25, interval=0.1, max_stalls=20, instrumentation=metrics):
+        self.threshold = threshold
+        self.interval = interval
+        self.instrumentation = instrumentation
+        self.lag = Histogram()
+        self.max_lag = 0.0
+        self.stalls = deque(maxlen=max_stalls)
+        self.stall_count = 0
+        self.__loop = None
+        self.__loop_thread_id = None
+        self.__beat = None
+        self.__stall = None
+        self.__heartbeat = None
+        self.__stopped = threading.Event()
+
+    def start(self):
+        """Start watching the running loop."""
+        self.__loop = asyncio.get_running_loop()
+        self.__loop_thread_id = threading.get_ident()
+        self.__beat = time.monotonic()
+        self.__stopped.clear()
+        self.__heartbeat = self.__loop.create_task(self.__run_heartbeat())
+        threading.Thread(target=self.__run_sampler, name='loop-watchdog', daemon=True).start()
+
+    def stop(self):
+        self.__stopped.set()
+        if self.__heartbeat is not None:
+            self.__heartbeat.cancel()
+
+    async def __run_heartbeat(self):
+        while True:
+            before = time.monotonic()
+            await asyncio.sleep(self.interval)
+            self.__beat = now = time.monotonic()
+            lag = max(0.0, now - before - self.interval)
+            self.lag.observe(lag)
+            self.max_lag = max(self.max_lag, lag)
+            stall = self.__stall
+            if stall is not None:
+                self.__stall = None
+                stall.duration = lag
+                log.warning(f"Event loop blocked for {lag * 1000:.0f} ms while running {stall.label}:\n{''.join(stall.stack)}")
+
+    def __run_sampler(self):
+        while not self.__stopped.wait(self.interval):
+            overdue = time.monotonic() - self.__beat - self.interval
+            if overdue > self.threshold and self.__stall is None and not self.__stopped.is_set():
+                self.__capture()
+
+    def __capture(self):
+        frame = sys._current_frames().get(self.__loop_thread_id)
+        if frame is None:
+            return
+        stack = traceback.format_stack(frame)
+        del frame
+        stall = Stall(time.time(), self.__running_label(), stack)
+        self.stall_count += 1
+        self.stalls.append(stall)
+        # only set once complete, the heartbeat reads it from the loop thread
+        self.__stall = stall
+
+    def __running_label(self):
+        # reading these from another thread is fine for a best effort answer
+        try:
+            task = asyncio.current_task(self.__loop)
+        except RuntimeError:
+            task = None
+        if task is None:
+            return "(no task, e.g. a callback)"
+        label = self.instrumentation.running.get(task)
+        if label is not None:
+            return label
+        coro = task.get_coro()
+        return f"task {task.get_name()} ({getattr(coro, '__qualname__', coro)})"
+
+    def stats(self):
+        return {
+            'lag_p50_ms': self.lag.percentile(50) * 1000,
+            'lag_p99_ms': self.lag.percentile(99) * 1000,
+            'max_lag_ms': self.max_lag * 1000,
+            'stalls': self.stall_count,
+        }
@@ -0,0 +1,146 @@
+import discord
+import asyncio
+import time
+
+# https://discord.com/developers/docs/resources/message#embed-object-embed-limits
+MESSAGE_LIMIT = 2000
+EMBED_DESCRIPTION_LIMIT = 4096
+MESSAGE_EMBED_LIMIT = 10
+MESSAGE_EMBED_TOTAL_LIMIT = 6000  # summed over all embeds of a message
+FOOTER_RESERVE = 32  # room left for the page counter of paginated output
+
+def pack_text(pages, limit=MESSAGE_LIMIT):
+    """Join pages (e.g. of a commands.Paginator) into as few messages as possible."""
+    messages = []
+    for page in pages:
+        if messages and len(messages[-1]) + 1 + len(page) <= limit:
+            messages[-1] += '\n' + page
+        else:
+            messages.append(page)
+    return messages
+
+def pack_embeds(pages, total_limit=MESSAGE_EMBED_TOTAL_LIMIT - FOOTER_RESERVE):
+    """Join pages into embed descriptions and those into as few messages as possible.
+
+    Returns a list of messages, each a list of embeds.
+    """
+    messages = []
+    message_size = 0
+    for page in pages:
+        if messages and message_size + 1 + len(page) <= total_limit:
+            embed = messages[-1][-1]
+            if len(embed.description) + 1 + len(page) <= EMBED_DESCRIPTION_LIMIT:
+                embed.description += '\n' + page
+                message_size += 1 + len(page)
+                continue
+            if len(messages[-1]) < MESSAGE_EMBED_LIMIT:
+                messages[-1].append(discord.Embed(description=page))
+                message_size += len(page)
+                continue
+        messages.append([discord.Embed(description=page)])
+        message_size = len(page)
+    return messages
+
+class PageView(discord.ui.View):
+    """Flips through pages of embeds in a single message, only for the user who asked for them."""
+
+    def __init__(self, pages, author_id, *, timeout=180):
+        super().__init__(timeout=timeout)
+        self.pages = pages
+        self.author_id = author_id
+        self.index = 0
+        self.message = None
+        for i, embeds in enumerate(pages):
+            embeds[-1].set_footer(text=f"Page {i + 1}/{len(pages)}")
+        self.__update_buttons()
+
+    def __update_buttons(self):
+        self.previous_page.disabled = self.index == 0
+        self.next_page.disabled = self.index == len(self.pages) - 1
+
+    async def interaction_check(self, interaction):
+        if interaction.user.id != self.author_id:
+            await interaction.response.send_message("Only whoever asked can turn the pages.", ephemeral=True)
+            return False
+        return True
+
+    async def __show(self, interaction, index):
+        self.index = index
+        self.__update_buttons()
+        await interaction.response.edit_message(embeds=self.pages[index], view=self)
+
+    @discord.ui.button(label='◀', style=discord.ButtonStyle.secondary)
+    async def previous_page(self, interaction, button):
+        await self.__show(interaction, self.index - 1)
+
+    @discord.ui.button(label='▶', style=discord.ButtonStyle.secondary)
+    async def next_page(self, interaction, button):
+        await self.__show(interaction, self.index + 1)
+
+    async def on_timeout(self):
+        if self.message is not None:
+            try:
+                await self.message.edit(view=None)
+            except discord.HTTPException:
+                pass
+
+class ChannelState:
+
+    def __init__(self, capacity):
+        self.lock = asyncio.Lock()
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+class MessageSender:
+    """Sends multi-part responses through a queue per channel.
+
+    Parts of one response are never interleaved with another response in the same
+    channel and are paced by a token bucket mirroring Discord's per-channel limit
+    (5 messages per 5 seconds) so bursts wait here instead of running into 429s.
+    """
+
+    def __init__(self, *, rate=1.0, capacity=5):
+        self.rate = rate
+        self.capacity = capacity
+        self.__channels = {}  # channel id -> ChannelState
+        self.sent = 0
+        self.throttled = 0
+
+    async def send_all(self, destination, messages):
+        """Send messages (dicts of keyword arguments for send) in order, returns the sent messages."""
+        state = self.__channels.setdefault(destination.channel.id, ChannelState(self.capacity))
+        sent = []
+        async with state.lock:
+            for kwargs in messages:
+                await self.__acquire(state)
+                sent.append(await destination.send(**kwargs))
+                self.sent += 1
+        return sent
+
+    async def send_pages(self, ctx, pages, *, paginate=True, **kwargs):
+        """Send pages in as few messages as possible.
+
+        Text is kept if it fits a single message, otherwise the pages go into embeds
+        which hold three times as much. If that's still more than one message, the
+        pages are either shown in a single message with buttons or sent one after the other.
+        """
+        texts = pack_text(pages)
+        if len(texts) == 1:
+            return await self.send_all(ctx, [dict(content=texts[0], **kwargs)])
+        messages = pack_embeds(pages)
+        if len(messages) > 1 and paginate:
+            view = PageView(messages, ctx.author.id)
+            view.message, = await self.send_all(ctx, [dict(embeds=messages[0], view=view, **kwargs)])
+            return [view.message]
+        return await self.send_all(ctx, [dict(embeds=embeds, **kwargs) for embeds in messages])
+
+    async def __acquire(self, state):
+        now = time.monotonic()
+        state.tokens = min(self.capacity, state.tokens + (now - state.updated) * self.rate)
+        state.updated = now
+        if state.tokens < 1:
+            self.throttled += 1
+            await asyncio.sleep((1 - state.tokens) / self.rate)
+            state.tokens = 1
+            state.updated = time.monotonic()
+        state.tokens -= 1
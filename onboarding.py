@@ -0,0 +1,160 @@
+import discord
+from dataclasses import dataclass, field
+import asyncio
+import logging
+
+from cache import TTLCache
+
+log = logging.getLogger(__name__)
+
+@dataclass
+class OnboardingBatch:
+    welcomes: dict = field(default_factory=dict)  # member id -> member
+    notices: list = field(default_factory=list)
+    kicks: dict = field(default_factory=dict)  # member id -> (member, notice sent once kicked)
+    timer: asyncio.Task = None
+
+    def __len__(self):
+        return len(self.welcomes) + len(self.notices) + len(self.kicks)
+
+class OnboardingPipeline:
+    """Collects onboarding actions per guild for a short window and carries them out together.
+
+    Welcomes end up in a single message, mod notices in a single summary and kicks
+    run concurrently up to a limit. No member waits longer than window seconds
+    before their batch is processed, a batch reaching max_batch goes out right away.
+
+    welcome(guild, members) and notify(guild, lines) are coroutines sending the merged
+    messages, kick(member) is a coroutine kicking a single member.
+    """
+
+    def __init__(self, *, welcome, notify, kick, window=1.0, max_batch=25, kick_concurrency=4):
+        self.__welcome = welcome
+        self.__notify = notify
+        self.__kick = kick
+        self.window = window
+        self.max_batch = max_batch
+        self.__kick_semaphore = asyncio.Semaphore(kick_concurrency)
+        self.__batches = {}  # guild id -> (guild, OnboardingBatch)
+        self.__flushes = set()
+
+    def welcome_member(self, member):
+        self.__batch(member.guild).welcomes[member.id] = member
+        self.__check_size(member.guild)
+
+    def notify_mods(self, guild, line):
+        self.__batch(guild).notices.append(line)
+        self.__check_size(guild)
+
+    def kick_member(self, member, notice):
+        """Kick member, notice is added to the mod summary if the kick succeeds."""
+        self.__batch(member.guild).kicks[member.id] = (member, notice)
+        self.__check_size(member.guild)
+
+    async def flush(self):
+        """Process every pending batch now and wait for all of them to finish."""
+        for guild_id in list(self.__batches):
+            self.__start_flush(guild_id)
+        if self.__flushes:
+            await asyncio.wait(self.__flushes)
+
+    def close(self):
+        for _, batch in self.__batches.values():
+            batch.timer.cancel()
+        self.__batches.clear()
+
+    def __batch(self, guild):
+        if guild.id not in self.__batches:
+            batch = OnboardingBatch()
+            batch.timer = asyncio.create_task(self.__flush_later(guild.id))
+            self.__batches[guild.id] = (guild, batch)
+        return self.__batches[guild.id][1]
+
+    def __check_size(self, guild):
+        if len(self.__batches[guild.id][1]) >= self.max_batch:
+            self.__start_flush(guild.id)
+
+    async def __flush_later(self, guild_id):
+        await asyncio.sleep(self.window)
+        self.__start_flush(guild_id)
+
+    def __start_flush(self, guild_id):
+        guild, batch = self.__batches.pop(guild_id)
+        if asyncio.current_task() is not batch.timer:
+            batch.timer.cancel()
+        task = asyncio.create_task(self.__process(guild, batch))
+        self.__flushes.add(task)
+        task.add_done_callback(self.__flushes.discard)
+
+    async def __kick_member(self, member, notice):
+        async with self.__kick_semaphore:
+            try:
+                await self.__kick(member)
+            except:
+                log.exception(f"Failed to kick member {member.id}")
+                return None
+        return notice
+
+    async def __send_welcome(self, guild, members):
+        try:
+            await self.__welcome(guild, members)
+        except:
+            log.exception("Failed to send welcome message")
+
+    async def __process(self, guild, batch):
+        tasks = [self.__kick_member(member, notice) for member, notice in batch.kicks.values()]
+        if batch.welcomes:
+            tasks.append(self.__send_welcome(guild, list(batch.welcomes.values())))
+        results = await asyncio.gather(*tasks)
+        # members are only reported kicked once they actually are
+        lines = batch.notices + [notice for notice in results[:len(batch.kicks)] if notice is not None]
+        if lines:
+            try:
+                await self.__notify(guild, lines)
+            except:
+                log.exception("Failed to send mod notices")
+
+class WelcomeMessageTracker:
+    """Deletes Discord's built-in welcome message of members kicked during onboarding.
+
+    The welcome messages of the home channel are passed to track(). Their ids are kept for ttl seconds,
+    members kicked later than that have their message looked up in the last history_limit messages of
+    the channel. Members kicked before their message shows up have it deleted once it does, if that
+    happens within pending_ttl seconds.
+    """
+
+    def __init__(self, *, ttl=60 * 60, pending_ttl=60, history_limit=200, maxsize=1024):
+        # member id -> id of their welcome message
+        self.__message_ids = TTLCache(maxsize, ttl)
+        # ids of kicked members whose welcome message hasn't shown up yet
+        self.__unwelcome = TTLCache(maxsize, pending_ttl)
+        self.history_limit = history_limit
+
+    async def track(self, message):
+        if self.__unwelcome.pop(message.author.id):
+            # member got kicked before Discord got around to welcoming them
+            await message.delete()
+            return
+        self.__message_ids.set(message.author.id, message.id)
+
+    async def delete(self, channel, member):
+        """Delete the welcome message of member from channel, or have it deleted once it's posted."""
+        message_id = self.__message_ids.pop(member.id)
+        if message_id is not None:
+            message = channel.get_partial_message(message_id)
+        else:
+            # set before searching so that a message arriving in the meantime is deleted by track()
+            self.__unwelcome.set(member.id, True)
+            message = await self.__find(channel, member)
+            if message is None or not self.__unwelcome.pop(member.id):
+                return
+        try:
+            await message.delete()
+        except discord.NotFound:
+            pass
+
+    async def __find(self, channel, member):
+        async for message in channel.history(limit=self.history_limit):
+            if message.type == discord.MessageType.new_member and message.author.id == member.id:
+                return message
+        return None
@@ -0,0 +1,146 @@
+from collections import Counter
+from contextlib import asynccontextmanager
+import asyncio
+import cProfile
+import io
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+
+# cProfile and the sampler both watch the loop thread, running them at once would skew the results
+profiler_lock = asyncio.Lock()
+
+class ProfilerBusy(RuntimeError):
+    """Raised when a profiler is started while another one is running."""
+
+@asynccontextmanager
+async def exclusive_profiler():
+    # checked and taken without awaiting in between, so a second profiler is refused right away instead of queueing up
+    if profiler_lock.locked():
+        raise ProfilerBusy("A profiler is already running.")
+    async with profiler_lock:
+        yield
+
+async def profile_deterministic(seconds, *, limit=50):
+    """Profile everything running on the event loop for seconds, returns the top functions by cumulative time.
+
+    Raises ProfilerBusy if another profiler is running.
+    """
+    async with exclusive_profiler():
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            profile.disable()
+    return await asyncio.to_thread(format_profile, profile, limit)
+
+def format_profile(profile, limit):
+    stream = io.StringIO()
+    pstats.Stats(profile, stream=stream).strip_dirs().sort_stats(pstats.SortKey.CUMULATIVE).print_stats(limit)
+    return stream.getvalue()
+
+class StackSampler:
+    """Samples the stack of a thread from another thread.
+
+    Each function on the stack counts once per sample for its cumulative share,
+    the innermost one also for its own share.
+    """
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = 0
+        self.cumulative = Counter()
+        self.own = Counter()
+
+    def run(self, seconds):
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            self.sample()
+            time.sleep(self.interval)
+
+    def sample(self):
+        frame = sys._current_frames().get(self.thread_id)
+        if frame is None:
+            return
+        self.samples += 1
+        self.own[self.__key(frame)] += 1
+        seen = set()
+        while frame is not None:
+            key = self.__key(frame)
+            if key not in seen:
+                seen.add(key)
+                self.cumulative[key] += 1
+            frame = frame.f_back
+
+    @staticmethod
+    def __key(frame):
+        code = frame.f_code
+        return (code.co_filename, code.co_firstlineno, code.co_qualname if hasattr(code, 'co_qualname') else code.co_name)
+
+    def format(self, limit=50):
+        lines = [f"{self.samples} samples every {self.interval * 1000:g} ms", '',
+                 f"{'cumulative':>10} {'own':>6}  function"]
+        for key, count in self.cumulative.most_common(limit):
+            filename, lineno, name = key
+            lines.append(f"{count / self.samples:>10.1%} {self.own[key] / self.samples:>6.1%}  {name} ({filename}:{lineno})")
+        return '\n'.join(lines) + '\n'
+
+async def profile_sampling(seconds, *, interval=0.005, limit=50):
+    """Sample the event loop thread's stack for seconds, returns the top functions by cumulative samples.
+
+    The sampling happens on a separate thread so the loop only pays for the GIL switches.
+    Raises ProfilerBusy if another profiler is running.
+    """
+    async with exclusive_profiler():
+        sampler = StackSampler(threading.get_ident(), interval)
+        await asyncio.to_thread(sampler.run, seconds)
+    if not sampler.samples:
+        return "No samples taken.\n"
+    return sampler.format(limit)
+
+class MemoryTracker:
+    """Compares tracemalloc snapshots against a baseline taken at start()."""
+
+    def __init__(self, frames=10):
+        self.frames = frames
+        self.baseline = None
+
+    @property
+    def running(self):
+        return self.baseline is not None
+
+    async def start(self):
+        """Take the baseline, returns the number of bytes traced so far."""
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+        self.baseline = await asyncio.to_thread(self.__take_snapshot)
+        return tracemalloc.get_traced_memory()[0]
+
+    async def diff(self, *, limit=30):
+        """Return the allocations that grew the most since start() by source line."""
+        snapshot = await asyncio.to_thread(self.__take_snapshot)
+        return await asyncio.to_thread(self.__format_diff, snapshot, limit)
+
+    def stop(self):
+        self.baseline = None
+        tracemalloc.stop()
+
+    @staticmethod
+    def __take_snapshot():
+        # the tracer's own allocations would just be noise
+        return tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+        ])
+
+    def __format_diff(self, snapshot, limit):
+        stats = snapshot.compare_to(self.baseline, 'lineno')
+        total = sum(stat.size_diff for stat in stats)
+        lines = [f"Total growth since start: {total / 1024:+.1f} KiB", '']
+        for stat in stats[:limit]:
+            lines.append(str(stat))
+        return '\n'.join(lines) + '\n'
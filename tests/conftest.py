@@ -0,0 +1,15 @@
+import sys
+from types import ModuleType
+
+# config.py and cogs/cog_config.py hold secrets and aren't part of the repository,
+# stand in for them so the cogs can be imported without a deployment
+def stand_in(name, **attributes):
+    try:
+        __import__(name)
+    except ImportError:
+        module = ModuleType(name)
+        module.__dict__.update(attributes)
+        sys.modules[name] = module
+
+stand_in('config', SUPERUSER_ROLE='superuser', EXTENSIONS=[])
+stand_in('cogs.cog_config', IGDB_CLIENT_ID='', IGDB_CLIENT_SECRET='', DETECT_LANGUAGE_API_KEY='')
@@ -0,0 +1,104 @@
+import pytest
+
+from cache import TTLCache
+
+class FakeTimer:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def timer():
+    return FakeTimer()
+
+@pytest.fixture
+def cache(timer):
+    return TTLCache(maxsize=2, ttl=10, timer=timer)
+
+def test_get_returns_set_value(cache):
+    cache.set('a', 1)
+    assert cache.get('a') == 1
+    assert cache.stats()['hits'] == 1
+
+def test_missing_key_returns_default(cache):
+    assert cache.get('a', 'default') == 'default'
+    assert cache.stats()['misses'] == 1
+
+def test_entries_expire_after_ttl(cache, timer):
+    cache.set('a', 1)
+    timer.now = 10
+    assert cache.get('a') is None
+    assert len(cache) == 0
+
+def test_least_recently_used_entry_is_evicted(cache):
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+    assert 'a' in cache
+    assert 'b' not in cache
+    assert cache.stats()['evictions'] == 1
+
+def test_expired_entries_are_dropped_before_live_ones(cache, timer):
+    cache.set('a', 1)
+    timer.now = 5
+    cache.set('b', 2)
+    timer.now = 11
+    cache.set('c', 3)
+    assert 'b' in cache
+    assert 'c' in cache
+    assert cache.stats()['evictions'] == 0
+
+def test_falsy_values_are_cached(cache):
+    cache.set('a', [])
+    assert cache.get('a', None) == []
+
+def test_zero_sized_cache_stores_nothing(timer):
+    cache = TTLCache(maxsize=0, ttl=10, timer=timer)
+    cache.set('a', 1)
+    assert 'a' not in cache
+
+def test_entries_are_evicted_to_stay_within_maxbytes(timer):
+    cache = TTLCache(maxsize=10, ttl=10, maxbytes=10, sizeof=lambda key, value: len(value), timer=timer)
+    cache.set('a', 'xxxx')
+    cache.set('b', 'xxxx')
+    cache.set('c', 'xxxx')
+    assert 'a' not in cache
+    assert cache.currbytes == 8
+
+def test_entries_larger_than_maxbytes_are_not_stored(timer):
+    cache = TTLCache(maxsize=10, ttl=10, maxbytes=2, sizeof=lambda key, value: len(value), timer=timer)
+    cache.set('a', 'xxx')
+    assert 'a' not in cache
+    assert cache.currbytes == 0
+
+def test_dumped_entries_keep_their_remaining_ttl(cache, timer):
+    cache.set('a', 1)
+    timer.now = 6
+    restored = TTLCache(maxsize=2, ttl=10, timer=timer)
+    restored.load(cache.dump())
+    timer.now = 9
+    assert restored.get('a') == 1
+    timer.now = 10
+    assert restored.get('a') is None
+
+def test_downtime_between_dump_and_load_counts_against_the_ttl(timer):
+    wall_clock = FakeTimer()
+    wall_clock.now = 1000.0
+    cache = TTLCache(maxsize=2, ttl=10, timer=timer, wall_clock=wall_clock)
+    cache.set('a', 1)
+    cache.set('b', 2, ttl=100)
+    entries = cache.dump()
+    # the bot is down for a minute, the monotonic clock of the next run starts over
+    wall_clock.now += 60
+    restarted = FakeTimer()
+    restored = TTLCache(maxsize=2, ttl=10, timer=restarted, wall_clock=wall_clock)
+    restored.load(entries)
+    assert 'a' not in restored
+    assert restored.get('b') == 2
+    restarted.now = 39
+    assert restored.get('b') == 2
+    restarted.now = 40
+    assert restored.get('b') is None
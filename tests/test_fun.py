@@ -0,0 +1,144 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from cogs import fun
+
+class FakeTree:
+    def add_command(self, command):
+        pass
+
+    def remove_command(self, name, type=None):
+        pass
+
+@pytest.fixture
+def cog():
+    return fun.Fun(SimpleNamespace(tree=FakeTree()))
+
+def test_translation_cache_is_saved_periodically(cog, tmp_path):
+    path = tmp_path / 'translations.json'
+    cog.translation_cache_path = path
+    cog.translation_cache_save_interval = 0.01
+
+    async def run():
+        await cog.cog_load()
+        await asyncio.sleep(0.05)
+        # nothing new, nothing written
+        assert not path.exists()
+        cog._cache_translation(('translate', 'en', 'hola'), 'hello')
+        await asyncio.sleep(0.05)
+        assert cog.unsaved_translations == 0
+        saved = json.loads(path.read_text(encoding='utf-8'))
+        await cog.cog_unload()
+        return saved
+    saved = asyncio.run(run())
+    assert [(key, value) for key, _, value in saved] == [(['translate', 'en', 'hola'], 'hello')]
+
+def test_split_text_prefers_line_breaks_then_spaces():
+    assert fun.split_text("aaaa bbbb\ncccc dddd", 12) == ["aaaa bbbb", "cccc dddd"]
+    assert fun.split_text("aaaa bbbb cccc", 10) == ["aaaa bbbb", "cccc"]
+    assert fun.split_text("a" * 25, 10) == ["a" * 10, "a" * 10, "a" * 5]
+    assert fun.split_text("short", 10) == ["short"]
+
+def test_translation_messages_stay_within_discord_limits():
+    text = "word " * 2000
+    translations = [(f"language {i}", f"translation {i} " * 300) for i in range(40)]
+    messages = fun.build_translation_messages(text, 'https://example.com', 'description', translations)
+    assert len(messages) > 1
+    for embeds in messages:
+        assert 1 <= len(embeds) <= fun.MESSAGE_EMBED_LIMIT
+        assert sum(len(embed) for embed in embeds) <= fun.MESSAGE_EMBED_TOTAL_LIMIT
+        for embed in embeds:
+            assert len(embed.fields) <= fun.EMBED_FIELD_LIMIT
+            assert all(len(field.value) <= fun.EMBED_FIELD_VALUE_LIMIT for field in embed.fields)
+    assert len(messages[0][0].title) <= fun.EMBED_TITLE_LIMIT
+
+def test_translation_messages_stay_within_the_embed_count_limit():
+    translations = [(f"{i}", "x") for i in range(fun.EMBED_FIELD_LIMIT * (fun.MESSAGE_EMBED_LIMIT + 1))]
+    messages = fun.build_translation_messages("hello", None, None, translations)
+    assert [len(embeds) for embeds in messages] == [fun.MESSAGE_EMBED_LIMIT, 1]
+
+def test_empty_translations_are_shown_as_failed():
+    embed, = fun.build_translation_messages("hello", None, None, [('english', ''), ('japanese', ' \n')])[0]
+    assert [field.value for field in embed.fields] == [fun.TRANSLATION_FAILED] * 2
+
+@pytest.fixture(scope='module')
+def detector():
+    return fun.LocalLanguageDetector()
+
+@pytest.mark.parametrize(("text", "language"), [
+    ("Is anyone up for some casual sets later tonight?", 'en'),
+    ("Ich muss noch einkaufen gehen, bevor der Laden schließt.", 'de'),
+    ("Fue un partido muy reñido, bien jugado.", 'es'),
+    ("Dat was een heel spannende wedstrijd, goed gespeeld.", 'nl'),
+    ("週末ずっと練習してやっと紫ランクになった。", 'ja'),
+    ("오늘 밤에 같이 게임할 사람 있어요?", 'ko'),
+])
+def test_clear_texts_are_detected_confidently(detector, text, language):
+    detection = detector.detect(text)
+    assert detection['language'] == language
+    assert detection['confidence'] >= 0.95
+
+@pytest.mark.parametrize("text", [
+    pytest.param("Anna", id="name"),
+    pytest.param("Hola amigo", id="short_in_model"),
+    pytest.param("Hej, hur mår du?", id="short_out_of_model"),
+    pytest.param("Jag spelade hela helgen och blev mycket bättre.", id="swedish"),
+    pytest.param("Jeg har spillet hele dagen og det var sjovt.", id="danish"),
+    pytest.param("Bugün hava çok güzel, akşam turnuvaya gidiyoruz.", id="turkish"),
+    pytest.param("Mitä kuuluu? Pelataanko tänään illalla vähän?", id="finnish"),
+    pytest.param("Saya suka bermain game ini setiap malam.", id="indonesian"),
+])
+def test_short_and_out_of_model_texts_are_left_to_the_api(detector, text):
+    assert detector.detect(text)['confidence'] <= fun.LocalLanguageDetector.UNCERTAIN_CONFIDENCE
+
+def test_texts_without_letters_are_not_detected(detector):
+    assert detector.detect("123 :) !!!") is None
+
+class FakeFollowup:
+    def __init__(self):
+        self.sent = []
+
+    async def send(self, content=None, **kwargs):
+        self.sent.append(dict(kwargs, content=content))
+
+class FakeTranslator:
+    def translate_batch(self, texts, target):
+        return [f"{target}: {text}" for text in texts]
+
+def test_batch_translation_is_one_ephemeral_paginated_message(cog):
+    cog.translator = FakeTranslator()
+    interaction = SimpleNamespace(followup=FakeFollowup(), user=SimpleNamespace(id=1))
+    author = SimpleNamespace(display_name='someone')
+    messages = [SimpleNamespace(content=f"message {i} " + 'x' * 1000, author=author) for i in range(10)]
+    asyncio.run(cog.send_batch_translation(interaction, messages))
+    sent, = interaction.followup.sent
+    assert sent['ephemeral']
+    assert isinstance(sent['view'], fun.PageView)
+    assert len(sent['view'].pages) > 1
+
+class FakeChannel:
+    def __init__(self, messages):
+        self.messages = messages
+
+    async def history(self, limit):
+        for message in self.messages[:limit]:
+            yield message
+
+class FakeResponse:
+    async def defer(self, **kwargs):
+        pass
+
+def test_translate_recent_tells_when_the_count_was_reduced(cog):
+    cog.translator = FakeTranslator()
+    cog.recent_translation_limit = 3
+    author = SimpleNamespace(display_name='someone')
+    channel = FakeChannel([SimpleNamespace(content=f"message {i}", author=author) for i in range(10)])
+    interaction = SimpleNamespace(followup=FakeFollowup(), response=FakeResponse(), channel=channel,
+                                  user=SimpleNamespace(id=1))
+    asyncio.run(cog.translate_recent.callback(cog, interaction, 5))
+    translation, notice = interaction.followup.sent
+    assert notice['ephemeral']
+    assert "latest 3 messages" in notice['content']
@@ -0,0 +1,369 @@
+import asyncio
+import sqlite3
+import time
+from types import SimpleNamespace
+
+import aiohttp
+import pytest
+
+from cogs.gametags import (Gametags, IgdbScheduler, IgdbWrapper, Item, Itemtag, ItemtagRepository, ItemType, PlayerIndex,
+                           PlayerQuery, RoleTrie, TagIndex)
+
+def rejected(status):
+    return aiohttp.ClientResponseError(None, (), status=status)
+
+class FakeIgdb:
+    """Answers every query with its own data, multiqueries split up the way IGDB does."""
+
+    def __init__(self, failures=()):
+        self.requests = []
+        self.failures = list(failures)  # statuses of the first requests, None lets one through
+
+    async def post_query(self, endpoint, data):
+        self.requests.append((endpoint, data))
+        await asyncio.sleep(0)
+        status = self.failures.pop(0) if self.failures else None
+        if status is not None:
+            raise rejected(status)
+        if endpoint != 'multiquery':
+            if 'bad' in data:
+                raise rejected(400)
+            return [data]
+        if 'bad' in data:
+            raise rejected(400)
+        body = []
+        for line in data.splitlines():
+            name = line.split('"')[1]
+            query_data = line.split('{ ', 1)[1].rsplit(' }', 1)[0]
+            body.append({'name': name, 'result': [query_data]})
+        return body
+
+def run_queries(igdb, queries, **kwargs):
+    async def run():
+        scheduler = IgdbScheduler(igdb.post_query, rate_limit=1000, **kwargs)
+        try:
+            return await asyncio.gather(*(scheduler.query(*query) for query in queries), return_exceptions=True), scheduler
+        finally:
+            await scheduler.close()
+    return asyncio.run(run())
+
+def test_identical_queries_share_a_request():
+    igdb = FakeIgdb()
+    results, scheduler = run_queries(igdb, [('games', 'a'), ('games', 'a')])
+    assert results == [['a'], ['a']]
+    assert len(igdb.requests) == 1
+    assert scheduler.coalesced == 1
+
+def test_queries_arriving_together_share_a_multiquery():
+    igdb = FakeIgdb()
+    results, scheduler = run_queries(igdb, [('games', 'a'), ('platforms', 'b'), ('games', 'c')])
+    assert results == [['a'], ['b'], ['c']]
+    assert igdb.requests == [('multiquery', 'query games "0" { a };\nquery platforms "1" { b };\nquery games "2" { c };\n')]
+
+def test_multiquery_holds_at_most_ten_queries():
+    igdb = FakeIgdb()
+    results, scheduler = run_queries(igdb, [('games', str(i)) for i in range(15)])
+    assert results == [[str(i)] for i in range(15)]
+    assert [data.count('query ') for _, data in igdb.requests] == [10, 5]
+
+def test_query_after_idle_is_sent_without_waiting_for_the_window():
+    igdb = FakeIgdb()
+    started = time.monotonic()
+    results, scheduler = run_queries(igdb, [('games', 'a')], batch_window=5)
+    assert results == [['a']]
+    assert time.monotonic() - started < 1
+
+def test_rate_limited_queries_are_requeued():
+    igdb = FakeIgdb(failures=[429])
+    results, scheduler = run_queries(igdb, [('games', 'a'), ('games', 'b')])
+    assert results == [['a'], ['b']]
+    assert scheduler.rate_limited == 1
+    assert [endpoint for endpoint, _ in igdb.requests] == ['multiquery', 'multiquery']
+
+def test_rate_limit_retries_are_limited():
+    igdb = FakeIgdb(failures=[429, 429])
+    results, scheduler = run_queries(igdb, [('games', 'a')], max_retries=1)
+    assert isinstance(results[0], RuntimeError)
+    assert len(igdb.requests) == 2
+
+def test_rejected_multiquery_only_fails_the_bad_query():
+    igdb = FakeIgdb()
+    results, scheduler = run_queries(igdb, [('games', 'a'), ('games', 'bad'), ('games', 'c')])
+    assert results[0] == ['a'] and results[2] == ['c']
+    assert isinstance(results[1], aiohttp.ClientResponseError) and results[1].status == 400
+    assert [endpoint for endpoint, _ in igdb.requests] == ['multiquery', 'games', 'games', 'games']
+
+def test_search_text_is_escaped():
+    wrapper = IgdbWrapper('id', 'secret')
+    queries = []
+
+    async def query(endpoint, data):
+        queries.append(data)
+        return []
+    wrapper.scheduler.query = query
+    asyncio.run(wrapper.find_items_by_name(ItemType.game, 'a" } ; \\'))
+    assert queries == ['fields id,name,slug; sort first_release_date desc; limit 20; where name ~ *"a\\" } ; \\\\"*;']
+
+def run_repository(tmp_path, use):
+    async def run():
+        repository = ItemtagRepository(f'{tmp_path}/')
+        await repository.setup()
+        try:
+            return await use(repository)
+        finally:
+            await repository.close()
+    return asyncio.run(run())
+
+def game(id, name):
+    return Item(ItemType.game, id, name)
+
+def tag(id):
+    return SimpleNamespace(id=id)
+
+def test_concurrent_writes_share_a_transaction(tmp_path):
+    statements = []
+
+    async def use(repository):
+        connection = repository._ItemtagRepository__conn
+        await repository._ItemtagRepository__run(connection.set_trace_callback, statements.append)
+        return await asyncio.gather(*(repository.add_item(game(i, f'game {i}')) for i in range(5)))
+    assert run_repository(tmp_path, use) == [True] * 5
+    assert statements.count('BEGIN') == 1
+    assert statements.count('COMMIT') == 1
+
+def test_failing_write_keeps_its_batch(tmp_path):
+    async def use(repository):
+        results = await asyncio.gather(
+            repository.add_item(game(1, 'one')),
+            # no such game, the foreign key fails
+            repository.add_itemtag(Itemtag(game(2, 'two'), tag(20))),
+            repository.add_item(game(3, 'three')),
+            return_exceptions=True,
+        )
+        return results, await repository.check_consistency()
+    results, differences = run_repository(tmp_path, use)
+    assert results[0] is True and results[2] is True
+    assert isinstance(results[1], sqlite3.IntegrityError)
+    assert differences == []
+    connection = sqlite3.connect(tmp_path / 'gametag.db')
+    try:
+        assert connection.execute('SELECT id FROM games ORDER BY id').fetchall() == [(1,), (3,)]
+        assert connection.execute('SELECT id FROM tags').fetchall() == []
+    finally:
+        connection.close()
+
+def test_snapshot_follows_added_items_and_tags(tmp_path):
+    async def use(repository):
+        await repository.add_item(game(1, 'b'))
+        await repository.add_item(game(2, 'a'))
+        assert await repository.add_item(game(1, 'b')) is False
+        await repository.add_itemtag(Itemtag(game(1, 'b'), tag(10)))
+        assert await repository.find_item_by_tag(ItemType.game, tag(10)) == game(1, 'b')
+        itemtags = await repository.find_itemtags_by_tags(ItemType.game, [tag(10)], all=True)
+        assert [(itemtag.item.id, itemtag.tag and itemtag.tag.id) for itemtag in itemtags] == [(2, None), (1, 10)]
+        return await repository.check_consistency()
+    assert run_repository(tmp_path, use) == []
+
+def test_snapshot_drops_rows_replaced_by_a_tag(tmp_path):
+    async def use(repository):
+        await repository.add_item(game(1, 'one'))
+        await repository.add_item(game(2, 'two'))
+        await repository.add_itemtag(Itemtag(game(1, 'one'), tag(10)))
+        # retagging an item drops its old tag
+        await repository.add_itemtag(Itemtag(game(1, 'one'), tag(11)))
+        assert await repository.find_item_by_tag(ItemType.game, tag(10)) is None
+        assert await repository.check_consistency() == []
+        # moving a tag to another item drops it from the first one
+        await repository.add_itemtag(Itemtag(game(2, 'two'), tag(11)))
+        assert await repository.find_item_by_tag(ItemType.game, tag(11)) == game(2, 'two')
+        assert await repository.find_itemtags_by_tags(ItemType.game, [tag(10), tag(11)]) == [Itemtag(game(2, 'two'), tag(11))]
+        return await repository.check_consistency()
+    assert run_repository(tmp_path, use) == []
+
+def test_snapshot_is_reloaded_after_rows_are_removed(tmp_path):
+    async def use(repository):
+        await repository.add_item(game(1, 'one'))
+        await repository.add_itemtag(Itemtag(game(1, 'one'), tag(10)))
+        connection = sqlite3.connect(tmp_path / 'gametag.db')
+        try:
+            with connection:
+                connection.execute('DELETE FROM game_tags WHERE tag_id = 10')
+        finally:
+            connection.close()
+        assert await repository.check_consistency() != []
+        assert await repository.find_item_by_tag(ItemType.game, tag(10)) is None
+        return await repository.check_consistency()
+    assert run_repository(tmp_path, use) == []
+
+def role(id, name, position=1):
+    return SimpleNamespace(id=id, name=name, position=position)
+
+def test_role_trie_completes_in_name_order():
+    trie = RoleTrie()
+    for name, id in (('sf6', 1), ('sf5', 2), ('t8', 3), ('sf', 4)):
+        trie.add(name, role(id, name))
+    assert [r.id for r in trie.complete('sf')] == [4, 2, 1]
+    assert [r.id for r in trie.complete('sf', limit=2)] == [4, 2]
+    assert trie.complete('x') == []
+
+def test_role_trie_prunes_removed_names():
+    trie = RoleTrie()
+    trie.add('sf6', role(1, 'sf6'))
+    trie.add('sf', role(2, 'sf'))
+    trie.remove('sf6', role(1, 'sf6'))
+    assert [r.id for r in trie.complete('')] == [2]
+    assert list(trie.children['s'].children['f'].children) == []
+
+def test_tag_index_prefers_the_lowest_role_among_duplicates():
+    index = TagIndex([role(1, 'SF6', position=5), role(2, 'sf6', position=2), role(3, 'T8')])
+    assert index.get('Sf6').id == 2
+    assert index.get('sf6', among={1, 3}).id == 1
+    assert index.get('sf6', among={3}) is None
+    assert index.get('missing') is None
+    index.remove(role(2, 'sf6', position=2))
+    assert index.get('sf6').id == 1
+    assert [r.id for r in index.complete('s')] == [1]
+
+class FakePermissions:
+    def __init__(self, value=0):
+        self.value = value
+
+    def is_subset(self, other):
+        return self.value & ~other.value == 0
+
+class FakeRole:
+    def __init__(self, id, name, position=1, *, permissions=0, default=False, assignable=True):
+        self.id = id
+        self.name = name
+        self.position = position
+        self.permissions = FakePermissions(permissions)
+        self.default = default
+        self.assignable = assignable
+
+    def is_default(self):
+        return self.default
+
+    def is_assignable(self):
+        return self.assignable
+
+class FakeGuild:
+    def __init__(self, roles, members=()):
+        self.id = 1
+        self.roles = roles
+        self.members = list(members)
+        self.default_role = next(role for role in roles if role.default)
+
+@pytest.fixture
+def gametags():
+    return Gametags(None)
+
+def test_unavailable_duplicate_does_not_hide_an_available_tag(gametags):
+    guild = FakeGuild([
+        FakeRole(0, '@everyone', 0, default=True),
+        # above the bot's top role so the bot can't assign it
+        FakeRole(1, 'SF6', 1, assignable=False),
+        FakeRole(2, 'SF6', 2),
+    ])
+    selected_tags, unknown_tag_names = gametags._get_selected_tags(guild, ['sf6', 'T8'])
+    assert [tag.id for tag in selected_tags] == [2]
+    assert unknown_tag_names == ['T8']
+
+def test_available_tags_exclude_privileged_and_unassignable_roles(gametags):
+    guild = FakeGuild([
+        FakeRole(0, '@everyone', 0, permissions=0b011, default=True),
+        FakeRole(1, 'SF6', 1, permissions=0b001),
+        FakeRole(2, 'Mod', 2, permissions=0b111),
+        FakeRole(3, 'Booster', 3, assignable=False),
+        FakeRole(4, 'T8', 4),
+    ])
+    assert [role.id for role in gametags._filter_available_tags(guild)] == [1, 4]
+
+def test_stale_tag_pages_count_as_evictions(gametags):
+    guild = FakeGuild([FakeRole(0, '@everyone', 0, default=True), FakeRole(1, 'SF6', 1)])
+
+    async def list_twice():
+        await gametags._get_cached_pages(guild, ItemType.game)
+        await gametags._get_cached_pages(guild, ItemType.game)
+        gametags.repository.version += 1
+        await gametags._get_cached_pages(guild, ItemType.game)
+        await gametags.on_guild_remove(guild)
+    asyncio.run(list_twice())
+    stats = gametags.cache_stats()['tag pages']
+    assert (stats['size'], stats['hits'], stats['misses'], stats['evictions']) == (0, 1, 2, 2)
+
+SF6, T8, STRIVE = role(1, 'SF6'), role(2, 'T8'), role(3, 'Strive')
+
+def member(id, *roles):
+    return SimpleNamespace(id=id, roles=list(roles), name=f'player{id}', mention=f'<@{id}>')
+
+@pytest.fixture
+def players():
+    return [member(1, SF6), member(2, SF6, T8), member(3, T8, STRIVE), member(4)]
+
+def query(index, included=(), excluded=()):
+    query = PlayerQuery()
+    for group in included:
+        query.include([index.bits(role) for role in group])
+    query.exclude([index.bits(role) for role in excluded])
+    return query
+
+def ids(index, bits):
+    return [member.id for member in index.members(bits)]
+
+def test_player_query_ands_groups_and_ors_within_them(players):
+    index = PlayerIndex(players)
+    assert ids(index, index.evaluate(query(index, [[SF6], [T8]]))) == [2]
+    assert ids(index, index.evaluate(query(index, [[SF6, STRIVE]]))) == [1, 2, 3]
+    assert ids(index, index.evaluate(query(index, [[SF6, STRIVE], [T8]]))) == [2, 3]
+
+def test_player_query_excludes_players(players):
+    index = PlayerIndex(players)
+    assert ids(index, index.evaluate(query(index, [[SF6]], [T8]))) == [1]
+    assert index.count(query(index, [[SF6, T8]], [STRIVE, SF6])) == 0
+
+def test_player_query_without_included_tags_matches_nobody(players):
+    index = PlayerIndex(players)
+    assert index.evaluate(query(index, [], [T8])) == 0
+    assert index.evaluate(PlayerQuery()) == 0
+
+def test_player_index_follows_members(players):
+    index = PlayerIndex(players)
+    index.remove_member(players[0])
+    assert ids(index, index.bits(SF6)) == [2]
+    # the freed slot is reused
+    index.add_member(member(5, STRIVE))
+    assert ids(index, index.bits(STRIVE)) == [5, 3]
+    assert index.count(index.bits(SF6)) == 1
+    index.update_member(member(2, STRIVE), before_roles=[SF6, T8])
+    assert ids(index, index.bits(SF6)) == []
+    assert ids(index, index.bits(T8)) == [3]
+    assert ids(index, index.bits(STRIVE)) == [5, 2, 3]
+    index.remove_role(STRIVE)
+    assert index.bits(STRIVE) == 0
+
+class FakeContext:
+    def __init__(self, guild):
+        self.guild = guild
+        self.sent = []
+
+    async def send(self, content, **kwargs):
+        self.sent.append(content)
+
+def test_player_query_needs_an_included_tag(gametags, players):
+    roles = [FakeRole(0, '@everyone', 0, default=True), FakeRole(1, 'SF6', 1), FakeRole(2, 'T8', 2)]
+    ctx = FakeContext(FakeGuild(roles, players))
+    asyncio.run(gametags._query_players(ctx, ['-T8']))
+    assert ctx.sent == [Gametags.EXCLUDE_ONLY_QUERY]
+
+def test_player_query_results_go_through_the_message_sender(gametags, players):
+    pages = []
+
+    class FakeSender:
+        async def send_pages(self, ctx, sent_pages, **kwargs):
+            pages.extend(sent_pages)
+    gametags.bot = SimpleNamespace(message_sender=FakeSender())
+    roles = [FakeRole(0, '@everyone', 0, default=True), FakeRole(1, 'SF6', 1), FakeRole(2, 'T8', 2)]
+    ctx = FakeContext(FakeGuild(roles, players))
+    asyncio.run(gametags._query_players(ctx, ['SF6', '-T8']))
+    assert ctx.sent == []
+    assert [page.strip() for page in pages] == ["The following tags are matched by 1 player: *SF6*, not *T8*.\n<@1> (player1)"]
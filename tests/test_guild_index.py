@@ -0,0 +1,65 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from guild_index import GuildIndex
+
+class FakeGuild:
+    def __init__(self, channels=(), emojis=(), roles=()):
+        self.id = 1
+        self.channels = list(channels)
+        self.emojis = tuple(emojis)
+        self.roles = list(roles)
+
+    def get_channel(self, channel_id):
+        return next((channel for channel in self.channels if channel.id == channel_id), None)
+
+class FakeMember:
+    def __init__(self, guild, roles):
+        self.guild = guild
+        self.roles = roles
+
+    def get_role(self, role_id):
+        return next((role for role in self.roles if role.id == role_id), None)
+
+def item(id, name, guild=None):
+    return SimpleNamespace(id=id, name=name, guild=guild)
+
+@pytest.fixture
+def index():
+    return GuildIndex()
+
+def test_channel_is_resolved_by_name(index):
+    guild = FakeGuild(channels=[item(10, 'general'), item(11, 'mod')])
+    assert index.channel(guild, 'mod').id == 11
+    assert index.channel(guild, 'missing') is None
+
+def test_index_is_built_once(index):
+    guild = FakeGuild(channels=[item(10, 'general')])
+    index.channel(guild, 'general')
+    index.channel(guild, 'general')
+    assert index.builds == 1
+
+def test_renamed_channel_is_picked_up(index):
+    guild = FakeGuild(channels=[item(10, 'general')])
+    assert index.channel(guild, 'lobby') is None
+    before = item(10, 'general', guild)
+    guild.channels = [item(10, 'lobby', guild)]
+    asyncio.run(index.on_guild_channel_update(before, guild.channels[0]))
+    assert index.channel(guild, 'lobby').id == 10
+
+def test_emojis_are_replaced_on_update(index):
+    guild = FakeGuild(emojis=[item(20, 'quan')])
+    assert index.emoji(guild, 'quan').id == 20
+    guild.emojis = (item(21, 'quan'),)
+    asyncio.run(index.on_guild_emojis_update(guild, (), guild.emojis))
+    assert index.emoji(guild, 'quan').id == 21
+
+def test_member_role_matches_casefolded_name(index):
+    guild = FakeGuild(roles=[item(30, 'Superuser'), item(31, 'other')])
+    assert index.member_role(FakeMember(guild, [guild.roles[0]]), 'SUPERUSER').id == 30
+    assert index.member_role(FakeMember(guild, [guild.roles[1]]), 'superuser') is None
+
+def test_users_outside_guilds_have_no_roles(index):
+    assert index.member_role(SimpleNamespace(id=1), 'superuser') is None
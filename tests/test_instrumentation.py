@@ -0,0 +1,69 @@
+import asyncio
+
+import pytest
+
+from instrumentation import Histogram, Instrumentation, current_span, io_timer
+
+def test_percentiles_are_interpolated_within_buckets():
+    histogram = Histogram(buckets=(1.0, 2.0))
+    for value in (0.5, 1.5, 1.5, 1.5):
+        histogram.observe(value)
+    assert histogram.percentile(25) == pytest.approx(1.0)
+    assert histogram.percentile(100) == pytest.approx(2.0)
+    assert Histogram().percentile(50) == 0.0
+
+def test_io_is_attributed_to_current_span():
+    instrumentation = Instrumentation()
+
+    async def handler():
+        with io_timer():
+            await asyncio.sleep(0.01)
+        # tasks created by the handler count towards it as well
+        await asyncio.create_task(io())
+
+    async def io():
+        with io_timer():
+            await asyncio.sleep(0.01)
+
+    async def run():
+        async with instrumentation.measure('command:test'):
+            await handler()
+
+    asyncio.run(run())
+    metric = instrumentation.metrics['command:test']
+    assert metric.calls == 1
+    assert metric.io.sum >= 0.02
+    assert current_span.get() is None
+
+def test_timed_counts_errors():
+    instrumentation = Instrumentation()
+
+    @instrumentation.timed
+    async def on_message(fail):
+        if fail:
+            raise RuntimeError
+
+    asyncio.run(on_message(False))
+    with pytest.raises(RuntimeError):
+        asyncio.run(on_message(True))
+    [row] = instrumentation.report()
+    assert row['label'].startswith('listener:') and row['label'].endswith('on_message')
+    assert (row['calls'], row['errors']) == (2, 1)
+
+def test_prometheus_text():
+    instrumentation = Instrumentation()
+    span, token = instrumentation.start('command:list')
+    instrumentation.finish(span, token)
+    text = instrumentation.prometheus_text()
+    assert '# TYPE botemkin_duration_seconds histogram' in text
+    assert 'botemkin_duration_seconds_bucket{handler="command:list",le="+Inf"} 1' in text
+    assert 'botemkin_errors_total{handler="command:list"} 0' in text
+
+def test_observed_durations_are_reported():
+    instrumentation = Instrumentation()
+    for seconds in (0.2, 0.2, 0.2):
+        instrumentation.observe('translation:first_output', seconds)
+    row, = instrumentation.report()
+    assert (row['label'], row['calls'], row['errors']) == ('translation:first_output', 3, 0)
+    assert 0.1 < row['p50'] <= 0.25
+    assert row['io_share'] == 0.0
@@ -0,0 +1,43 @@
+import pytest
+
+from link_rewriter import LinkRewriter, RewriteRule
+
+@pytest.fixture
+def rewriter():
+    return LinkRewriter()
+
+@pytest.mark.parametrize(("input_text", "output"), [
+    pytest.param("https://www.instagram.com/reel/C8abc-12/?igsh=xyz",
+                 "https://ddinstagram.com/reel/C8abc-12",
+                 id="instagram_links_are_rewritten"),
+    pytest.param("https://www.tiktok.com/@some.user/video/7380000000000000000",
+                 "https://vxtiktok.com/@some.user/video/7380000000000000000",
+                 id="tiktok_links_are_rewritten"),
+    pytest.param("https://old.reddit.com/r/Guiltygear/comments/1abcde/title/",
+                 "https://rxddit.com/r/Guiltygear/comments/1abcde",
+                 id="reddit_links_are_rewritten"),
+    pytest.param("https://bsky.app/profile/someone.bsky.social/post/3kabc",
+                 "https://fxbsky.app/profile/someone.bsky.social/post/3kabc",
+                 id="bluesky_links_are_rewritten"),
+    pytest.param("https://X.com/test/status/123",
+                 "https://vxtwitter.com/test/status/123",
+                 id="domains_are_case_insensitive"),
+    pytest.param("https://x.com/test/status/123 https://bsky.app/profile/a.bsky.social/post/1",
+                 "https://vxtwitter.com/test/status/123 https://fxbsky.app/profile/a.bsky.social/post/1",
+                 id="links_of_different_sites_are_returned_in_order"),
+    pytest.param("https://ddinstagram.com/p/abc https://fxbsky.app/profile/a.bsky.social/post/1",
+                 None,
+                 id="already_fixed_links_of_any_site_are_ignored"),
+    pytest.param("https://ddinstagram.com/p/abc https://instagram.com/p/def",
+                 "https://ddinstagram.com/p/abc https://ddinstagram.com/p/def",
+                 id="fixed_links_are_kept_next_to_unfixed_ones"),
+    pytest.param("https://example.com/p/abc",
+                 None,
+                 id="unknown_sites_are_ignored"),
+])
+def test_default_rules(rewriter, input_text, output):
+    assert rewriter.rewrite(input_text) == output
+
+def test_custom_rules():
+    rewriter = LinkRewriter([RewriteRule(name='example', domains=['example.com'], path=r'[0-9]+', target='https://fixed.example.com/{path}')])
+    assert rewriter.rewrite("https://example.com/123 https://x.com/test/status/123") == "https://fixed.example.com/123"
@@ -0,0 +1,36 @@
+import asyncio
+import time
+
+from instrumentation import Instrumentation
+from loop_watchdog import LoopWatchdog
+
+def test_blocking_call_is_captured_and_attributed():
+    instrumentation = Instrumentation()
+    watchdog = LoopWatchdog(threshold=0.05, interval=0.01, instrumentation=instrumentation)
+
+    async def run():
+        watchdog.start()
+        await asyncio.sleep(0.05)
+        async with instrumentation.measure('command:slow'):
+            time.sleep(0.3)
+        await asyncio.sleep(0.05)
+        watchdog.stop()
+
+    asyncio.run(run())
+    [stall] = watchdog.stalls
+    assert stall.label == 'command:slow'
+    assert 'time.sleep(0.3)' in stall.stack[-1]
+    assert stall.duration >= 0.25
+    assert watchdog.stats()['max_lag_ms'] >= 250
+
+def test_no_stalls_when_loop_is_responsive():
+    watchdog = LoopWatchdog(threshold=0.05, interval=0.01)
+
+    async def run():
+        watchdog.start()
+        await asyncio.sleep(0.1)
+        watchdog.stop()
+
+    asyncio.run(run())
+    assert watchdog.stall_count == 0
+    assert watchdog.lag.count > 0
@@ -0,0 +1,47 @@
+import asyncio
+from types import SimpleNamespace
+
+from messaging import MessageSender, PageView, pack_embeds, pack_text
+
+class FakeContext:
+    def __init__(self):
+        self.channel = SimpleNamespace(id=10)
+        self.author = SimpleNamespace(id=1)
+        self.sent = []
+
+    async def send(self, **kwargs):
+        self.sent.append(kwargs)
+        return SimpleNamespace(id=len(self.sent))
+
+def test_pack_text_joins_pages_that_fit():
+    assert pack_text(["a" * 900, "b" * 900, "c" * 900]) == ["a" * 900 + "\n" + "b" * 900, "c" * 900]
+    assert pack_text(["a" * 5, "b" * 5, "c" * 5], limit=11) == ["aaaaa\nbbbbb", "ccccc"]
+
+def test_pack_embeds_respects_total_limit():
+    messages = pack_embeds(["a" * 1900] * 10)
+    assert all(sum(len(embed.description) for embed in embeds) <= 6000 for embeds in messages)
+    assert sum(len(embeds) for embeds in messages) < 10
+    assert "".join(embed.description for embeds in messages for embed in embeds).count("a") == 19000
+
+def test_single_message_stays_text():
+    ctx = FakeContext()
+    asyncio.run(MessageSender().send_pages(ctx, ["one", "two"]))
+    assert ctx.sent == [{'content': "one\ntwo"}]
+
+def test_long_output_is_paginated_in_one_message():
+    ctx = FakeContext()
+
+    async def run():
+        await MessageSender().send_pages(ctx, ["a" * 1900] * 10)
+
+    asyncio.run(run())
+    assert len(ctx.sent) == 1
+    assert isinstance(ctx.sent[0]['view'], PageView)
+    assert len(ctx.sent[0]['view'].pages) == 4
+
+def test_bursts_are_throttled():
+    ctx = FakeContext()
+    sender = MessageSender(rate=1000, capacity=2)
+    asyncio.run(sender.send_all(ctx, [{'content': str(i)} for i in range(5)]))
+    assert [kwargs['content'] for kwargs in ctx.sent] == ['0', '1', '2', '3', '4']
+    assert sender.throttled == 3
@@ -0,0 +1,130 @@
+import asyncio
+from types import SimpleNamespace
+
+import discord
+
+from onboarding import OnboardingPipeline, WelcomeMessageTracker
+
+GUILD = SimpleNamespace(id=1)
+
+def member(id):
+    return SimpleNamespace(id=id, guild=GUILD)
+
+class Recorder:
+    def __init__(self, failing_kicks=()):
+        self.calls = []
+        self.failing_kicks = failing_kicks
+
+    async def welcome(self, guild, members):
+        self.calls.append(('welcome', [m.id for m in members]))
+
+    async def notify(self, guild, lines):
+        self.calls.append(('notify', lines))
+
+    async def kick(self, member):
+        if member.id in self.failing_kicks:
+            raise RuntimeError("kick failed")
+        self.calls.append(('kick', member.id))
+
+def run_pipeline(recorder, submit, **kwargs):
+    async def run():
+        pipeline = OnboardingPipeline(welcome=recorder.welcome, notify=recorder.notify, kick=recorder.kick, **kwargs)
+        submit(pipeline)
+        await pipeline.flush()
+    asyncio.run(run())
+
+def test_actions_within_window_are_merged():
+    recorder = Recorder()
+
+    def submit(pipeline):
+        pipeline.welcome_member(member(1))
+        pipeline.kick_member(member(2), "kicked 2")
+        pipeline.welcome_member(member(3))
+        pipeline.notify_mods(GUILD, "old member 4")
+        pipeline.kick_member(member(5), "kicked 5")
+
+    run_pipeline(recorder, submit)
+    assert ('welcome', [1, 3]) in recorder.calls
+    assert recorder.calls[-1] == ('notify', ["old member 4", "kicked 2", "kicked 5"])
+    assert sorted(call for call in recorder.calls if call[0] == 'kick') == [('kick', 2), ('kick', 5)]
+
+def test_failed_kicks_are_not_reported():
+    recorder = Recorder(failing_kicks={2})
+    run_pipeline(recorder, lambda pipeline: pipeline.kick_member(member(2), "kicked 2"))
+    assert recorder.calls == []
+
+def test_full_batch_goes_out_without_waiting_for_window():
+    recorder = Recorder()
+
+    async def run():
+        pipeline = OnboardingPipeline(welcome=recorder.welcome, notify=recorder.notify, kick=recorder.kick, window=60, max_batch=2)
+        pipeline.welcome_member(member(1))
+        pipeline.welcome_member(member(2))
+        pipeline.welcome_member(member(3))
+        await asyncio.sleep(0.01)
+        assert recorder.calls == [('welcome', [1, 2])]
+        pipeline.close()
+
+    asyncio.run(run())
+
+def test_batch_goes_out_after_window():
+    recorder = Recorder()
+
+    async def run():
+        pipeline = OnboardingPipeline(welcome=recorder.welcome, notify=recorder.notify, kick=recorder.kick, window=0.01)
+        pipeline.welcome_member(member(1))
+        await asyncio.sleep(0.05)
+        assert recorder.calls == [('welcome', [1])]
+
+    asyncio.run(run())
+
+class WelcomeChannel:
+    """Home channel recording deleted messages."""
+
+    def __init__(self, history=()):
+        self.messages = list(history)
+        self.deleted = []
+
+    def message(self, id, author_id):
+        async def delete():
+            self.deleted.append(id)
+        return SimpleNamespace(id=id, type=discord.MessageType.new_member, author=SimpleNamespace(id=author_id),
+                               delete=delete)
+
+    def get_partial_message(self, id):
+        return self.message(id, None)
+
+    async def history(self, limit):
+        for message in self.messages[:limit]:
+            yield message
+
+def test_welcome_message_is_deleted_when_member_is_kicked():
+    channel = WelcomeChannel()
+    tracker = WelcomeMessageTracker()
+
+    async def run():
+        await tracker.track(channel.message(10, 1))
+        await tracker.delete(channel, member(1))
+    asyncio.run(run())
+    assert channel.deleted == [10]
+
+def test_welcome_message_of_already_kicked_member_is_deleted_when_posted():
+    channel = WelcomeChannel()
+    tracker = WelcomeMessageTracker()
+
+    async def run():
+        await tracker.delete(channel, member(1))
+        assert channel.deleted == []
+        await tracker.track(channel.message(10, 1))
+        # later welcomes of the member are left alone
+        await tracker.track(channel.message(11, 1))
+    asyncio.run(run())
+    assert channel.deleted == [10]
+
+def test_welcome_message_no_longer_tracked_is_found_in_history():
+    channel = WelcomeChannel()
+    channel.messages = [channel.message(11, 2), channel.message(10, 1)]
+    # e.g. posted before a restart or longer ago than the ttl
+    tracker = WelcomeMessageTracker()
+    asyncio.run(tracker.delete(channel, member(1)))
+    assert channel.deleted == [10]
@@ -0,0 +1,62 @@
+import asyncio
+import time
+
+import pytest
+
+from profiling import MemoryTracker, ProfilerBusy, profile_deterministic, profile_sampling
+
+def busy_loop(seconds):
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        pass
+
+async def keep_busy(seconds):
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        busy_loop(0.01)
+        await asyncio.sleep(0)
+
+def test_deterministic_profile_lists_functions_run_meanwhile():
+    async def run():
+        task = asyncio.create_task(keep_busy(0.1))
+        report = await profile_deterministic(0.1)
+        await task
+        return report
+
+    assert 'busy_loop' in asyncio.run(run())
+
+def test_sampling_profile_lists_functions_run_meanwhile():
+    async def run():
+        task = asyncio.create_task(keep_busy(0.2))
+        report = await profile_sampling(0.2, interval=0.001)
+        await task
+        return report
+
+    assert 'busy_loop' in asyncio.run(run())
+
+def test_memory_diff_shows_growth():
+    tracker = MemoryTracker()
+
+    async def run():
+        await tracker.start()
+        grown = [bytearray(1024) for _ in range(1000)]
+        report = await tracker.diff()
+        tracker.stop()
+        return grown, report
+
+    _, report = asyncio.run(run())
+    assert 'test_profiling.py' in report
+    assert not tracker.running
+
+def test_second_profiler_is_refused_right_away():
+    async def run():
+        first = asyncio.create_task(profile_deterministic(0.1))
+        await asyncio.sleep(0)
+        started = time.monotonic()
+        with pytest.raises(ProfilerBusy):
+            await profile_sampling(0.1)
+        refused_after = time.monotonic() - started
+        await first
+        return refused_after
+
+    assert asyncio.run(run()) < 0.05
@@ -1,3 +1,9 @@
+import asyncio
+import json
+import time
+from types import SimpleNamespace
+
+import discord
 import pytest
 
 from cogs import vxtwitter
@@ -38,3 +44,196 @@ def cog():
 ])
 def test_generate_vxtwitter_links(cog, input_text, output):
     assert cog.generate_vxtwitter_links(input_text) == output
+
+class NoApiBot:
+    """Fails the test on any lookup or API call."""
+    user = SimpleNamespace(id=1)
+
+    def __getattr__(self, name):
+        pytest.fail(f"bot.{name} used")
+
+def test_untracked_reactions_are_ignored_without_api_calls():
+    cog = vxtwitter.Vxtwitter(NoApiBot())
+    payload = SimpleNamespace(emoji=SimpleNamespace(name=vxtwitter.UNDO_EMOJI_NAME), user_id=2, message_id=123)
+    asyncio.run(cog.on_raw_reaction_add(payload))
+
+def test_deleted_replies_are_forgotten():
+    cog = vxtwitter.Vxtwitter(NoApiBot())
+    cog.replies.set(123, (100, 10, 2))
+    cog.replies_by_original.set(100, (123, "https://vxtwitter.com/test/status/1"))
+    asyncio.run(cog.on_raw_message_delete(SimpleNamespace(message_id=123, channel_id=10)))
+    assert 123 not in cog.replies
+    assert 100 not in cog.replies_by_original
+
+def test_channel_queue_coalesces_pending_actions():
+    calls = []
+
+    async def run():
+        queue = vxtwitter.ChannelQueue(interval=0)
+        for key, value in [(1, 'a'), (2, 'b'), (1, 'c')]:
+            queue.submit(10, key, lambda value=value: asyncio.sleep(0, calls.append(value)))
+        while queue.pending():
+            await asyncio.sleep(0)
+        await asyncio.sleep(0)
+
+    asyncio.run(run())
+    assert calls == ['c', 'b']
+
+def rate_limited(headers):
+    return discord.HTTPException(SimpleNamespace(status=429, reason='Too Many Requests', headers=headers), 'rate limited')
+
+@pytest.mark.parametrize(("headers", "pause"), [
+    pytest.param({'Retry-After': '0.2'}, 0.2, id="retry_after_header"),
+    pytest.param({}, 0.3, id="backoff_without_header"),
+])
+def test_channel_queue_backs_off_when_rate_limited(headers, pause):
+    started = []
+
+    async def action():
+        started.append(time.monotonic())
+        if len(started) == 1:
+            raise rate_limited(headers)
+
+    async def run():
+        queue = vxtwitter.ChannelQueue(interval=0, backoff=0.3)
+        queue.submit(10, 1, action)
+        queue.submit(10, 2, action)
+        while queue.pending() or len(started) < 2:
+            await asyncio.sleep(0.01)
+
+    asyncio.run(run())
+    assert pause <= started[1] - started[0] < pause + 0.1
+
+class FakeMessage:
+    """Records the API calls made through it."""
+
+    def __init__(self, id, content, calls):
+        self.id = id
+        self.content = content
+        self.calls = calls
+        self.author = SimpleNamespace(id=2)
+        self.channel = SimpleNamespace(id=10, get_partial_message=lambda id: FakeMessage(id, None, calls))
+
+    async def reply(self, content, **kwargs):
+        self.calls.append(('reply', self.id, content))
+        return FakeMessage(self.id + 1000, content, self.calls)
+
+    async def add_reaction(self, emoji):
+        self.calls.append(('react', self.id))
+
+    async def edit(self, **kwargs):
+        self.calls.append(('edit', self.id, kwargs))
+
+    async def delete(self):
+        self.calls.append(('delete', self.id))
+
+def test_sync_reply_follows_edits():
+    calls = []
+    cog = vxtwitter.Vxtwitter(NoApiBot())
+    message = FakeMessage(1, "https://x.com/test/status/123", calls)
+    asyncio.run(cog.sync_reply(message))
+    assert calls == [('reply', 1, "https://vxtwitter.com/test/status/123"), ('react', 1001), ('edit', 1, {'suppress': True})]
+
+    calls.clear()
+    message.content = "https://x.com/test/status/456"
+    asyncio.run(cog.sync_reply(message))
+    assert calls == [('edit', 1001, {'content': "https://vxtwitter.com/test/status/456"})]
+
+    calls.clear()
+    asyncio.run(cog.sync_reply(message))
+    assert calls == []
+
+    message.content = "never mind"
+    asyncio.run(cog.sync_reply(message))
+    assert calls == [('delete', 1001)]
+    assert 1001 not in cog.replies
+
+class RecordingQueue:
+    def __init__(self):
+        self.submitted = []
+
+    def submit(self, channel_id, key, action):
+        self.submitted.append(key)
+
+def edited(id, content, *, before=None, bot=False, type=discord.MessageType.default, edited_at=None):
+    message = SimpleNamespace(id=id, content=content, author=SimpleNamespace(bot=bot), type=type,
+                              channel=SimpleNamespace(id=10), edited_at=edited_at)
+    cached = None if before is None else SimpleNamespace(id=id, content=before)
+    return SimpleNamespace(message=message, cached_message=cached)
+
+@pytest.mark.parametrize(("payload", "submitted"), [
+    pytest.param(edited(1, "https://x.com/test/status/1", before="https://x.com/user/status/2"), [1],
+                 id="changed_links"),
+    pytest.param(edited(1, "https://x.com/test/status/1 nice", before="https://x.com/test/status/1"), [],
+                 id="same_links"),
+    pytest.param(edited(1, "https://x.com/test/status/1", before="https://x.com/test/status/1"), [],
+                 id="embeds_resolved"),
+    pytest.param(edited(1, "https://x.com/test/status/1", edited_at=1), [1],
+                 id="uncached_edit"),
+    pytest.param(edited(1, "https://x.com/test/status/1"), [],
+                 id="uncached_embeds_resolved"),
+    pytest.param(edited(1, "https://x.com/test/status/1", before="", bot=True), [],
+                 id="bot"),
+    pytest.param(edited(1, "https://x.com/test/status/1", before="", type=discord.MessageType.pins_add), [],
+                 id="system_message"),
+    pytest.param(edited(1, "no links", before="https://x.com/test/status/1"), [],
+                 id="links_removed_without_reply"),
+])
+def test_raw_message_edits_resync_replies(payload, submitted):
+    cog = vxtwitter.Vxtwitter(NoApiBot())
+    cog.reply_queue = RecordingQueue()
+    asyncio.run(cog.on_raw_message_edit(payload))
+    assert cog.reply_queue.submitted == submitted
+
+class UndoBot:
+    """Serves an uncached original message and its reply for undoing."""
+    user = SimpleNamespace(id=1)
+    cached_messages = []
+
+    def __init__(self, original):
+        self.original = original
+
+    def get_channel(self, id):
+        return self.original.channel
+
+def test_undone_replies_are_not_posted_again():
+    calls = []
+    original = FakeMessage(1, "https://x.com/test/status/123", calls)
+
+    async def fetch_message(id):
+        return original
+    original.channel.fetch_message = fetch_message
+    cog = vxtwitter.Vxtwitter(UndoBot(original))
+    asyncio.run(cog.sync_reply(original))
+    calls.clear()
+
+    payload = SimpleNamespace(emoji=SimpleNamespace(name=vxtwitter.UNDO_EMOJI_NAME), user_id=2, message_id=1001)
+    asyncio.run(cog.on_raw_reaction_add(payload))
+    assert calls == [('edit', 1, {'suppress': False}), ('delete', 1001)]
+    # restoring the embeds of the uncached original comes back as an edit of a previously edited message
+    cog.reply_queue = RecordingQueue()
+    asyncio.run(cog.on_raw_message_edit(edited(1, "https://x.com/test/status/123", edited_at=1)))
+    assert cog.reply_queue.submitted == []
+    # new links are still followed
+    asyncio.run(cog.on_raw_message_edit(edited(1, "https://x.com/test/status/456", edited_at=2)))
+    assert cog.reply_queue.submitted == [1]
+
+def test_tracked_replies_are_saved_periodically(tmp_path):
+    path = tmp_path / 'replies.json'
+    cog = vxtwitter.Vxtwitter(NoApiBot(), tracked_replies_path=path, tracked_replies_save_interval=0.01)
+
+    async def run():
+        await cog.cog_load()
+        await asyncio.sleep(0.05)
+        # nothing new, nothing written
+        assert not path.exists()
+        message = SimpleNamespace(id=10, channel=SimpleNamespace(id=20), author=SimpleNamespace(id=30))
+        cog.track_reply(SimpleNamespace(id=40), message, 'https://vxtwitter.com/test/status/1')
+        await asyncio.sleep(0.05)
+        assert cog.unsaved_replies == 0
+        assert not path.with_name(path.name + '.tmp').exists()
+        saved = json.loads(path.read_text(encoding='utf-8'))
+        await cog.cog_unload()
+        return saved
+    saved = asyncio.run(run())
+    assert [(key, value) for key, _, value in saved] == [(40, [10, 20, 30])]
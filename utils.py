@@ -1,20 +1,17 @@
-import discord
 from discord.ext import commands
 
 from config import SUPERUSER_ROLE
 
 def superuser_only():
     async def predicate(ctx):
-        su_role = discord.utils.find(
-            lambda role: role.name.casefold() == SUPERUSER_ROLE.casefold(), ctx.author.roles)
+        su_role = ctx.bot.guild_index.member_role(ctx.author, SUPERUSER_ROLE)
         if su_role is None:
             raise commands.CheckFailure(f"This command is only available to {SUPERUSER_ROLE} role.")
         return True
     return commands.check(predicate)
 
 async def superuser_cog_check(ctx):
-    su_role = discord.utils.find(
-        lambda role: role.name.casefold() == SUPERUSER_ROLE.casefold(), ctx.author.roles)
+    su_role = ctx.bot.guild_index.member_role(ctx.author, SUPERUSER_ROLE)
     if su_role is None:
         return False
     return True
\ No newline at end of file